@@ -0,0 +1,156 @@
+"""
+    annotationDataset.py
+"""
+
+from collections import OrderedDict
+from collections.abc import Sequence
+
+from image import Image
+from boundingBox import BoundingBox
+
+
+class AnnotationDataset(Sequence):
+    """
+        A lazily built list of image objects. Only a path table is held up front, images and their bounding
+        boxes are materialised a page at a time when accessed and pages that are not touched again are evicted.
+    """
+    PAGE_SIZE = 256
+    MAX_PAGES = 16  # pages of images kept materialised at once
+
+    def __init__(self, imagePaths: list, loadAnnotations, createBoundingBoxes) -> None:
+        """
+            init
+            loadAnnotations(start, stop) returns the stored annotations of images start:stop, one entry per image
+            createBoundingBoxes(entry) turns one of those entries into the image's bounding boxes
+        """
+        self.imagePaths = imagePaths
+        self.loadAnnotations = loadAnnotations
+        self.createBoundingBoxes = createBoundingBoxes
+
+        self.pages = OrderedDict()  # page number -> list of images, least recently used first
+        self.modifiedAnnotations = {}  # image index -> box records of images edited since the project was loaded
+        self.imageFlags = {}  # image index -> {flag name: value} of flags set on images, such as isValid and needsWork
+        self.annotatedFlags = {}  # page number -> bytearray of annotated state per image
+        self.imageStore = None  # shared image store images are read from, if the project uses one
+        self.imageDigest = None  # imageDigest(index) returns an image's content hash, used with the store
+        self.imageMetadata = None  # imageMetadata(index) returns (height, width, channels, valid) if already known
+
+    def __len__(self) -> int:
+        return len(self.imagePaths)
+
+    def __getitem__(self, index: int) -> Image:
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.__page(index // self.PAGE_SIZE)[index % self.PAGE_SIZE]
+
+    def append(self, imagePath: str) -> int:
+        """ Adds an image to the end of the dataset, returns its index """
+        self.imagePaths.append(imagePath)
+        # the last page may now be missing an image so drop it to be rebuilt
+        pageNumber = (len(self) - 1) // self.PAGE_SIZE
+        self.pages.pop(pageNumber, None)
+        self.annotatedFlags.pop(pageNumber, None)
+        return len(self) - 1
+
+    def invalidate(self, indexes: list) -> None:
+        """ Drops the materialised images at indexes, and their annotated state, so they are rebuilt when next accessed """
+        for index in indexes:
+            self.pages.pop(index // self.PAGE_SIZE, None)
+            self.annotatedFlags.pop(index // self.PAGE_SIZE, None)
+            # validity is worked out again for the image as it now is, other flags stay
+            self.imageFlags.get(index, {}).pop("isValid", None)
+
+    def refreshMetadata(self) -> None:
+        """ Fills in the metadata of materialised images that have not worked it out themselves """
+        for page in self.pages.values():
+            for image in page:
+                if not image.metadataCreated:
+                    self.__applyMetadata(image)
+
+    def updateAnnotations(self, index: int, records: list) -> None:
+        """ Stores the edited boxes of an image so they survive its page being evicted """
+        self.modifiedAnnotations[index] = records
+        flags = self.annotatedFlags.get(index // self.PAGE_SIZE)
+        if flags is not None:
+            flags[index % self.PAGE_SIZE] = len(records) > 0
+
+    def imageFlag(self, index: int, name: str, default: bool) -> bool:
+        """ Returns a flag set on an image, default if it was never set """
+        return self.imageFlags.get(index, {}).get(name, default)
+
+    def setImageFlag(self, index: int, name: str, value: bool) -> None:
+        """ Sets a flag on an image, kept here so it survives the image's page being evicted """
+        self.imageFlags.setdefault(index, {})[name] = value
+
+    def isAnnotated(self, index: int) -> bool:
+        """ Returns the annotated state of an image without materialising it """
+        pageNumber = index // self.PAGE_SIZE
+        flags = self.annotatedFlags.get(pageNumber)
+        if flags is None:
+            start, stop = self.__pageRange(pageNumber)
+            entries = self.loadAnnotations(start, stop)
+            flags = bytearray(len(self.modifiedAnnotations.get(start + offset, entry)) > 0
+                              for offset, entry in enumerate(entries))
+            self.annotatedFlags[pageNumber] = flags
+        return bool(flags[index % self.PAGE_SIZE])
+
+    def iterBoundingBoxes(self):
+        """ Yields (index, path, bounding boxes) for every image without materialising image objects """
+        for pageNumber in range((len(self) + self.PAGE_SIZE - 1) // self.PAGE_SIZE):
+            start, stop = self.__pageRange(pageNumber)
+            page = self.pages.get(pageNumber)
+            if page is not None:
+                for image in page:
+                    yield image.index, image.path, image.boundingBoxes
+                continue
+
+            for offset, entry in enumerate(self.loadAnnotations(start, stop)):
+                index = start + offset
+                yield index, self.imagePaths[index], self.__boundingBoxes(index, entry)
+
+    def __page(self, pageNumber: int) -> list:
+        """ Returns a page of images, materialising it and evicting the least recently used page if needed """
+        page = self.pages.get(pageNumber)
+        if page is not None:
+            self.pages.move_to_end(pageNumber)
+            return page
+
+        start, stop = self.__pageRange(pageNumber)
+        page = []
+        for offset, entry in enumerate(self.loadAnnotations(start, stop)):
+            index = start + offset
+            image = Image(self.imagePaths[index], self.__boundingBoxes(index, entry))
+            image.index = index
+            image.dataset = self
+            if self.imageStore is not None:
+                image.imageStore = self.imageStore
+                image.digest = self.imageDigest(index)
+            self.__applyMetadata(image)
+            page.append(image)
+
+        self.pages[pageNumber] = page
+        while len(self.pages) > self.MAX_PAGES:
+            self.pages.popitem(last=False)
+        return page
+
+    def __applyMetadata(self, image: Image) -> None:
+        """ Sets an image's metadata from what is already known, invalid images are marked before they are viewed """
+        metadata = self.imageMetadata(image.index) if self.imageMetadata is not None else None
+        if metadata is None:
+            return
+        image.height, image.width, image.channels, image.isValid = metadata
+        image.metadataCreated = True
+
+    def __pageRange(self, pageNumber: int) -> tuple:
+        """ Returns the image indexes covered by a page """
+        start = pageNumber * self.PAGE_SIZE
+        return start, min(start + self.PAGE_SIZE, len(self))
+
+    def __boundingBoxes(self, index: int, entry):
+        """ Returns an image's bounding boxes, preferring any edits over what is stored """
+        records = self.modifiedAnnotations.get(index)
+        if records is not None:
+            return [BoundingBox.fromRecord(record) for record in records]
+        return self.createBoundingBoxes(entry)
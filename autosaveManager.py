@@ -0,0 +1,98 @@
+"""
+    autosaveManager.py
+    Periodically saves the changed parts of the open project on a worker thread
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6 import QtCore
+
+
+class AutosaveManager(QtCore.QObject):
+    """
+        Snapshots whatever is dirty in the open project on a timer and writes it out in the background,
+        so the UI never blocks on disk and a crash loses at most one autosave interval.
+    """
+    AUTOSAVE_INTERVAL = 30 * 1000  # ms between autosaves
+
+    shardsRead = QtCore.pyqtSignal(object, object)  # project, changes read by Project.readShardChanges
+
+    def __init__(self, app) -> None:
+        """ init """
+        super().__init__()
+        self.app = app
+        # A single worker keeps saves in the order they were snapshotted
+        self.executor = ThreadPoolExecutor(max_workers=1)
+        self.pendingSave = None
+        self.reportedUnsavedCount = 0  # changes waiting on leased shards when the user was last told about them
+        # shards are read on the worker and swapped in on the GUI thread, which owns the project's annotations
+        self.shardsRead.connect(self.__applyShardChanges)
+
+        self.timer = QtCore.QTimer()
+        self.timer.timeout.connect(self.autosave)
+        self.timer.start(self.AUTOSAVE_INTERVAL)
+
+    def autosave(self):
+        """ Snapshots the dirty parts of the project on the calling thread and writes them out on the worker """
+        project = self.app.project
+        if not project:
+            return None
+        # leases on shards are kept alive on the same timer, other annotators' shards are picked up with them.
+        # The worker renews them ahead of the write below, so the write goes to shards that are still held
+        if project.shardStore:
+            self.pendingSave = self.executor.submit(self.__readShardChanges, project)
+        self.__reportUnsavedChanges(project)
+        if not project.isDirty():
+            return None
+
+        # The snapshot is taken here so the worker never reads state the UI is still editing
+        snapshot = project.takeDirtySnapshot()
+        self.pendingSave = self.executor.submit(self.__writeSnapshot, project, snapshot)
+        return self.pendingSave
+
+    def flush(self) -> None:
+        """ Saves anything still dirty and blocks until every write has finished """
+        save = self.autosave()
+        if save is None:
+            save = self.pendingSave
+        if save is not None:
+            save.result()
+        if self.app.project and self.app.project.journal:
+            self.app.project.journal.waitForCompaction()
+
+    def stop(self) -> None:
+        """ Stops autosaving, flushing any pending write first """
+        self.timer.stop()
+        self.flush()
+        self.executor.shutdown(wait=True)
+
+    def __reportUnsavedChanges(self, project) -> None:
+        """ Tells the user when changes start waiting on, or grow behind, shards other annotators hold """
+        unsavedCount = project.unsavedAnnotationCount
+        if unsavedCount > self.reportedUnsavedCount:
+            self.app.notificationManager.raiseNotification(f"{unsavedCount} annotation changes are waiting to be saved, "
+                                                           f"another annotator holds their images")
+        self.reportedUnsavedCount = unsavedCount
+
+    def __readShardChanges(self, project) -> None:
+        """ Worker that reads what other annotators changed and hands it to the GUI thread """
+        changes = project.readShardChanges()
+        if changes:
+            self.shardsRead.emit(project, changes)
+
+    def __applyShardChanges(self, project, changes: dict) -> None:
+        """ Swaps in the shards read on the worker, unless the project was closed in the meantime """
+        if project is not self.app.project:
+            return
+        lostShards = project.applyShardChanges(changes)
+        if lostShards:
+            self.app.notificationManager.raiseNotification(f"Another annotator took over {len(lostShards)} annotation shards, "
+                                                           f"changes to their images are kept and saved once they are free")
+
+    def __writeSnapshot(self, project, snapshot: dict) -> None:
+        """ Worker that writes a snapshot out to disk """
+        try:
+            project.writeSnapshot(snapshot)
+            self.app.recentProjects.update(project)
+        except Exception as exc:
+            print(exc)
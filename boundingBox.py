@@ -15,3 +15,17 @@ class BoundingBox():
         self.colour = colour  #TODO: in the future this should be a class label which is then mapped to a colour
         self.className = className  #TODO: this class should be renamed to annotation.py as it is more representative
 
+    def toRecord(self) -> list:
+        """ Returns the bounding box as the list stored in the annotations file """
+        return [self.x, self.y, self.width, self.height, list(self.colour.getRgb()), self.className, self.id]
+
+    @staticmethod
+    def fromRecord(record: list) -> "BoundingBox":
+        """ Creates a bounding box from a list stored in the annotations file """
+        return BoundingBox(record[0],
+                           record[1],
+                           record[2],
+                           record[3],
+                           QColor(record[4][0], record[4][1], record[4][2], record[4][3]),
+                           record[5],
+                           int(record[6]))
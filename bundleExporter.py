@@ -0,0 +1,50 @@
+"""
+    bundleExporter.py
+    Exports a project as a bundle on a worker thread so the UI stays responsive
+"""
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from project import LoadPhases, LoadCancelled
+
+
+class BundleExporter(QThread):
+    """
+        Writes a project bundle off the GUI thread. The bundle is written alongside its path and only swapped
+        in once complete, so a failed or cancelled export leaves any earlier bundle as it was.
+    """
+    progress = pyqtSignal(object, int, int)  # LoadPhases, done, total (0 when unknown)
+    exported = pyqtSignal(str)  # path of the bundle written
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, project, bundlePath: str, includeImages: bool = False) -> None:
+        """ init """
+        super().__init__()
+        self.project = project
+        self.bundlePath = bundlePath
+        self.includeImages = includeImages
+        self.cancelRequested = False
+
+    def cancel(self) -> None:
+        """ Requests the export stops at the next progress report """
+        self.cancelRequested = True
+
+    def run(self) -> None:
+        """ Worker """
+        try:
+            self.project.exportBundle(self.bundlePath, self.includeImages, progressCallback=self.__reportProgress)
+        except LoadCancelled:
+            self.cancelled.emit()
+            return
+        except Exception as exc:
+            print(exc)
+            self.failed.emit(str(exc))
+            return
+        self.exported.emit(self.bundlePath)
+
+    def __reportProgress(self, phase: LoadPhases, done: int, total: int) -> None:
+        """ Forwards progress to the GUI thread and stops exporting if cancelled """
+        if self.cancelRequested:
+            raise LoadCancelled()
+        self.progress.emit(phase, done, total)
@@ -2,14 +2,16 @@
     annotationCanvas.py
 """
 
-from pathlib import Path
-from PyQt6.QtCore import Qt, pyqtSignal as Signal
+from PyQt6.QtCore import Qt, QBuffer, QRectF, QSize, pyqtSignal as Signal
 from PyQt6.QtGui import QPixmap, QColor, QPen
 from PyQt6.QtWidgets import QGraphicsView, QGraphicsScene, QGraphicsPixmapItem, QGraphicsItem
 
 from boundingBox import BoundingBox
+from storage.shardedStore import AnnotationIDsExhausted
+from dataset.imageSource import readImageRange, probeImage, HEADER_SIZE
 from pages.annotationPage import Tools
 from custom_widgets.annotation_canvas.customRectangleGraphicsItem import CustomRectangleGraphicsItem
+from custom_widgets.annotation_canvas.imagePrefetcher import ImagePrefetcher, fitScale, imageReader, REDUCTIONS, REDUCED_FORMATS
 
 
 class AnnotationCanvas(QGraphicsView):
@@ -17,6 +19,12 @@ class AnnotationCanvas(QGraphicsView):
     # Signals
     new_annotation = Signal(BoundingBox)
     annotationSelectedSignal = Signal(str, int)
+    imageDecodeFailed = Signal(object)  # image shown that was read but would not decode
+
+    ZOOM_STEP = 1.25  # zoom per wheel notch
+    MIN_ZOOM = 0.25
+    MAX_ZOOM = 32
+    THUMBNAIL_SIZE = 256  # longest side of the thumbnails kept in the image store
 
     def __init__(self, parent):
         super(AnnotationCanvas, self).__init__(parent)
@@ -29,6 +37,12 @@ class AnnotationCanvas(QGraphicsView):
         self.rectEnd = None
         self.imagePath = None
         self.rects = []  # QGraphicsRectItem list of bounding boxes
+        self.prefetcher = ImagePrefetcher()  # decodes the images likely to be shown next
+        self.displayScale = 1  # image pixels per scene unit, large images are shown reduced
+        self.pixmapScale = 1  # image pixels per pixel of the pixmap shown, drops to 1 once zoomed in
+        self.zoom = 1
+        self.awaitedPath = None  # image whose decodes are still to replace the preview shown
+        self.sizeProbed = False  # scene laid out from probed dimensions, which are checked against the decode
 
         # Annotation canvas attributes
         self.mode = Tools.mouseTool
@@ -37,6 +51,7 @@ class AnnotationCanvas(QGraphicsView):
 
         # Setting alignment
         self.setAlignment(Qt.AlignmentFlag.AlignLeft | Qt.AlignmentFlag.AlignTop)
+        self.setTransformationAnchor(QGraphicsView.ViewportAnchor.AnchorUnderMouse)
 
         # Creating the graphics scene
         self.scene = QGraphicsScene()
@@ -51,25 +66,133 @@ class AnnotationCanvas(QGraphicsView):
         self.scene.addItem(self.imageItem)
         
         self.setScene(self.scene)
+
+        # Swapping in images as they are decoded in the background
+        self.prefetcher.imageDecoded.connect(self.__onImageDecoded)
+        self.prefetcher.decodeFailed.connect(self.__onDecodeFailed)
     
     def updateImage(self, image) -> None:
         """ Updates the image currently being shown as a QGraphicsPixmapItem """
         # Set up for new image
         self.image = image
         
-        # Setup for new image
-        if not Path(self.image.path).is_file():
-            return
-        self.imagePixmap = QPixmap(image.path)
+        # Setup for new image, usually already decoded by the prefetcher, reduced to fit the view
+        self.awaitedPath = None
+        self.sizeProbed = False
+        dataPath = self.image.dataPath()
+        decoded = self.prefetcher.pixmap(dataPath)
+        if decoded is not None:
+            self.imagePixmap, self.pixmapScale = decoded
+            self.displayScale = self.pixmapScale
+            imageRect = QRectF(self.imagePixmap.rect())
+        else:
+            # otherwise the scene is laid out from the image's header and a preview shown straight away, which is
+            # replaced once the image is decoded in the background
+            header = readImageRange(dataPath, 0, HEADER_SIZE)
+            if header is None:
+                return
+            reader = imageReader(header)
+            size = reader.size()
+            if not size.isValid():
+                # qt gives up on a header that does not hold the size, e.g. behind a large exif segment
+                dimensions = probeImage(dataPath)
+                size = QSize(*dimensions) if dimensions is not None else QSize(0, 0)  # not an image qt can read
+                self.sizeProbed = dimensions is not None
+            self.displayScale = fitScale(size, self.viewport().size())
+            imageRect = QRectF(0, 0, size.width() / self.displayScale, size.height() / self.displayScale)
+            self.imagePixmap, self.pixmapScale = self.__preview(dataPath, size)
+            if self.pixmapScale > self.displayScale:
+                self.awaitedPath = dataPath
+                # jpegs decode quickly at the greatest reduction, that goes ahead of everything queued on the pool
+                if self.pixmapScale > REDUCTIONS[-1] > self.displayScale and reader.format() in REDUCED_FORMATS:
+                    self.prefetcher.decode(dataPath, REDUCTIONS[-1])
+                self.prefetcher.prefetch([dataPath])
+        # the scene is laid out in the pixels of the reduced image, boxes are scaled in and out of it
+        self.zoom = 1
+        self.resetTransform()
         
         # Clear working rects
         self.rects = []
 
         # Create rectangles from bounding boxes
         for boundingBox in self.image.boundingBoxes:
-            self.createRect(boundingBox.x, boundingBox.y, boundingBox.width, boundingBox.height, boundingBox.colour, boundingBox.className, boundingBox.id, True, True, True)
+            self.createRect(boundingBox.x / self.displayScale, boundingBox.y / self.displayScale,
+                            boundingBox.width / self.displayScale, boundingBox.height / self.displayScale,
+                            boundingBox.colour, boundingBox.className, boundingBox.id, True, True, True)
 
         self.resetScene()
+        self.scene.setSceneRect(imageRect)
+
+    def __preview(self, dataPath: str, size: QSize) -> tuple:
+        """
+            Returns (pixmap, scale) to show while an image is decoded, its thumbnail from the image store or a
+            decode at the greatest reduction left from an earlier visit. An empty pixmap if there is neither.
+        """
+        if self.image.imageStore is not None and self.image.digest is not None:
+            thumbnail = self.image.imageStore.thumbnail(self.image.digest)
+            if thumbnail is not None and size.isValid():
+                pixmap = QPixmap()
+                if pixmap.loadFromData(thumbnail) and pixmap.width() > 0:
+                    return pixmap, size.width() / pixmap.width()
+        decoded = self.prefetcher.pixmap(dataPath, REDUCTIONS[-1])
+        if decoded is not None:
+            return decoded
+        return QPixmap(), REDUCTIONS[-1] + 1  # nothing to show, any decode replaces it
+
+    def __onImageDecoded(self, dataPath: str) -> None:
+        """ Swaps an image decoded in the background in for its preview, the boxes and selection are left alone """
+        if dataPath != self.awaitedPath:
+            return
+        # full resolution is only wanted while zoomed in, it may still be cached from an earlier visit
+        scales = (None, REDUCTIONS[-1], 1) if self.zoom > 1 else (None, REDUCTIONS[-1])
+        decodes = [decoded for decoded in (self.prefetcher.pixmap(dataPath, scale) for scale in scales) if decoded is not None]
+        decoded = min(decodes, key=lambda decoded: decoded[1], default=None)
+        if decoded is None or decoded[1] >= self.pixmapScale:
+            return
+        self.__showPixmap(*decoded)
+        if self.sizeProbed:
+            # probed dimensions follow exif orientation, which qt does not apply when decoding
+            self.sizeProbed = False
+            pixmap, scale = decoded
+            self.scene.setSceneRect(QRectF(0, 0, pixmap.width() * scale / self.displayScale, pixmap.height() * scale / self.displayScale))
+        self.__storeThumbnail()
+
+    def __onDecodeFailed(self, dataPath: str) -> None:
+        """ Passes on a failure to decode the image shown """
+        if self.image is not None and dataPath == self.image.dataPath():
+            self.imageDecodeFailed.emit(self.image)
+
+    def __showPixmap(self, pixmap: QPixmap, scale: float) -> None:
+        """ Replaces the pixmap shown with one of the same image at another scale """
+        self.imagePixmap, self.pixmapScale = pixmap, scale
+        self.imageItem.setPixmap(self.imagePixmap)
+        self.imageItem.setScale(self.pixmapScale / self.displayScale)
+
+    def __storeThumbnail(self) -> None:
+        """ Keeps a thumbnail of the image shown in the image store, so it can be previewed next time """
+        imageStore = self.image.imageStore
+        if imageStore is None or self.image.digest is None or imageStore.thumbnail(self.image.digest) is not None:
+            return
+        thumbnail = self.imagePixmap.toImage().scaled(self.THUMBNAIL_SIZE, self.THUMBNAIL_SIZE, Qt.AspectRatioMode.KeepAspectRatio,
+                                                      Qt.TransformationMode.SmoothTransformation)
+        buffer = QBuffer()
+        buffer.open(QBuffer.OpenModeFlag.WriteOnly)
+        if thumbnail.save(buffer, "JPG", 85):
+            imageStore.putThumbnail(self.image.digest, bytes(buffer.data()))
+
+    def showFullResolution(self) -> None:
+        """
+            Has the image shown decoded at full resolution in the background, it is swapped in for the reduced
+            image once decoded, scaled into the same scene
+        """
+        if self.image is None or self.pixmapScale == 1:
+            return
+        self.awaitedPath = self.image.dataPath()
+        decoded = self.prefetcher.pixmap(self.awaitedPath, 1)
+        if decoded is not None:
+            self.__showPixmap(*decoded)
+            return
+        self.prefetcher.decode(self.awaitedPath, 1)
 
     def resetScene(self):
         """ Resets the scene environment """
@@ -82,23 +205,32 @@ class AnnotationCanvas(QGraphicsView):
         # Adding the image item back immediately after clearing
         self.imageItem = QGraphicsPixmapItem(self.imagePixmap)
         self.imageItem.setZValue(-1)  # Make sure that this is always on the lowest z value
+        self.imageItem.setScale(self.pixmapScale / self.displayScale)
+        self.imageItem.setTransformationMode(Qt.TransformationMode.SmoothTransformation)
         self.scene.addItem(self.imageItem)
     
     def generateBoundingBoxes(self) -> None:
         """ Loops through all of the rectangles and stores bounding boxes. Update respective image object """
         if not self.image:
             return
-        boundingBoxes = []
-        for rect in self.rects:
-            boundingBox = BoundingBox(rect.x() + rect.rect().x(),
-                                      rect.y() + rect.rect().y(),
-                                      rect.rect().width(),
-                                      rect.rect().height(),
-                                      rect.classColour,
-                                      rect.className,
-                                      rect.id)
-            boundingBoxes.append(boundingBox)
-        self.image.updateBoundingBoxes(boundingBoxes)
+        boundingBoxes = [self.__boundingBox(rect) for rect in self.rects]
+        if not self.app.project.updateImageAnnotations(self.image, boundingBoxes):
+            # the project is read-only or another annotator holds this image's shard, put its boxes back as they were
+            if self.app.project.readOnly:
+                self.app.notificationManager.raiseNotification("This project was opened read-only from a bundle")
+            else:
+                self.app.notificationManager.raiseNotification(f"This image is being annotated by {self.app.project.imageLeaseHolder(self.image.index)}")
+            self.updateImage(self.image)
+
+    def __boundingBox(self, rect) -> BoundingBox:
+        """ Returns the bounding box of a rectangle in the pixels of the original image """
+        return BoundingBox((rect.x() + rect.rect().x()) * self.displayScale,
+                           (rect.y() + rect.rect().y()) * self.displayScale,
+                           rect.rect().width() * self.displayScale,
+                           rect.rect().height() * self.displayScale,
+                           rect.classColour,
+                           rect.className,
+                           rect.id)
 
     def createRect(self, x: float, y: float, width: float, height: float, colour, className: str, id: int, store: bool, reload: bool, load: bool):
         """ Creates a rectangle based on mouse location and adds the rectangle to the scene """
@@ -112,13 +244,7 @@ class AnnotationCanvas(QGraphicsView):
             self.rects.append(rect)
             if not load:
                 # Dont emit new annotation when loading existing annotations
-                self.new_annotation.emit(BoundingBox(rect.x() + rect.rect().x(),
-                                          rect.y() + rect.rect().y(),
-                                          rect.rect().width(),
-                                          rect.rect().height(),
-                                          rect.classColour,
-                                          rect.className,
-                                          rect.id))
+                self.new_annotation.emit(self.__boundingBox(rect))
 
     def selectAnnotation(self, id: str):
         """ Selects an annotation """
@@ -153,6 +279,23 @@ class AnnotationCanvas(QGraphicsView):
             else:
                 rect.show()
 
+    def wheelEvent(self, event):
+        """ Zooms about the mouse while ctrl is held, otherwise scrolls """
+        if not event.modifiers() & Qt.KeyboardModifier.ControlModifier:
+            return super(AnnotationCanvas, self).wheelEvent(event)
+        step = self.ZOOM_STEP if event.angleDelta().y() > 0 else 1 / self.ZOOM_STEP
+        step = min(max(self.zoom * step, self.MIN_ZOOM), self.MAX_ZOOM) / self.zoom
+        self.zoom = self.zoom * step
+        self.scale(step, step)
+        # past 1:1 the reduced image runs out of detail
+        if self.zoom > 1:
+            self.showFullResolution()
+
+    def resizeEvent(self, event):
+        """ Keeps the size images are prefetched at in step with the view """
+        super(AnnotationCanvas, self).resizeEvent(event)
+        self.prefetcher.displaySize = self.viewport().size()
+
     def mousePressEvent(self, event):
         """ Event to capture mouse press and update rect coords """
         super(AnnotationCanvas, self).mousePressEvent(event)
@@ -184,13 +327,19 @@ class AnnotationCanvas(QGraphicsView):
         # Only add rectangle if in annotation mode
         if self.mode == Tools.annotationTool:
             self.resetScene()
+            try:
+                annotationID = self.app.project.getNextAnnotationID(self.image.index if self.image else None)
+            except AnnotationIDsExhausted as exc:
+                # the box is refused rather than given an id another box already has
+                self.app.notificationManager.raiseNotification(f"Could not add the box: {exc}")
+                return
             self.createRect(self.rectBegin.x(),
                             self.rectBegin.y(),
                             abs(self.rectEnd.x() - self.rectBegin.x()),
                             abs(self.rectEnd.y() - self.rectBegin.y()),
                             self.currentClassColour,
                             self.currentClassName,
-                            self.app.project.getNextAnnotationID(),
+                            annotationID,
                             True,
                             False,
                             False)
@@ -0,0 +1,152 @@
+"""
+    imagePrefetcher.py
+    Decodes the images around the one being annotated ahead of time, so navigating to them does not wait on a decode
+"""
+
+import math
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from PyQt6.QtCore import QObject, QBuffer, QByteArray, QSize, pyqtSignal as Signal
+from PyQt6.QtGui import QImage, QImageReader, QPixmap
+
+from dataset.imageSource import readImage
+
+REDUCTIONS = (1, 2, 4, 8)  # powers of two, so coordinates scaled by them convert back exactly
+REDUCED_FORMATS = (b"jpeg",)  # formats decoded straight to a reduced size, others are decoded in full and shrunk
+
+
+def imageReader(data: bytes) -> QImageReader:
+    """ Returns a reader over an encoded image, its size and format are read from the header alone """
+    buffer = QBuffer()
+    buffer.setData(QByteArray(data))
+    reader = QImageReader(buffer)
+    reader.buffer = buffer  # the reader does not keep its device alive
+    return reader
+
+
+def fitScale(size: QSize, displaySize: QSize) -> int:
+    """ Returns the least reduction at which an image of size fits displaySize """
+    if displaySize is None or displaySize.isEmpty() or not size.isValid():
+        return 1
+    return next((reduction for reduction in REDUCTIONS if size.width() <= displaySize.width() * reduction
+                 and size.height() <= displaySize.height() * reduction), REDUCTIONS[-1])
+
+
+def decodeImage(data: bytes, displaySize: QSize = None, scale: int = None) -> tuple:
+    """
+        Decodes an image for display, returning (image, scale) where scale is the number of image pixels per
+        decoded pixel. With a displaySize the image is decoded at the least reduction that fits it, or at scale
+        when it is given. Jpegs are decoded at that resolution directly rather than decoded in full and shrunk.
+    """
+    reader = imageReader(data)
+    size = reader.size()
+    if scale is None:
+        scale = fitScale(size, displaySize)
+    if scale > 1 and size.isValid():
+        reader.setScaledSize(QSize(math.ceil(size.width() / scale), math.ceil(size.height() / scale)))
+    return reader.read(), scale
+
+
+class ImagePrefetcher(QObject):
+    """
+        Decodes images on a pool of threads into QImages, which unlike pixmaps can be built off the GUI thread,
+        and keeps the most recent few. They are only turned into pixmaps when shown. Images are decoded reduced
+        to fit displaySize when it is set. Each prefetch replaces the last, so work queued for images that are
+        no longer wanted, e.g. after changing direction, is cancelled. An image can also be decoded at a given
+        scale, e.g. a quick preview or full resolution once zoomed in, ahead of anything queued. imageDecoded is
+        emitted with the path of each image as it is cached, decodeFailed with the path of each image that was
+        read but would not decode.
+    """
+    imageDecoded = Signal(str)
+    decodeFailed = Signal(str)
+
+    WORKERS = 2
+    MAX_CACHED = 8  # decoded images kept, a 4K image takes around 32 MB
+    MAX_SCALED = 2  # images decoded at a given scale kept, the preview and full resolution of the image shown
+
+    def __init__(self) -> None:
+        """ init """
+        super().__init__()
+        self.executor = ThreadPoolExecutor(max_workers=self.WORKERS)
+        self.lock = threading.Lock()
+        self.images = OrderedDict()  # image path -> (decoded image, scale), least recently wanted first
+        self.pending = {}  # image path -> future of an image being decoded
+        self.scaled = OrderedDict()  # (image path, scale) -> image decoded at that scale, least recently wanted first
+        self.scaledPending = {}  # (image path, scale) -> future of an image being decoded at that scale
+        self.displaySize = None  # size of the view images are shown in, images are decoded to fit it
+
+    def prefetch(self, imagePaths: list) -> None:
+        """ Decodes images in the background, most wanted first, and cancels queued work for any others """
+        imagePaths = imagePaths[:self.MAX_CACHED]
+        with self.lock:
+            for imagePath, future in list(self.pending.items()):
+                if imagePath not in imagePaths and future.cancel():
+                    del self.pending[imagePath]
+            for imagePath in imagePaths:
+                if imagePath in self.images:
+                    self.images.move_to_end(imagePath)  # so it is evicted after images no longer wanted
+                elif imagePath not in self.pending:
+                    self.pending[imagePath] = self.executor.submit(self.__decode, imagePath)
+
+    def decode(self, imagePath: str, scale: int) -> None:
+        """ Decodes an image at scale in the background, ahead of the images queued by prefetch """
+        key = (imagePath, scale)
+        with self.lock:
+            if key in self.scaled:
+                self.scaled.move_to_end(key)
+                return
+            if key in self.scaledPending:
+                return
+            # the pool runs work in the order it was queued, so what is still queued goes back in behind this
+            requeued = [path for path, future in list(self.pending.items()) if future.cancel()]
+            self.scaledPending[key] = self.executor.submit(self.__decodeScaled, imagePath, scale)
+            for path in requeued:
+                self.pending[path] = self.executor.submit(self.__decode, path)
+
+    def pixmap(self, imagePath: str, scale: int = None):
+        """
+            Returns (pixmap, scale) for an image if it has been decoded, None if it has not been yet. With a
+            scale, the image as decoded at that scale rather than to fit the display.
+        """
+        with self.lock:
+            if scale is None:
+                decoded = self.images.get(imagePath)
+            else:
+                image = self.scaled.get((imagePath, scale))
+                decoded = (image, scale) if image is not None else None
+        if decoded is None:
+            return None
+        return QPixmap.fromImage(decoded[0]), decoded[1]
+
+    def __decode(self, imagePath: str) -> tuple:
+        """ Worker, decodes an image and adds it to the cache """
+        data = readImage(imagePath)
+        decoded = decodeImage(data, self.displaySize) if data is not None else (QImage(), 1)
+        with self.lock:
+            self.pending.pop(imagePath, None)
+            if not decoded[0].isNull():
+                self.images[imagePath] = decoded
+                while len(self.images) > self.MAX_CACHED:
+                    self.images.popitem(last=False)
+        if not decoded[0].isNull():
+            self.imageDecoded.emit(imagePath)
+        elif data is not None:
+            self.decodeFailed.emit(imagePath)  # corrupt, as opposed to unreachable for now
+        return decoded
+
+    def __decodeScaled(self, imagePath: str, scale: int) -> None:
+        """ Worker, decodes an image at scale and adds it to the cache of scaled images """
+        data = readImage(imagePath)
+        image = decodeImage(data, scale=scale)[0] if data is not None else QImage()
+        with self.lock:
+            self.scaledPending.pop((imagePath, scale), None)
+            if not image.isNull():
+                self.scaled[(imagePath, scale)] = image
+                while len(self.scaled) > self.MAX_SCALED:
+                    self.scaled.popitem(last=False)
+        if not image.isNull():
+            self.imageDecoded.emit(imagePath)
+        elif data is not None:
+            self.decodeFailed.emit(imagePath)
@@ -0,0 +1,83 @@
+"""
+    datasetIntegrity.py
+    Content hashes of a dataset's images, used to tell when an image has been replaced or truncated on disk
+"""
+
+import os
+import hashlib
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from dataset.imageSource import ArchiveSource, readImage, splitArchivePath
+from dataset.remoteSource import isRemote, remoteHash
+
+HASH_SIZE = 16  # bytes of blake2b digest kept per image
+CHUNK_SIZE = 1 << 20  # bytes read from an image at a time
+UNKNOWN_HASH = bytes(HASH_SIZE)  # marks an image that has not been hashed
+
+
+def hashFile(filePath: str):
+    """ Returns the blake2b digest of a file's contents, None if it could not be read """
+    if isRemote(filePath):
+        return remoteHash(filePath)  # from the object's etag rather than downloading it
+    digest = hashlib.blake2b(digest_size=HASH_SIZE)
+    if splitArchivePath(filePath) is not None:
+        data = readImage(filePath)  # a member of an archive, read from its memory map
+        if data is None:
+            return None
+        digest.update(data)
+        return digest.digest()
+    try:
+        with open(filePath, "rb") as file:
+            while True:
+                chunk = file.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                digest.update(chunk)
+    except OSError:
+        return None
+    return digest.digest()
+
+
+class DatasetHasher:
+    """
+        Hashes images on a pool of processes so hashing is spread over every core. Small batches are hashed in
+        process, where starting the pool would cost more than it saves.
+    """
+    POOL_THRESHOLD = 64  # fewest images worth starting a pool for
+    PROGRESS_INTERVAL = 256  # images hashed between progress reports
+
+    def __init__(self, workers: int = None, progressCallback=None) -> None:
+        """ init, progressCallback(imagesHashed, imageCount) is called periodically while hashing """
+        self.workers = workers or os.cpu_count() or 1
+        self.progressCallback = progressCallback
+
+    def hash(self, filePaths: list) -> list:
+        """ Returns the digest of each file, in order, with None for files that could not be read """
+        # remote images are hashed from their listed etags, which is not worth a pool
+        if len(filePaths) < self.POOL_THRESHOLD or self.workers == 1 or isRemote(filePaths[0]):
+            digests = []
+            for filePath in filePaths:
+                digests.append(hashFile(filePath))
+                self.__reportProgress(len(digests), len(filePaths))
+            return digests
+
+        # spawned rather than forked, forking a process that is running qt threads is not safe
+        # archives are reopened in each worker from their stored indexes rather than reindexed
+        executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                       initializer=ArchiveSource.register, initargs=(ArchiveSource.indexPaths(),))
+        try:
+            chunkSize = max(1, min(64, len(filePaths) // (self.workers * 8)))
+            digests = []
+            for digest in executor.map(hashFile, filePaths, chunksize=chunkSize):
+                digests.append(digest)
+                self.__reportProgress(len(digests), len(filePaths))
+            return digests
+        finally:
+            # stopped early (cancelled or an error), images not yet hashed are dropped
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def __reportProgress(self, imagesHashed: int, imageCount: int) -> None:
+        """ Calls the progress callback every PROGRESS_INTERVAL images and once hashing is done """
+        if self.progressCallback and (imagesHashed % self.PROGRESS_INTERVAL == 0 or imagesHashed == imageCount):
+            self.progressCallback(imagesHashed, imageCount)
@@ -0,0 +1,180 @@
+"""
+    datasetRescan.py
+    Compares a dataset directory or archive against a project's image manifest to find images that were added, removed or changed
+"""
+
+import os
+import numpy as np
+
+from dataset.datasetScanner import DatasetScanner
+from dataset.imageSource import ArchiveScanner, ArchiveSource, isArchive
+from dataset.remoteSource import RemoteScanner, RemoteSource, isRemote
+from dataset.datasetIntegrity import DatasetHasher, HASH_SIZE, UNKNOWN_HASH
+
+
+class ScanState:
+    """
+        The (mtime, size, inode) and content hash of every image in the manifest as of the last scan, indexed
+        by image id. A mtime of -1 marks an image that has not been seen yet and a hash of zeros one that has
+        not been hashed.
+    """
+    def __init__(self, filePath: str) -> None:
+        """ init """
+        self.filePath = filePath
+        self.mtimes = np.full(0, -1, dtype=np.int64)
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.inodes = np.zeros(0, dtype=np.uint64)
+        self.hashes = np.zeros((0, HASH_SIZE), dtype=np.uint8)
+
+    def load(self) -> None:
+        """ Reads the state stored on disk, if there is one """
+        if not os.path.exists(self.filePath):
+            return
+        try:
+            with np.load(self.filePath) as state:
+                self.mtimes = state["mtimes"]
+                self.sizes = state["sizes"]
+                self.inodes = state["inodes"]
+                # states written before images were hashed have no hashes
+                self.hashes = state["hashes"] if "hashes" in state else np.zeros((len(self.mtimes), HASH_SIZE), dtype=np.uint8)
+        except Exception as exc:
+            print(exc)
+
+    def save(self) -> None:
+        """ Writes the state out to disk """
+        os.makedirs(os.path.dirname(self.filePath), exist_ok=True)
+        tempPath = self.filePath + ".tmp.npz"
+        np.savez(tempPath, mtimes=self.mtimes, sizes=self.sizes, inodes=self.inodes, hashes=self.hashes)
+        os.replace(tempPath, self.filePath)
+
+    def copy(self) -> "ScanState":
+        """ Returns a copy that can be saved from another thread """
+        scanState = ScanState(self.filePath)
+        scanState.mtimes = self.mtimes.copy()
+        scanState.sizes = self.sizes.copy()
+        scanState.inodes = self.inodes.copy()
+        scanState.hashes = self.hashes.copy()
+        return scanState
+
+    def stat(self, imageID: int):
+        """ Returns the recorded (mtime, size, inode) of an image, None if it is unknown """
+        if imageID >= len(self.mtimes) or self.mtimes[imageID] == -1:
+            return None
+        return int(self.mtimes[imageID]), int(self.sizes[imageID]), int(self.inodes[imageID])
+
+    def hash(self, imageID: int):
+        """ Returns the recorded content hash of an image, None if it has not been hashed """
+        if imageID >= len(self.hashes):
+            return None
+        digest = self.hashes[imageID].tobytes()
+        return None if digest == UNKNOWN_HASH else digest
+
+    def reserve(self, imageCount: int) -> None:
+        """ Grows the state to cover at least imageCount images, new images are marked as not seen """
+        if imageCount <= len(self.mtimes):
+            return
+        self.mtimes = np.concatenate([self.mtimes, np.full(imageCount - len(self.mtimes), -1, dtype=np.int64)])
+        self.sizes = np.concatenate([self.sizes, np.zeros(imageCount - len(self.sizes), dtype=np.int64)])
+        self.inodes = np.concatenate([self.inodes, np.zeros(imageCount - len(self.inodes), dtype=np.uint64)])
+        self.hashes = np.concatenate([self.hashes, np.zeros((imageCount - len(self.hashes), HASH_SIZE), dtype=np.uint8)])
+
+    def setStat(self, imageID: int, stat) -> None:
+        """ Records the (mtime, size, inode) of an image, stat may be None if it could not be read """
+        if imageID >= len(self.mtimes):
+            # grow geometrically so images arriving one at a time do not copy the arrays every time
+            self.reserve(max(imageID + 1, 2 * len(self.mtimes)))
+        if stat is None:
+            self.mtimes[imageID] = -1
+        else:
+            self.mtimes[imageID], self.sizes[imageID], self.inodes[imageID] = stat
+
+    def setHash(self, imageID: int, digest) -> None:
+        """ Records the content hash of an image, digest may be None if it could not be read """
+        if imageID >= len(self.hashes):
+            self.reserve(max(imageID + 1, 2 * len(self.hashes)))
+        self.hashes[imageID] = np.frombuffer(digest or UNKNOWN_HASH, dtype=np.uint8)
+
+
+class RescanResult:
+    """
+        The difference between a dataset directory and its manifest. Added images are relative paths in the
+        order they should be appended, removed and modified images are ids.
+    """
+    def __init__(self) -> None:
+        """ init """
+        self.added = []  # relative paths of images not yet in the manifest
+        self.addedStats = []  # (mtime, size, inode) of each added image
+        self.addedHashes = []  # content hash of each added image
+        self.removed = []  # ids of images no longer on disk
+        self.modified = []  # ids of images whose contents changed, or whose stat changed if they were never hashed
+        self.verified = 0  # images whose stat changed that were rehashed and found unchanged
+        self.directories = []  # every directory in the dataset, relative to its root
+        self.scanState = None  # stats of the images already in the manifest as they were found by this scan
+
+    def hasChanges(self) -> bool:
+        """ Returns true if anything was added, removed or modified """
+        return len(self.added) > 0 or len(self.removed) > 0 or len(self.modified) > 0
+
+
+def rescanDataset(manifest, scanState: ScanState, progressCallback=None) -> RescanResult:
+    """
+        Walks the dataset directory and compares it with the images in the manifest and the stats recorded for
+        them. Images whose stat changed are rehashed to check their contents really differ, as are added images
+        and ones never hashed. Only reads the manifest, so it can run off the GUI thread while images are viewed.
+    """
+    imageCount = len(manifest)
+    imageIDs = {manifest.relativePath(imageID): imageID for imageID in range(imageCount)}
+    seen = np.zeros(imageCount, dtype=bool)
+
+    result = RescanResult()
+    result.scanState = ScanState(scanState.filePath)
+    result.scanState.reserve(imageCount)
+    hashCount = min(imageCount, len(scanState.hashes))
+    result.scanState.hashes[:hashCount] = scanState.hashes[:hashCount]
+
+    changed = []  # ids of images whose stat differs from the last scan
+    unhashed = []  # ids of images seen before but never hashed, e.g. added while the dataset was watched
+    if isRemote(manifest.datasetDir):
+        scanner = RemoteScanner(RemoteSource.open(manifest.datasetDir), progressCallback=progressCallback)
+    elif isArchive(manifest.datasetDir):
+        # the archive is reindexed if it was replaced, otherwise its members are listed from the index
+        scanner = ArchiveScanner(ArchiveSource.open(manifest.datasetDir), progressCallback=progressCallback)
+    else:
+        scanner = DatasetScanner(manifest.datasetDir, progressCallback=progressCallback, collectStats=True)
+    for directory, fileNames, fileStats in scanner.scan():
+        for fileName, stat in zip(fileNames, fileStats):
+            relativePath = directory + "/" + fileName if directory else fileName
+            imageID = imageIDs.get(relativePath)
+            if imageID is None:
+                result.added.append(relativePath)
+                result.addedStats.append(stat)
+                continue
+
+            seen[imageID] = True
+            previous = scanState.stat(imageID)
+            if previous is not None and stat is not None:
+                if previous != stat:
+                    changed.append(imageID)
+                elif scanState.hash(imageID) is None:
+                    unhashed.append(imageID)
+            result.scanState.setStat(imageID, stat)
+
+    # only images that look changed are read, the rest are trusted from their stats
+    hashedIDs = changed + unhashed
+    filePaths = [manifest[imageID] for imageID in hashedIDs]
+    filePaths.extend(manifest.datasetDir + "/" + relativePath for relativePath in result.added)
+    digests = DatasetHasher().hash(filePaths)
+    for imageID, digest in zip(changed, digests):
+        if digest is not None and digest == scanState.hash(imageID):
+            result.verified = result.verified + 1  # touched or copied over with the same contents
+        else:
+            result.modified.append(imageID)
+    for imageID, digest in zip(hashedIDs, digests):
+        result.scanState.setHash(imageID, digest)
+    result.addedHashes = digests[len(hashedIDs):]
+
+    # images kept outside of the dataset directory are not part of the scan
+    result.removed = [int(imageID) for imageID in np.flatnonzero(~seen)
+                      if not manifest.relativePath(int(imageID)).startswith("/")]
+    result.directories = scanner.directories
+    return result
@@ -0,0 +1,135 @@
+"""
+    datasetScanner.py
+    Walks a dataset directory tree in parallel and finds the images within it
+"""
+
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+IMAGE_EXTENSIONS = {".bmp", ".jpeg", ".jpg", ".png", ".tif", ".tiff", ".webp"}
+
+# leading bytes of the supported image formats, used for files that have no extension
+IMAGE_SIGNATURES = (b"\xff\xd8\xff",  # jpeg
+                    b"\x89PNG\r\n\x1a\n",  # png
+                    b"BM",  # bmp
+                    b"II*\x00",  # tiff, little endian
+                    b"MM\x00*")  # tiff, big endian
+
+
+class DatasetScanner:
+    """
+        Lists a directory tree with os.scandir on a pool of threads, one directory per task. Images are found
+        by extension, files without an extension are identified from their leading bytes.
+    """
+    PROGRESS_INTERVAL = 64  # directories scanned between progress reports
+
+    def __init__(self, rootDir: str, workers: int = None, progressCallback=None, collectStats: bool = False) -> None:
+        """
+            init, progressCallback(directoriesScanned, imagesFound) is called periodically while scanning. When
+            collectStats is set each image's (mtime, size, inode) is gathered as it is listed.
+        """
+        self.rootDir = rootDir
+        self.collectStats = collectStats
+        # listing is bound by filesystem latency rather than cpu, so use more threads than cores
+        self.workers = workers or min(32, (os.cpu_count() or 1) * 4)
+        self.progressCallback = progressCallback
+
+        self.directoriesScanned = 0
+        self.imagesFound = 0
+        self.directories = []  # every directory listed, relative to the root
+
+    def scan(self):
+        """
+            Yields (directory relative to the root, sorted image file names, file stats or None) for each directory
+            that contains images. Directories finish listing in whatever order the threads get to them, so they are
+            held back until the walk completes and yielded in sorted order, every project built over the same tree
+            then numbers its images the same way.
+        """
+        results = queue.Queue()
+        executor = ThreadPoolExecutor(max_workers=self.workers)
+        found = []
+        try:
+            executor.submit(self.__scanDirectory, "", results)
+            outstanding = 1
+            while outstanding > 0:
+                directory, fileNames, fileStats, subdirectories = results.get()
+                outstanding = outstanding - 1
+                self.directories.append(directory)
+                for subdirectory in subdirectories:
+                    executor.submit(self.__scanDirectory, subdirectory, results)
+                    outstanding = outstanding + 1
+
+                self.directoriesScanned = self.directoriesScanned + 1
+                self.imagesFound = self.imagesFound + len(fileNames)
+                if fileNames:
+                    found.append((directory, fileNames, fileStats))
+                if self.progressCallback and (self.directoriesScanned % self.PROGRESS_INTERVAL == 0 or outstanding == 0):
+                    self.progressCallback(self.directoriesScanned, self.imagesFound)
+        finally:
+            # stopped early (cancelled or an error), directories not yet listed are dropped
+            executor.shutdown(wait=True, cancel_futures=True)
+
+        # ordered by path components so a directory's subdirectories follow it directly
+        self.directories.sort(key=directoryKey)
+        found.sort(key=lambda result: directoryKey(result[0]))
+        yield from found
+
+    def __scanDirectory(self, directory: str, results: queue.Queue) -> None:
+        """ Worker that lists a single directory """
+        images = []
+        subdirectories = []
+        try:
+            with os.scandir(self.rootDir + "/" + directory if directory else self.rootDir) as entries:
+                for entry in entries:
+                    if entry.name.startswith("."):
+                        continue  # hidden files and directories, e.g. a project's .session cache
+                    # symlinked directories are not followed so a link back up the tree cannot loop forever
+                    if entry.is_dir(follow_symlinks=False):
+                        subdirectories.append(directory + "/" + entry.name if directory else entry.name)
+                    elif entry.is_file() and isImage(entry.path, entry.name):
+                        images.append((entry.name, fileStat(entry) if self.collectStats else None))
+        except OSError as exc:
+            print(exc)
+        finally:
+            # always report back, the scan waits on a result for every directory it submitted
+            images.sort()
+            subdirectories.sort()
+            fileNames = [fileName for fileName, _ in images]
+            fileStats = [stat for _, stat in images] if self.collectStats else None
+            results.put((directory, fileNames, fileStats, subdirectories))
+
+
+def directoryKey(directory: str) -> list:
+    """ Sort key of a directory relative to the root, the root itself sorts first """
+    return directory.split("/") if directory else []
+
+
+def fileStat(entry: os.DirEntry) -> tuple:
+    """ Returns the (mtime, size, inode) of a directory entry, used to spot files that have changed """
+    try:
+        stat = entry.stat()
+    except OSError:
+        return None  # removed while being listed
+    return stat.st_mtime_ns, stat.st_size, entry.inode()
+
+
+def isImage(filePath: str, fileName: str) -> bool:
+    """ Returns true if a file is an image, from its extension or, when it has none, its leading bytes """
+    extension = os.path.splitext(fileName)[1]
+    if extension:
+        return extension.lower() in IMAGE_EXTENSIONS
+
+    try:
+        with open(filePath, "rb") as file:
+            header = file.read(12)
+    except OSError:
+        return False
+    return isImageHeader(header)
+
+
+def isImageHeader(header: bytes) -> bool:
+    """ Returns true if the leading bytes of a file are those of a supported image format """
+    if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+        return True
+    return header.startswith(IMAGE_SIGNATURES)
@@ -0,0 +1,175 @@
+"""
+    datasetWatcher.py
+    Keeps a project's images in step with its dataset directory
+"""
+
+import os
+
+from PyQt6 import QtCore
+from PyQt6.QtCore import QThread, QFileSystemWatcher, pyqtSignal
+
+from dataset.datasetRescan import rescanDataset
+from dataset.datasetScanner import DatasetScanner, fileStat, isImage
+from dataset.imageMetadata import MetadataProber
+
+
+class DatasetRescanner(QThread):
+    """
+        Compares the dataset directory against the project's manifest in the background. The result is handed
+        back through rescanned to be applied on the GUI thread.
+    """
+    rescanned = pyqtSignal(object)  # RescanResult
+
+    def __init__(self, project) -> None:
+        """ init """
+        super().__init__()
+        self.project = project
+
+    def run(self) -> None:
+        """ Worker """
+        try:
+            result = rescanDataset(self.project.imageDataset, self.project.scanState)
+        except Exception as exc:
+            print(exc)
+            return
+        self.rescanned.emit(result)
+
+
+class MetadataPrecomputer(QThread):
+    """
+        Works out the metadata of every image not yet in the project's metadata cache in the background, so
+        dimensions and invalid images are known before the images are viewed. Results are handed back through
+        precomputed a batch at a time to be recorded on the GUI thread, so images probed early are known
+        without waiting on the rest of a large dataset.
+    """
+    precomputed = pyqtSignal(list, list, list)  # image ids, their stats when probed, (height, width, channels) or None
+    completed = pyqtSignal(int)  # number of images that could not be read, after the last batch
+    BATCH_SIZE = 1024  # images probed between batches handed back
+
+    def __init__(self, project) -> None:
+        """ init """
+        super().__init__()
+        self.imageIDs, self.imagePaths, self.imageStats = project.imagesWithoutMetadata()
+        self.prober = MetadataProber()
+
+    def stop(self) -> None:
+        """ Stops probing, what was probed so far is still handed back """
+        self.prober.cancel()
+
+    def run(self) -> None:
+        """ Worker """
+        if not self.imageIDs:
+            return
+        start = 0
+        shapes = []
+        invalidCount = 0
+        try:
+            for shape in self.prober.iterProbe(self.imagePaths):
+                shapes.append(shape)
+                if shape is None:
+                    invalidCount = invalidCount + 1
+                if len(shapes) == self.BATCH_SIZE:
+                    self.__emitBatch(start, shapes)
+                    start = start + len(shapes)
+                    shapes = []
+        except Exception as exc:
+            print(exc)
+        if shapes:
+            self.__emitBatch(start, shapes)
+        self.completed.emit(invalidCount)
+
+    def __emitBatch(self, start: int, shapes: list) -> None:
+        """ Hands back the shapes of the images from start onwards """
+        stop = start + len(shapes)
+        self.precomputed.emit(self.imageIDs[start:stop], self.imageStats[start:stop], shapes)
+
+
+class DatasetWatcher(QtCore.QObject):
+    """
+        Watches every directory of a dataset and appends images to the project as they appear. Bursts of
+        changes, such as a capture rig writing frames, are gathered up and handled together.
+    """
+    imagesAdded = pyqtSignal(int)  # number of images appended
+    DEBOUNCE_INTERVAL = 1000  # ms to wait after the last change before listing the changed directories
+
+    def __init__(self, project) -> None:
+        """ init """
+        super().__init__()
+        self.project = project
+        self.changedDirectories = set()
+
+        self.watcher = QFileSystemWatcher()
+        self.watcher.directoryChanged.connect(self.__onDirectoryChanged)
+
+        self.timer = QtCore.QTimer()
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.__processChanges)
+
+    def start(self, directories: list) -> None:
+        """ Starts watching the given directories, relative to the dataset directory """
+        self.__watch(directories)
+
+    def stop(self) -> None:
+        """ Stops watching, changes not yet handled are dropped """
+        self.timer.stop()
+        self.changedDirectories.clear()
+        watched = self.watcher.directories()
+        if watched:
+            self.watcher.removePaths(watched)
+
+    def __watch(self, directories: list) -> None:
+        """ Adds directories to the watcher """
+        datasetDir = self.project.imageDataset.datasetDir
+        paths = [datasetDir + "/" + directory if directory else datasetDir for directory in directories]
+        if paths:
+            failed = self.watcher.addPaths(paths)
+            if failed:
+                print(f"Could not watch {len(failed)} directories in {datasetDir}")
+
+    def __onDirectoryChanged(self, path: str) -> None:
+        """ Records a changed directory and restarts the debounce timer """
+        self.changedDirectories.add(path)
+        self.timer.start(self.DEBOUNCE_INTERVAL)
+
+    def __processChanges(self) -> None:
+        """ Lists each changed directory and appends any images that are new to the project """
+        datasetDir = self.project.imageDataset.datasetDir
+        changedDirectories = sorted(self.changedDirectories)
+        self.changedDirectories.clear()
+
+        imagePaths = []
+        imageStats = []
+        newDirectories = []
+        watchedDirectories = set(self.watcher.directories())
+        for path in changedDirectories:
+            directory = os.path.relpath(path, datasetDir)
+            directory = "" if directory == "." else directory
+            knownFileNames = self.project.imageDataset.fileNamesIn(directory)
+            try:
+                with os.scandir(path) as entries:
+                    for entry in sorted(entries, key=lambda entry: entry.name):
+                        if entry.name.startswith("."):
+                            continue
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirectory = directory + "/" + entry.name if directory else entry.name
+                            if entry.path not in watchedDirectories:
+                                newDirectories.append(subdirectory)
+                        elif entry.name not in knownFileNames and entry.is_file() and isImage(entry.path, entry.name):
+                            imagePaths.append(directory + "/" + entry.name if directory else entry.name)
+                            imageStats.append(fileStat(entry))
+            except OSError as exc:
+                print(exc)  # the directory was removed
+
+        # new directories may already hold images, e.g. a folder moved into the dataset
+        for newDirectory in newDirectories:
+            scanner = DatasetScanner(datasetDir + "/" + newDirectory, collectStats=True)
+            for directory, fileNames, fileStats in scanner.scan():
+                relativeDirectory = newDirectory + "/" + directory if directory else newDirectory
+                imagePaths.extend(relativeDirectory + "/" + fileName for fileName in fileNames)
+                imageStats.extend(fileStats)
+            self.__watch([newDirectory + "/" + directory if directory else newDirectory for directory in scanner.directories])
+
+        # in a sharded project only the annotator looking after the manifest adds images, none are returned here
+        imageIDs = self.project.addImages(imagePaths, imageStats) if imagePaths else []
+        if imageIDs:
+            self.imagesAdded.emit(len(imageIDs))
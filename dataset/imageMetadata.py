@@ -0,0 +1,161 @@
+"""
+    imageMetadata.py
+    The dimensions and validity of every image in a dataset, worked out in bulk and kept alongside the project
+"""
+
+import os
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+
+from dataset.imageSource import ArchiveSource, loadImage, probeImage
+from dataset.remoteSource import isRemote
+
+
+def probeMetadata(imagePath: str):
+    """
+        Returns the (height, width, channels) of an image as decoded, None if it cannot be read. Formats with
+        known headers are sized from them, anything else is decoded.
+    """
+    dimensions = probeImage(imagePath)
+    if dimensions is not None:
+        return dimensions[1], dimensions[0], 3  # images are always decoded to bgr
+    image = loadImage(imagePath)
+    if image is None:
+        return None
+    return image.shape
+
+
+class MetadataCache:
+    """
+        The (height, width, channels) and validity of every image, indexed by image id, along with the
+        (mtime, size, inode) of the file they were worked out from. An entry only counts while the image's
+        stat in the scan state still matches, so images changed on disk are worked out again.
+    """
+    def __init__(self, filePath: str) -> None:
+        """ init """
+        self.filePath = filePath
+        self.mtimes = np.full(0, -1, dtype=np.int64)  # -1 marks an image not worked out yet
+        self.sizes = np.zeros(0, dtype=np.int64)
+        self.inodes = np.zeros(0, dtype=np.uint64)
+        self.shapes = np.zeros((0, 3), dtype=np.int32)  # height, width, channels
+        self.valid = np.zeros(0, dtype=bool)
+
+    def load(self) -> None:
+        """ Reads the cache stored on disk, if there is one """
+        if not os.path.exists(self.filePath):
+            return
+        try:
+            with np.load(self.filePath) as cache:
+                self.mtimes = cache["mtimes"]
+                self.sizes = cache["sizes"]
+                self.inodes = cache["inodes"]
+                self.shapes = cache["shapes"]
+                self.valid = cache["valid"]
+        except Exception as exc:
+            print(exc)
+
+    def save(self) -> None:
+        """ Writes the cache out to disk """
+        os.makedirs(os.path.dirname(self.filePath), exist_ok=True)
+        tempPath = self.filePath + ".tmp.npz"
+        np.savez(tempPath, mtimes=self.mtimes, sizes=self.sizes, inodes=self.inodes, shapes=self.shapes, valid=self.valid)
+        os.replace(tempPath, self.filePath)
+
+    def get(self, imageID: int, stat):
+        """
+            Returns (height, width, channels, valid) for an image with the given (mtime, size, inode), None if
+            it has not been worked out for that version of the file
+        """
+        if stat is None or imageID >= len(self.mtimes) or self.mtimes[imageID] == -1:
+            return None
+        if (int(self.mtimes[imageID]), int(self.sizes[imageID]), int(self.inodes[imageID])) != tuple(stat):
+            return None
+        height, width, channels = self.shapes[imageID].tolist()
+        return height, width, channels, bool(self.valid[imageID])
+
+    def set(self, imageID: int, stat, shape) -> None:
+        """ Records the (height, width, channels) of an image with the given stat, shape is None if it is invalid """
+        if stat is None:
+            return
+        if imageID >= len(self.mtimes):
+            self.reserve(max(imageID + 1, 2 * len(self.mtimes)))
+        self.mtimes[imageID], self.sizes[imageID], self.inodes[imageID] = stat
+        self.shapes[imageID] = shape or (0, 0, 0)
+        self.valid[imageID] = shape is not None
+
+    def reserve(self, imageCount: int) -> None:
+        """ Grows the cache to cover at least imageCount images """
+        if imageCount <= len(self.mtimes):
+            return
+        count = imageCount - len(self.mtimes)
+        self.mtimes = np.concatenate([self.mtimes, np.full(count, -1, dtype=np.int64)])
+        self.sizes = np.concatenate([self.sizes, np.zeros(count, dtype=np.int64)])
+        self.inodes = np.concatenate([self.inodes, np.zeros(count, dtype=np.uint64)])
+        self.shapes = np.concatenate([self.shapes, np.zeros((count, 3), dtype=np.int32)])
+        self.valid = np.concatenate([self.valid, np.zeros(count, dtype=bool)])
+
+    def missing(self, scanState) -> list:
+        """ Returns the ids of images whose metadata is not known for their current stat """
+        imageCount = len(scanState.mtimes)
+        self.reserve(imageCount)
+        stale = ((self.mtimes[:imageCount] != scanState.mtimes) | (self.sizes[:imageCount] != scanState.sizes)
+                 | (self.inodes[:imageCount] != scanState.inodes))
+        # images never seen by a scan have no stat to key an entry by
+        return np.flatnonzero(stale & (scanState.mtimes != -1)).tolist()
+
+
+class MetadataProber:
+    """
+        Works out the metadata of many images at once. Local images are probed on a pool of processes, as
+        images without known headers are decoded, remote images on a pool of threads since probing them is
+        waiting on range requests.
+    """
+    POOL_THRESHOLD = 64  # fewest images worth starting a pool for
+    REMOTE_WORKERS = 16
+    PROGRESS_INTERVAL = 256  # images probed between progress reports
+
+    def __init__(self, workers: int = None, progressCallback=None) -> None:
+        """ init, progressCallback(imagesProbed, imageCount) is called periodically while probing """
+        self.workers = workers or os.cpu_count() or 1
+        self.progressCallback = progressCallback
+        self.cancelRequested = False
+
+    def cancel(self) -> None:
+        """ Stops probing, images not yet probed are left out of the result """
+        self.cancelRequested = True
+
+    def probe(self, filePaths: list) -> list:
+        """ Returns the (height, width, channels) of each image in order, None for images that could not be read """
+        return list(self.iterProbe(filePaths))
+
+    def iterProbe(self, filePaths: list):
+        """ Yields the (height, width, channels) of each image in order as it is probed, None for images that could not be read """
+        if len(filePaths) < self.POOL_THRESHOLD:
+            executor = None
+            results = map(probeMetadata, filePaths)
+        elif isRemote(filePaths[0]):
+            executor = ThreadPoolExecutor(max_workers=self.REMOTE_WORKERS)
+            results = executor.map(probeMetadata, filePaths)
+        elif self.workers == 1:
+            executor = None
+            results = map(probeMetadata, filePaths)
+        else:
+            # spawned rather than forked, forking a process that is running qt threads is not safe
+            executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context("spawn"),
+                                           initializer=ArchiveSource.register, initargs=(ArchiveSource.indexPaths(),))
+            results = executor.map(probeMetadata, filePaths, chunksize=max(1, min(64, len(filePaths) // (self.workers * 8))))
+
+        imagesProbed = 0
+        try:
+            for shape in results:
+                if self.cancelRequested:
+                    break
+                imagesProbed = imagesProbed + 1
+                yield shape
+                if self.progressCallback and (imagesProbed % self.PROGRESS_INTERVAL == 0 or imagesProbed == len(filePaths)):
+                    self.progressCallback(imagesProbed, len(filePaths))
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True, cancel_futures=True)
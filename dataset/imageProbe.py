@@ -0,0 +1,181 @@
+"""
+    imageProbe.py
+    Finds an image's dimensions from its headers, so metadata costs a few small reads rather than a full decode
+"""
+
+import struct
+
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+JPEG_SOF_MARKERS = set(range(0xc0, 0xd0)) - {0xc4, 0xc8, 0xcc}  # start of frame, holding the dimensions
+TIFF_TYPE_SIZES = {1: 1, 2: 1, 3: 2, 4: 4, 5: 8, 6: 1, 7: 1, 8: 2, 9: 4, 10: 8, 11: 4, 12: 8, 16: 8, 17: 8, 18: 8}
+TIFF_IMAGE_WIDTH = 256
+TIFF_IMAGE_LENGTH = 257
+TIFF_ORIENTATION = 274
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}  # exif orientations that rotate by a quarter turn, swapping width and height
+MAX_CHUNKS = 1024  # chunks walked looking for exif before a png or webp is given up on and decoded
+
+
+def probeDimensions(read):
+    """
+        Returns the (width, height) an image decodes to, as opencv would report them, from its headers alone.
+        Opencv applies exif orientation in every format that carries it, so a quarter turn swaps the two.
+        read(offset, size) returns bytes of the image, fewer near its end. Returns None for formats that are
+        not parsed here, or headers that do not make sense, which are left to be decoded.
+    """
+    def readBytes(offset: int, size: int) -> bytes:
+        return read(offset, size) or b""  # past the end, or not readable
+
+    try:
+        header = readBytes(0, 32)
+        if header.startswith(PNG_SIGNATURE):
+            return pngDimensions(readBytes, header)
+        if header.startswith(b"\xff\xd8"):
+            return jpegDimensions(readBytes)
+        if header[:4] in (b"II*\x00", b"MM\x00*", b"II+\x00", b"MM\x00+"):
+            return orient(*tiffDimensions(readBytes, 0))
+        if header.startswith(b"BM"):
+            return bmpDimensions(header)
+        if header[:4] == b"RIFF" and header[8:12] == b"WEBP":
+            return webpDimensions(readBytes, header)
+    except (struct.error, ValueError, IndexError):
+        pass  # truncated or corrupt, decoding will tell
+    return None
+
+
+def orient(dimensions, orientation: int):
+    """ Returns the dimensions once an exif orientation has been applied """
+    if dimensions is not None and orientation in TRANSPOSED_ORIENTATIONS:
+        return dimensions[1], dimensions[0]
+    return dimensions
+
+
+def pngDimensions(read, header: bytes):
+    """ Returns the dimensions from a png's IHDR chunk, which always comes first, oriented by any eXIf chunk """
+    if header[12:16] != b"IHDR":
+        return None
+    dimensions = struct.unpack(">II", header[16:24])
+    # exif has to come before the image data, the chunks are walked reading only their headers
+    offset = 8
+    for _ in range(MAX_CHUNKS):
+        chunk = read(offset, 8)
+        if len(chunk) < 8:
+            break
+        length, chunkType = struct.unpack(">I4s", chunk)
+        if chunkType in (b"IDAT", b"IEND"):
+            break
+        if chunkType == b"eXIf":
+            start = offset + 8
+            return orient(dimensions, tiffOrientation(lambda tiffOffset, size: read(start + tiffOffset, size)))
+        offset = offset + 12 + length
+    return dimensions
+
+
+def jpegDimensions(read):
+    """ Walks a jpeg's segments to its start of frame, reading only the segment headers """
+    orientation = 1
+    offset = 2
+    while True:
+        marker = read(offset, 4)
+        if len(marker) < 4 or marker[0] != 0xff:
+            return None
+        if marker[1] == 0xff:
+            offset = offset + 1  # fill byte
+            continue
+        if marker[1] == 0x01 or 0xd0 <= marker[1] <= 0xd9:
+            offset = offset + 2  # markers without a length
+            continue
+        length = struct.unpack(">H", marker[2:4])[0]
+        if marker[1] in JPEG_SOF_MARKERS:
+            height, width = struct.unpack(">HH", read(offset + 5, 4))
+            return orient((width, height), orientation)
+        if marker[1] == 0xe1 and read(offset + 4, 6) == b"Exif\x00\x00":
+            # only the first exif segment counts, later ones are usually xmp or thumbnails
+            start = offset + 10
+            orientation = tiffOrientation(lambda tiffOffset, size: read(start + tiffOffset, size)) if orientation == 1 else orientation
+        offset = offset + 2 + length
+
+
+def tiffOrientation(read) -> int:
+    """ Returns the orientation tag of a tiff structure, as embedded in exif, 1 if it has none """
+    try:
+        return tiffDimensions(read, 0)[1]
+    except (struct.error, ValueError):
+        return 1
+
+
+def tiffDimensions(read, offset: int) -> tuple:
+    """
+        Returns ((width, height), orientation) from the first directory of a tiff or bigtiff structure starting
+        at offset. Dimensions are None when the directory has none, as for exif.
+    """
+    header = read(offset, 16)
+    if header[:2] not in (b"II", b"MM"):
+        raise ValueError("not a tiff structure")  # e.g. exif kept with a jpeg style prefix, which is ignored
+    byteOrder = "<" if header[:2] == b"II" else ">"
+    bigTiff = struct.unpack(byteOrder + "H", header[2:4])[0] == 43
+    if bigTiff:
+        directoryOffset = struct.unpack(byteOrder + "Q", header[8:16])[0]
+        countFormat, entryFormat, entrySize, valueSize = "Q", "HHQ", 20, 8
+    else:
+        directoryOffset = struct.unpack(byteOrder + "I", header[4:8])[0]
+        countFormat, entryFormat, entrySize, valueSize = "H", "HHI", 12, 4
+
+    countSize = struct.calcsize(countFormat)
+    entryCount = struct.unpack(byteOrder + countFormat, read(offset + directoryOffset, countSize))[0]
+    if entryCount > 4096:
+        raise ValueError("implausible tiff directory")
+    entries = read(offset + directoryOffset + countSize, entryCount * entrySize)
+
+    values = {}
+    for index in range(entryCount):
+        entry = entries[index * entrySize:(index + 1) * entrySize]
+        tag, valueType, count = struct.unpack(byteOrder + entryFormat, entry[:struct.calcsize(entryFormat)])
+        if tag not in (TIFF_IMAGE_WIDTH, TIFF_IMAGE_LENGTH, TIFF_ORIENTATION) or count < 1:
+            continue
+        size = TIFF_TYPE_SIZES.get(valueType, 0)
+        if size == 0 or size > valueSize:
+            continue  # dimensions always fit in the entry, anything else is malformed
+        value = entry[entrySize - valueSize:entrySize - valueSize + size]
+        values[tag] = struct.unpack(byteOrder + {1: "B", 2: "H", 4: "I", 8: "Q"}[size], value)[0]
+
+    orientation = values.get(TIFF_ORIENTATION, 1)
+    if TIFF_IMAGE_WIDTH not in values or TIFF_IMAGE_LENGTH not in values:
+        return None, orientation
+    return (values[TIFF_IMAGE_WIDTH], values[TIFF_IMAGE_LENGTH]), orientation
+
+
+def bmpDimensions(header: bytes):
+    """ Returns the dimensions from a bmp's info header, rows stored top down have a negative height """
+    infoSize = struct.unpack("<I", header[14:18])[0]
+    if infoSize == 12:
+        return struct.unpack("<HH", header[18:22])  # the original os/2 header
+    width, height = struct.unpack("<ii", header[18:26])
+    return width, abs(height)
+
+
+def webpDimensions(read, header: bytes):
+    """ Returns the dimensions from the first chunk of a webp, lossy, lossless or extended """
+    chunk = header[12:16]
+    if chunk == b"VP8X" and header[20] & 0x08:
+        # the extended header flags exif, found by walking the chunks that follow
+        dimensions = int.from_bytes(header[24:27], "little") + 1, int.from_bytes(header[27:30], "little") + 1
+        offset = 12
+        for _ in range(MAX_CHUNKS):
+            chunkHeader = read(offset, 8)
+            if len(chunkHeader) < 8:
+                break
+            chunkType, length = struct.unpack("<4sI", chunkHeader)
+            if chunkType == b"EXIF":
+                start = offset + 8
+                return orient(dimensions, tiffOrientation(lambda tiffOffset, size: read(start + tiffOffset, size)))
+            offset = offset + 8 + length + (length & 1)
+        return dimensions
+    if chunk == b"VP8 " and header[23:26] == b"\x9d\x01\x2a":
+        width, height = struct.unpack("<HH", header[26:30])
+        return width & 0x3fff, height & 0x3fff
+    if chunk == b"VP8L" and header[20] == 0x2f:
+        bits = struct.unpack("<I", header[21:25])[0]
+        return (bits & 0x3fff) + 1, ((bits >> 14) & 0x3fff) + 1
+    if chunk == b"VP8X":
+        return int.from_bytes(header[24:27], "little") + 1, int.from_bytes(header[27:30], "little") + 1
+    return None
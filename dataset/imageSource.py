@@ -0,0 +1,389 @@
+"""
+    imageSource.py
+    Reads a dataset's images from disk, in place from within a zip or tar archive, or from a remote store
+"""
+
+import os
+import mmap
+import time
+import zlib
+import struct
+import tarfile
+import zipfile
+import threading
+
+import cv2
+import numpy as np
+
+from dataset.datasetScanner import IMAGE_EXTENSIONS, isImageHeader
+from dataset.imageProbe import probeDimensions
+from dataset.remoteSource import fetch, fetchRange, isRemote, remoteInfo
+
+# archives that can be read by random access, compressed tars have to be decompressed from the start
+ARCHIVE_EXTENSIONS = (".zip", ".tar")
+
+ZIP_LOCAL_HEADER = struct.Struct("<4s22xHH")  # signature, then the name and extra field lengths
+TAR_MEMBER = -1  # compression of tar members, which are always stored as is
+PROBE_SIZE = 4 << 10  # bytes first read to find an image's dimensions without reading the whole image
+INFLATE_CHUNK = 4 << 10  # compressed bytes fed to the decompressor at a time when only the start of a member is read
+HEADER_SIZE = 64 << 10  # as above for remote images, where reading more up front saves a round trip
+
+
+class ArchiveSource:
+    """
+        A zip or uncompressed tar archive read in place. Its members are indexed once, name -> data offset,
+        size and compression, and the index is kept with the project so reopening it does not walk the
+        archive again. Member data is read by random access from a memory map of the archive.
+    """
+    VERSION = 1
+    openSources = {}  # archive path -> source, shared by everything reading the dataset in this process
+    openLock = threading.Lock()
+
+    def __init__(self, archivePath: str, indexPath: str = None) -> None:
+        """ init """
+        self.archivePath = archivePath
+        self.indexPath = indexPath
+        self.archiveStat = archiveStat(archivePath)  # (mtime, size) of the archive the index describes
+        self.names = []  # member file names
+        self.memberIndexes = {}  # member name -> position in the index
+        self.offsets = np.zeros(0, dtype=np.int64)  # where each member's data starts in the archive
+        self.sizes = np.zeros(0, dtype=np.int64)  # bytes of data stored for each member
+        self.fileSizes = np.zeros(0, dtype=np.int64)  # bytes once decompressed
+        self.methods = np.zeros(0, dtype=np.int16)  # zip compression of each member, TAR_MEMBER for tars
+        self.mtimes = np.zeros(0, dtype=np.int64)
+        self.lock = threading.Lock()  # reads that cannot go through the map share the file handle
+        self.zipFile = None  # opened for members compressed with something other than deflate
+
+        self.file = open(archivePath, "rb")
+        try:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+        except (ValueError, OSError):
+            self.map = None  # empty, or on a filesystem that cannot be mapped
+
+        if not self.__loadIndex():
+            self.__buildIndex()
+            self.__saveIndex()
+        self.memberIndexes = {name: index for index, name in enumerate(self.names)}
+
+    @staticmethod
+    def open(archivePath: str, indexPath: str = None) -> "ArchiveSource":
+        """ Returns the open source of an archive, reindexing it if the archive has changed since it was opened """
+        with ArchiveSource.openLock:
+            source = ArchiveSource.openSources.get(archivePath)
+            if source is not None and source.archiveStat == archiveStat(archivePath) and indexPath in (None, source.indexPath):
+                return source
+            if source is not None:
+                # the archive was replaced, reads still in flight on the old source fail rather than return stale members
+                indexPath = indexPath or source.indexPath
+                source.close()
+            source = ArchiveSource(archivePath, indexPath)
+            ArchiveSource.openSources[archivePath] = source
+            return source
+
+    def close(self) -> None:
+        """ Releases the archive's map and file handles """
+        with self.lock:
+            if self.map is not None:
+                self.map.close()
+            if self.zipFile is not None:
+                self.zipFile.close()
+            self.file.close()
+
+    @staticmethod
+    def indexPaths() -> dict:
+        """ Returns the index path of every open archive, so another process can open them the same way """
+        with ArchiveSource.openLock:
+            return {archivePath: source.indexPath for archivePath, source in ArchiveSource.openSources.items()}
+
+    @staticmethod
+    def register(indexPaths: dict) -> None:
+        """ Opens archives from their index paths, used to set up worker processes """
+        for archivePath, indexPath in indexPaths.items():
+            try:
+                ArchiveSource.open(archivePath, indexPath)
+            except OSError as exc:
+                print(exc)
+
+    def imageNames(self) -> list:
+        """ Returns the names of the members that are images, hidden files and directories are skipped """
+        imageNames = []
+        for name in self.names:
+            if any(part.startswith(".") or part == "__MACOSX" for part in name.split("/")):
+                continue  # includes the resource forks macOS adds to zips it creates
+            extension = os.path.splitext(name)[1]
+            if extension:
+                if extension.lower() in IMAGE_EXTENSIONS:
+                    imageNames.append(name)
+            elif isImageHeader(self.readRange(name, 0, 12) or b""):
+                imageNames.append(name)
+        return imageNames
+
+    def stat(self, name: str):
+        """ Returns the (mtime, size, data offset) of a member in place of a file's (mtime, size, inode) """
+        index = self.memberIndexes.get(name)
+        if index is None:
+            return None
+        return int(self.mtimes[index]), int(self.fileSizes[index]), int(self.offsets[index])
+
+    def contains(self, name: str) -> bool:
+        """ Returns true if the archive has a member of that name """
+        return name in self.memberIndexes
+
+    def read(self, name: str):
+        """ Returns the contents of a member, None if there is no such member """
+        index = self.memberIndexes.get(name)
+        if index is None:
+            return None
+        method = int(self.methods[index])
+        if method == zipfile.ZIP_STORED or method == TAR_MEMBER:
+            return self.__readRange(int(self.offsets[index]), int(self.sizes[index]))
+        if method == zipfile.ZIP_DEFLATED:
+            return zlib.decompress(self.__readRange(int(self.offsets[index]), int(self.sizes[index])), -zlib.MAX_WBITS)
+        with self.lock:
+            if self.zipFile is None:
+                self.zipFile = zipfile.ZipFile(self.archivePath)
+            return self.zipFile.read(name)
+
+    def readRange(self, name: str, offset: int, size: int):
+        """ Returns part of a member, stored members are sliced from the map and others decompressed only that far """
+        index = self.memberIndexes.get(name)
+        if index is None:
+            return None
+        method = int(self.methods[index])
+        if method == zipfile.ZIP_STORED or method == TAR_MEMBER:
+            size = max(0, min(size, int(self.sizes[index]) - offset))
+            return self.__readRange(int(self.offsets[index]) + offset, size)
+        if method == zipfile.ZIP_DEFLATED:
+            # fed a chunk at a time, so only as much of the member is read as is needed to reach the end of the range
+            decompressor = zlib.decompressobj(-zlib.MAX_WBITS)
+            dataOffset, dataSize = int(self.offsets[index]), int(self.sizes[index])
+            data = b""
+            for chunkOffset in range(0, dataSize, INFLATE_CHUNK):
+                chunk = self.__readRange(dataOffset + chunkOffset, min(INFLATE_CHUNK, dataSize - chunkOffset))
+                data += decompressor.decompress(chunk, offset + size - len(data))
+                if len(data) >= offset + size or decompressor.eof:
+                    break
+            return data[offset:offset + size]
+        with self.lock:
+            if self.zipFile is None:
+                self.zipFile = zipfile.ZipFile(self.archivePath)
+            with self.zipFile.open(name) as member:
+                return member.read(offset + size)[offset:]
+
+    def __readRange(self, offset: int, size: int) -> bytes:
+        """ Reads a range of bytes of the archive """
+        if self.map is not None:
+            return self.map[offset:offset + size]
+        with self.lock:
+            self.file.seek(offset)
+            return self.file.read(size)
+
+    def __buildIndex(self) -> None:
+        """ Lists the archive's members """
+        names, offsets, sizes, fileSizes, methods, mtimes = [], [], [], [], [], []
+        try:
+            if self.archivePath.lower().endswith(".zip"):
+                with zipfile.ZipFile(self.archivePath) as archive:
+                    for info in archive.infolist():
+                        if info.is_dir():
+                            continue
+                        # the data follows the member's local header, whose extra field can differ from the
+                        # copy in the central directory
+                        header = self.__readRange(info.header_offset, ZIP_LOCAL_HEADER.size)
+                        signature, nameLength, extraLength = ZIP_LOCAL_HEADER.unpack(header)
+                        if signature != b"PK\x03\x04":
+                            print(f"Skipping {info.filename} in {self.archivePath}, its header is corrupt")
+                            continue
+                        names.append(info.filename)
+                        offsets.append(info.header_offset + ZIP_LOCAL_HEADER.size + nameLength + extraLength)
+                        sizes.append(info.compress_size)
+                        fileSizes.append(info.file_size)
+                        # encrypted members are left to zipfile, which will report them
+                        methods.append(info.compress_type if not info.flag_bits & 0x1 else -2)
+                        mtimes.append(int(time.mktime(info.date_time + (0, 0, -1))) * 1000000000)
+            else:
+                with tarfile.open(self.archivePath, "r:") as archive:
+                    for member in archive:
+                        if not member.isfile():
+                            continue
+                        names.append(member.name[2:] if member.name.startswith("./") else member.name)
+                        offsets.append(member.offset_data)
+                        sizes.append(member.size)
+                        fileSizes.append(member.size)
+                        methods.append(TAR_MEMBER)
+                        mtimes.append(int(member.mtime) * 1000000000)
+        except (OSError, zipfile.BadZipFile, tarfile.TarError) as exc:
+            print(f"Could not index {self.archivePath}: {exc}")
+
+        self.names = names
+        self.offsets = np.array(offsets, dtype=np.int64)
+        self.sizes = np.array(sizes, dtype=np.int64)
+        self.fileSizes = np.array(fileSizes, dtype=np.int64)
+        self.methods = np.array(methods, dtype=np.int16)
+        self.mtimes = np.array(mtimes, dtype=np.int64)
+
+    def __loadIndex(self) -> bool:
+        """ Reads the stored index, returns false if there is none or it describes another version of the archive """
+        if self.indexPath is None or not os.path.exists(self.indexPath):
+            return False
+        try:
+            with np.load(self.indexPath) as index:
+                if int(index["version"]) != self.VERSION or tuple(index["archiveStat"].tolist()) != self.archiveStat:
+                    return False
+                names = index["names"].tobytes().decode()
+                self.names = names.split("\n") if names else []
+                self.offsets = index["offsets"]
+                self.sizes = index["sizes"]
+                self.fileSizes = index["fileSizes"]
+                self.methods = index["methods"]
+                self.mtimes = index["mtimes"]
+            return True
+        except Exception as exc:
+            print(exc)
+            return False
+
+    def __saveIndex(self) -> None:
+        """ Writes the index out, names are stored as one block of text rather than an array of fixed width strings """
+        if self.indexPath is None:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.indexPath), exist_ok=True)
+            tempPath = self.indexPath + ".tmp.npz"
+            np.savez(tempPath, version=self.VERSION, archiveStat=np.array(self.archiveStat, dtype=np.int64),
+                     names=np.frombuffer("\n".join(self.names).encode(), dtype=np.uint8), offsets=self.offsets,
+                     sizes=self.sizes, fileSizes=self.fileSizes, methods=self.methods, mtimes=self.mtimes)
+            os.replace(tempPath, self.indexPath)
+        except Exception as exc:
+            print(exc)
+
+
+class ArchiveScanner:
+    """ Lists the images in an archive the same way DatasetScanner lists a directory tree """
+    def __init__(self, source: ArchiveSource, progressCallback=None) -> None:
+        """ init, progressCallback(directoriesScanned, imagesFound) is called once the archive is listed """
+        self.source = source
+        self.progressCallback = progressCallback
+        self.directories = []  # archives are not watched, so no directories are reported
+
+    def scan(self):
+        """ Yields (directory relative to the archive root, sorted image file names, member stats) per directory """
+        imagesByDirectory = {}
+        for name in self.source.imageNames():
+            directory, _, fileName = name.rpartition("/")
+            imagesByDirectory.setdefault(directory, []).append(fileName)
+
+        for directory in sorted(imagesByDirectory):
+            fileNames = sorted(imagesByDirectory[directory])
+            yield directory, fileNames, [self.source.stat(directory + "/" + fileName if directory else fileName) for fileName in fileNames]
+        if self.progressCallback:
+            self.progressCallback(len(imagesByDirectory), sum(len(fileNames) for fileNames in imagesByDirectory.values()))
+
+
+def archiveStat(archivePath: str) -> tuple:
+    """ Returns the (mtime, size) of an archive, used to tell when its index is out of date """
+    try:
+        stat = os.stat(archivePath)
+    except OSError:
+        return None
+    return stat.st_mtime_ns, stat.st_size
+
+
+def isArchive(path: str) -> bool:
+    """ Returns true if a dataset path is an archive to be read in place rather than a directory """
+    return path.lower().endswith(ARCHIVE_EXTENSIONS) and os.path.isfile(path)
+
+
+def splitArchivePath(imagePath: str):
+    """ Returns the (archive path, member name) of an image within an archive, None for any other image """
+    if isRemote(imagePath):
+        return None
+    for archivePath in list(ArchiveSource.openSources):
+        if imagePath.startswith(archivePath + "/"):
+            return archivePath, imagePath[len(archivePath) + 1:]
+
+    # an archive that has not been opened yet, e.g. in a worker process
+    lowerPath = imagePath.lower()
+    for extension in ARCHIVE_EXTENSIONS:
+        end = lowerPath.find(extension + "/")
+        while end != -1:
+            archivePath = imagePath[:end + len(extension)]
+            if os.path.isfile(archivePath):
+                return archivePath, imagePath[len(archivePath) + 1:]
+            end = lowerPath.find(extension + "/", end + 1)
+    return None
+
+
+def imageExists(imagePath: str) -> bool:
+    """ Returns true if an image is on disk, in its archive or in its remote store """
+    if isRemote(imagePath):
+        return remoteInfo(imagePath) is not None
+    member = splitArchivePath(imagePath)
+    if member is None:
+        return os.path.isfile(imagePath)
+    archivePath, name = member
+    try:
+        return ArchiveSource.open(archivePath).contains(name)
+    except OSError:
+        return False
+
+
+def readImage(imagePath: str):
+    """ Returns the encoded bytes of an image, None if it could not be read. Remote images go through the disk cache. """
+    if isRemote(imagePath):
+        return fetch(imagePath)
+    member = splitArchivePath(imagePath)
+    try:
+        if member is None:
+            with open(imagePath, "rb") as file:
+                return file.read()
+        archivePath, name = member
+        return ArchiveSource.open(archivePath).read(name)
+    except (OSError, ValueError, zlib.error, zipfile.BadZipFile) as exc:
+        print(exc)
+        return None
+
+
+def loadImage(imagePath: str, flags: int = cv2.IMREAD_COLOR):
+    """ Decodes an image with opencv wherever it is stored, None if it could not be read """
+    if not isRemote(imagePath) and splitArchivePath(imagePath) is None:
+        return cv2.imread(imagePath, flags)
+    data = readImage(imagePath)
+    if data is None:
+        return None
+    return cv2.imdecode(np.frombuffer(data, dtype=np.uint8), flags)
+
+
+def readImageRange(imagePath: str, offset: int, size: int):
+    """ Returns part of an image, fewer bytes near its end and None if it could not be read. Remote images are read with a range request. """
+    if isRemote(imagePath):
+        return fetchRange(imagePath, offset, size)
+    member = splitArchivePath(imagePath)
+    try:
+        if member is None:
+            with open(imagePath, "rb") as file:
+                file.seek(offset)
+                return file.read(size)
+        archivePath, name = member
+        return ArchiveSource.open(archivePath).readRange(name, offset, size)
+    except (OSError, ValueError, zlib.error, zipfile.BadZipFile) as exc:
+        print(exc)
+        return None
+
+
+def probeImage(imagePath: str):
+    """
+        Returns the (width, height) an image decodes to from its headers alone, None if its format is not one
+        that is probed. A first block is read up front, larger for remote images where every read is a round
+        trip, and anything past it, such as a jpeg frame after a large exif segment, is read as needed.
+    """
+    blockSize = HEADER_SIZE if isRemote(imagePath) else PROBE_SIZE
+    block = readImageRange(imagePath, 0, blockSize)
+    if block is None:
+        return None
+
+    def read(offset: int, size: int):
+        if offset + size <= len(block) or len(block) < blockSize:
+            return block[offset:offset + size]  # a short block is the whole image
+        return readImageRange(imagePath, offset, size)
+
+    return probeDimensions(read)
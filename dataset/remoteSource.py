@@ -0,0 +1,438 @@
+"""
+    remoteSource.py
+    Reads a dataset's images from an S3 compatible object store or a plain HTTP server through a local disk cache
+"""
+
+import os
+import hmac
+import hashlib
+import threading
+import http.client
+import urllib.parse
+import xml.etree.ElementTree as ElementTree
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from collections import OrderedDict
+
+from dataset.datasetScanner import IMAGE_EXTENSIONS
+
+CACHE_CAPACITY = 2 << 30  # bytes of fetched images kept on disk
+MAX_CONNECTIONS = 8  # requests in flight at once, across every host
+REQUEST_TIMEOUT = 30  # s
+REQUEST_ERRORS = (OSError, http.client.HTTPException)  # a request that failed, from the connection or the response
+
+
+def isRemote(path: str) -> bool:
+    """ Returns true if a dataset or image path is a url, image urls are held unquoted like any other path """
+    return path.startswith(("http://", "https://"))
+
+
+class ConnectionPool:
+    """
+        Keep-alive connections reused between requests, at most maxConnections are in use at once and the
+        rest of the callers wait for one to come free
+    """
+    def __init__(self, maxConnections: int = MAX_CONNECTIONS, timeout: float = REQUEST_TIMEOUT) -> None:
+        """ init """
+        self.slots = threading.BoundedSemaphore(maxConnections)
+        self.timeout = timeout
+        self.idle = {}  # (scheme, host, port) -> idle connections
+        self.lock = threading.Lock()
+
+    def request(self, method: str, url: str, headers: dict = None) -> tuple:
+        """ Makes a request, returns the (status, headers with lower case names, body) of the response """
+        parts = urllib.parse.urlsplit(url)
+        key = (parts.scheme, parts.hostname, parts.port)
+        target = (parts.path or "/") + ("?" + parts.query if parts.query else "")
+        with self.slots:
+            for attempt in range(2):
+                connection = self.__take(key)
+                try:
+                    connection.request(method, target, headers=headers or {})
+                    response = connection.getresponse()
+                    body = response.read()
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    if attempt == 1:
+                        raise
+                    continue  # most likely a kept-alive connection the server has since closed
+                if response.will_close:
+                    connection.close()
+                else:
+                    with self.lock:
+                        self.idle.setdefault(key, []).append(connection)
+                return response.status, {name.lower(): value for name, value in response.getheaders()}, body
+
+    def __take(self, key: tuple) -> http.client.HTTPConnection:
+        """ Returns an idle connection to a host or opens a new one """
+        with self.lock:
+            connections = self.idle.get(key)
+            if connections:
+                return connections.pop()
+        scheme, host, port = key
+        if scheme == "https":
+            return http.client.HTTPSConnection(host, port, timeout=self.timeout)
+        return http.client.HTTPConnection(host, port, timeout=self.timeout)
+
+
+class S3Credentials:
+    """ Signs requests with AWS signature version 4, for buckets that are not public """
+    def __init__(self, accessKey: str, secretKey: str, region: str, sessionToken: str = None) -> None:
+        """ init """
+        self.accessKey = accessKey
+        self.secretKey = secretKey
+        self.region = region
+        self.sessionToken = sessionToken
+
+    @staticmethod
+    def fromEnvironment():
+        """ Returns credentials from the usual AWS environment variables, None if there are none """
+        accessKey = os.environ.get("AWS_ACCESS_KEY_ID")
+        secretKey = os.environ.get("AWS_SECRET_ACCESS_KEY")
+        if not accessKey or not secretKey:
+            return None
+        return S3Credentials(accessKey, secretKey, os.environ.get("AWS_REGION", "us-east-1"), os.environ.get("AWS_SESSION_TOKEN"))
+
+    def sign(self, method: str, url: str, headers: dict) -> dict:
+        """ Returns the headers with the signature added, payloads are left unsigned """
+        parts = urllib.parse.urlsplit(url)
+        now = datetime.now(timezone.utc)
+        amzDate = now.strftime("%Y%m%dT%H%M%SZ")
+        scope = f"{now:%Y%m%d}/{self.region}/s3/aws4_request"
+
+        signed = dict(headers, **{"host": parts.netloc, "x-amz-date": amzDate, "x-amz-content-sha256": "UNSIGNED-PAYLOAD"})
+        if self.sessionToken:
+            signed["x-amz-security-token"] = self.sessionToken
+        names = sorted(name.lower() for name in signed)
+        values = {name.lower(): str(value).strip() for name, value in signed.items()}
+        query = "&".join(f"{urllib.parse.quote(name, safe='-_.~')}={urllib.parse.quote(value, safe='-_.~')}"
+                         for name, value in sorted(urllib.parse.parse_qsl(parts.query, keep_blank_values=True)))
+        canonicalRequest = "\n".join([method, parts.path or "/", query,
+                                      "".join(f"{name}:{values[name]}\n" for name in names),
+                                      ";".join(names), "UNSIGNED-PAYLOAD"])
+        stringToSign = "\n".join(["AWS4-HMAC-SHA256", amzDate, scope, hashlib.sha256(canonicalRequest.encode()).hexdigest()])
+
+        key = ("AWS4" + self.secretKey).encode()
+        for part in (f"{now:%Y%m%d}", self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, stringToSign.encode(), hashlib.sha256).hexdigest()
+        signed["authorization"] = (f"AWS4-HMAC-SHA256 Credential={self.accessKey}/{scope}, "
+                                   f"SignedHeaders={';'.join(names)}, Signature={signature}")
+        del signed["host"]  # set by the connection
+        return signed
+
+
+class RemoteCache:
+    """
+        Fetched images kept on disk, capped at capacity bytes with the least recently used evicted first.
+        Recency survives between sessions as each file's mtime, which is touched on every hit.
+    """
+    sharedCache = None
+    sharedLock = threading.Lock()
+
+    def __init__(self, cacheDir: str, capacity: int = CACHE_CAPACITY) -> None:
+        """ init """
+        self.cacheDir = cacheDir
+        self.capacity = capacity
+        self.entries = OrderedDict()  # key -> bytes on disk, least recently used first
+        self.size = 0
+        self.lock = threading.Lock()
+
+        cached = []
+        for root, _, fileNames in os.walk(cacheDir):
+            for fileName in fileNames:
+                if fileName.endswith(".tmp"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, fileName))
+                except OSError:
+                    continue
+                cached.append((stat.st_mtime_ns, os.path.basename(root) + fileName, stat.st_size))
+        for _, key, size in sorted(cached):
+            self.entries[key] = size
+            self.size = self.size + size
+
+    @staticmethod
+    def shared() -> "RemoteCache":
+        """ Returns the cache shared by every project, created on first use """
+        with RemoteCache.sharedLock:
+            if RemoteCache.sharedCache is None:
+                RemoteCache.sharedCache = RemoteCache(os.getcwd() + "/projects/.remoteCache")
+            return RemoteCache.sharedCache
+
+    @staticmethod
+    def key(url: str, etag: str = None) -> str:
+        """ Returns the key of a url, the etag is included so a replaced object is not served stale """
+        return hashlib.blake2b(f"{url}\n{etag or ''}".encode(), digest_size=16).hexdigest()
+
+    def path(self, key: str) -> str:
+        """ Returns where an entry is kept, fanned out over directories by its first two characters """
+        return self.cacheDir + "/" + key[:2] + "/" + key[2:]
+
+    def get(self, key: str, start: int = 0, length: int = None):
+        """ Returns an entry's bytes, or a range of them, None if it is not cached """
+        with self.lock:
+            if key not in self.entries:
+                return None
+            self.entries.move_to_end(key)
+        try:
+            with open(self.path(key), "rb") as file:
+                file.seek(start)
+                data = file.read() if length is None else file.read(length)
+            os.utime(self.path(key))
+            return data
+        except OSError:
+            with self.lock:
+                self.size = self.size - self.entries.pop(key, 0)
+            return None
+
+    def put(self, key: str, data: bytes) -> None:
+        """ Stores an entry, evicting the least recently used until the cache fits """
+        filePath = self.path(key)
+        try:
+            os.makedirs(os.path.dirname(filePath), exist_ok=True)
+            tempPath = f"{filePath}.{threading.get_ident()}.tmp"
+            with open(tempPath, "wb") as file:
+                file.write(data)
+            os.replace(tempPath, filePath)
+        except OSError as exc:
+            print(exc)
+            return
+
+        evicted = []
+        with self.lock:
+            self.size = self.size - self.entries.pop(key, 0) + len(data)
+            self.entries[key] = len(data)
+            while self.size > self.capacity and len(self.entries) > 1:
+                evictedKey, size = self.entries.popitem(last=False)
+                self.size = self.size - size
+                evicted.append(evictedKey)
+        for evictedKey in evicted:
+            try:
+                os.remove(self.path(evictedKey))
+            except OSError:
+                pass
+
+
+class RemoteSource:
+    """
+        A dataset under a url prefix. On an S3 compatible store, where the first path segment is the bucket,
+        the objects are listed with ListObjectsV2, on a plain HTTP server from an index.txt of relative paths
+        kept under the prefix. Images are fetched once into the shared disk cache and read from there after.
+    """
+    pool = ConnectionPool()
+    credentials = S3Credentials.fromEnvironment()
+    openSources = {}  # dataset url -> source
+    openLock = threading.Lock()
+    statted = {}  # url -> (mtime, size, etag) of objects that were not listed with one, kept until their dataset is listed again
+    stattedLock = threading.Lock()
+
+    def __init__(self, datasetUrl: str) -> None:
+        """ init """
+        self.datasetUrl = datasetUrl.rstrip("/")
+        self.objects = {}  # relative path -> (mtime, size, etag) from the last listing
+
+    @staticmethod
+    def open(datasetUrl: str) -> "RemoteSource":
+        """ Returns the source of a dataset url, shared so a listing is made once """
+        with RemoteSource.openLock:
+            source = RemoteSource.openSources.get(datasetUrl)
+            if source is None:
+                source = RemoteSource(datasetUrl)
+                RemoteSource.openSources[datasetUrl] = source
+            return source
+
+    def list(self) -> dict:
+        """
+            Lists the objects under the dataset url, returns a dict of relative path -> (mtime, size, etag).
+            If the listing fails the previous one is kept, so an unreachable store does not look emptied.
+        """
+        try:
+            objects = self.__listObjects()
+        except REQUEST_ERRORS as exc:
+            print(f"Could not list {self.datasetUrl}: {exc}")
+            return self.objects
+
+        # objects statted since the last listing are statted again, in case they changed along with it
+        with RemoteSource.stattedLock:
+            for url in [url for url in RemoteSource.statted if url.startswith(self.datasetUrl + "/")]:
+                del RemoteSource.statted[url]
+        self.objects = objects
+        return objects
+
+    def __listObjects(self) -> dict:
+        """ Lists the objects with ListObjectsV2, falling back to an index.txt if the url is not a bucket """
+        parts = urllib.parse.urlsplit(self.datasetUrl)
+        bucket, _, prefix = parts.path.strip("/").partition("/")
+        bucketUrl = f"{parts.scheme}://{parts.netloc}/{bucket}"
+        prefix = prefix + "/" if prefix else ""
+
+        objects = {}
+        continuationToken = None
+        while True:
+            query = {"list-type": "2", "prefix": prefix}
+            if continuationToken:
+                query["continuation-token"] = continuationToken
+            status, _, body = request("GET", bucketUrl + "?" + urllib.parse.urlencode(query))
+            try:
+                listing = ElementTree.fromstring(body) if status == 200 else None
+            except ElementTree.ParseError:
+                listing = None
+            if listing is None or not listing.tag.endswith("ListBucketResult"):
+                return self.__listIndex()
+
+            namespace = listing.tag[:-len("ListBucketResult")]
+            for content in listing.iter(namespace + "Contents"):
+                key = content.findtext(namespace + "Key")
+                if key.endswith("/"):
+                    continue
+                modified = datetime.fromisoformat(content.findtext(namespace + "LastModified").replace("Z", "+00:00"))
+                objects[key[len(prefix):]] = (int(modified.timestamp() * 1e9), int(content.findtext(namespace + "Size")),
+                                              content.findtext(namespace + "ETag").strip('"'))
+            continuationToken = listing.findtext(namespace + "NextContinuationToken")
+            if listing.findtext(namespace + "IsTruncated") != "true" or not continuationToken:
+                break
+        return objects
+
+    def __listIndex(self) -> dict:
+        """ Reads the index.txt of a plain HTTP dataset, objects are statted as they are needed """
+        status, _, body = request("GET", self.datasetUrl + "/index.txt")
+        if status != 200:
+            print(f"Could not list {self.datasetUrl}, it is neither a bucket nor has an index.txt ({status})")
+            return {}
+        return {line.strip().lstrip("/"): None for line in body.decode().splitlines() if line.strip()}
+
+    def imageNames(self) -> list:
+        """ Returns the relative paths of the images listed, hidden files and directories are skipped """
+        return [name for name in self.list()
+                if not any(part.startswith(".") for part in name.split("/"))
+                and os.path.splitext(name)[1].lower() in IMAGE_EXTENSIONS]
+
+    def stat(self, name: str):
+        """ Returns the (mtime, size, etag as an integer) of an object in place of a file's (mtime, size, inode) """
+        info = self.objects.get(name) or remoteInfo(self.datasetUrl + "/" + name)
+        if info is None:
+            return None
+        mtime, size, etag = info
+        return mtime, size, int.from_bytes(hashlib.blake2b(etag.encode(), digest_size=7).digest(), "little")
+
+
+class RemoteScanner:
+    """ Lists the images of a remote dataset the same way DatasetScanner lists a directory tree """
+    def __init__(self, source: RemoteSource, progressCallback=None) -> None:
+        """ init, progressCallback(directoriesScanned, imagesFound) is called once the dataset is listed """
+        self.source = source
+        self.progressCallback = progressCallback
+        self.directories = []  # remote datasets are not watched, so no directories are reported
+
+    def scan(self):
+        """ Yields (directory relative to the dataset url, sorted image file names, object stats) per directory """
+        imagesByDirectory = {}
+        for name in self.source.imageNames():
+            directory, _, fileName = name.rpartition("/")
+            imagesByDirectory.setdefault(directory, []).append(fileName)
+
+        for directory in sorted(imagesByDirectory):
+            fileNames = sorted(imagesByDirectory[directory])
+            yield directory, fileNames, [self.source.stat(directory + "/" + fileName if directory else fileName) for fileName in fileNames]
+        if self.progressCallback:
+            self.progressCallback(len(imagesByDirectory), sum(len(fileNames) for fileNames in imagesByDirectory.values()))
+
+
+def request(method: str, url: str, headers: dict = None) -> tuple:
+    """ Makes a request through the shared pool, signed if there are credentials. Paths are quoted here. """
+    parts = urllib.parse.urlsplit(url)
+    url = urllib.parse.urlunsplit(parts._replace(path=urllib.parse.quote(parts.path, safe="/-_.~")))
+    headers = headers or {}
+    if RemoteSource.credentials:
+        headers = RemoteSource.credentials.sign(method, url, headers)
+    return RemoteSource.pool.request(method, url, headers)
+
+
+def remoteInfo(url: str):
+    """
+        Returns the (mtime, size, etag) of an object, None if it does not exist. Listed objects are taken from the
+        listing, others are statted with a HEAD request once and remembered until their dataset is listed again.
+    """
+    for datasetUrl, source in list(RemoteSource.openSources.items()):
+        if url.startswith(datasetUrl + "/"):
+            info = source.objects.get(url[len(datasetUrl) + 1:])
+            if info is not None:
+                return info
+    with RemoteSource.stattedLock:
+        info = RemoteSource.statted.get(url)
+    if info is not None:
+        return info
+
+    try:
+        status, headers, _ = request("HEAD", url)
+    except REQUEST_ERRORS as exc:
+        print(exc)
+        return None
+    if status != 200:
+        return None
+    modified = headers.get("last-modified")
+    mtime = int(parsedate_to_datetime(modified).timestamp() * 1e9) if modified else 0
+    info = mtime, int(headers.get("content-length", 0)), headers.get("etag", "").strip('"')
+    with RemoteSource.stattedLock:
+        RemoteSource.statted[url] = info
+    return info
+
+
+def remoteHash(url: str):
+    """
+        Returns a digest of an object's etag, which changes with its contents, None if it does not exist. Being
+        a digest of the etag rather than the contents, it never matches the digest of a local copy of the image.
+    """
+    info = remoteInfo(url)
+    if info is None or not info[2]:
+        return None
+    return hashlib.blake2b(info[2].encode(), digest_size=16).digest()
+
+
+def fetch(url: str):
+    """ Returns an object's bytes from the cache, fetching it on a miss, None if it could not be fetched """
+    info = remoteInfo(url)
+    if info is None:
+        return None
+    cache = RemoteCache.shared()
+    key = RemoteCache.key(url, info[2])
+    data = cache.get(key)
+    if data is not None:
+        return data
+
+    try:
+        status, _, data = request("GET", url)
+    except REQUEST_ERRORS as exc:
+        print(exc)
+        return None
+    if status != 200:
+        print(f"Could not fetch {url} ({status})")
+        return None
+    cache.put(key, data)
+    return data
+
+
+def fetchRange(url: str, start: int, length: int):
+    """ Returns a range of an object's bytes, from the cache if it is cached or else with a range request """
+    info = remoteInfo(url)
+    if info is None:
+        return None
+    data = RemoteCache.shared().get(RemoteCache.key(url, info[2]), start, length)
+    if data is not None:
+        return data
+
+    try:
+        status, headers, data = request("GET", url, {"Range": f"bytes={start}-{start + length - 1}"})
+    except REQUEST_ERRORS as exc:
+        print(exc)
+        return None
+    if status == 206:
+        if start == 0 and headers.get("content-range", "").endswith(f"/{len(data)}"):
+            RemoteCache.shared().put(RemoteCache.key(url, info[2]), data)  # the range covered the whole object
+        return data
+    if status == 200:
+        # the server ignored the range and sent the whole object, which may as well be kept
+        RemoteCache.shared().put(RemoteCache.key(url, info[2]), data)
+        return data[start:start + length]
+    return None
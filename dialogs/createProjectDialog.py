@@ -5,7 +5,10 @@
 import os
 from PyQt6.QtWidgets import QFileDialog
 from PyQt6.QtWidgets import QDialog
+from PyQt6.QtWidgets import QCheckBox
 
+from dataset.imageSource import isArchive
+from dataset.remoteSource import isRemote
 from dialogs.ui.createProjectDialog_ui import Ui_MainDialog
 
 
@@ -23,6 +26,13 @@ class CreateProjectDialog(QDialog):
 
         self.projectName = ""
         self.imageDirectory = ""
+        self.useImageStore = False
+
+        # images can be kept in the store shared by every project, so a dataset used by several is held once
+        self.imageStoreCheck = QCheckBox("Share images with other projects", parent=self.ui.mainFrame)
+        self.imageStoreCheck.setToolTip("Copies the images into a store shared by every project, "
+                                        "so metadata and thumbnails worked out by one project are reused by the others")
+        self.ui.verticalLayout_2.insertWidget(self.ui.verticalLayout_2.indexOf(self.ui.inputFrame) + 1, self.imageStoreCheck)
 
         # Connecting signals and slots for the dialog
         self.ui.dirSearchBtn.clicked.connect(lambda: self.__getImageDirectory())
@@ -60,7 +70,8 @@ class CreateProjectDialog(QDialog):
                     "border : 1px solid #373737;"
                     "}")
 
-        if imageDirectory == "" or not os.path.isdir(imageDirectory): 
+        # a zip or tar archive of images, or the url of a bucket or web server, can be used in place of a directory
+        if imageDirectory == "" or not (os.path.isdir(imageDirectory) or isArchive(imageDirectory) or isRemote(imageDirectory)):
             self.ui.imageDirInput.setStyleSheet("QLineEdit"
                                 "{"
                                 "border : 1px solid red;"
@@ -76,5 +87,6 @@ class CreateProjectDialog(QDialog):
         
         self.projectName = projectName
         self.imageDirectory = imageDirectory
+        self.useImageStore = self.imageStoreCheck.isChecked()
 
         return self.done(1)
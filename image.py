@@ -2,14 +2,16 @@
     image.py
 """
 
-import os
-import cv2
+from dataset.imageSource import imageExists, loadImage, probeImage
 
 
 class Image():
     """ A class to abstractly represent an image """
     def __init__(self, imagePath, boundingBoxes = []) -> None:
         self.path = imagePath 
+        self.index = None  # position of the image within the annotation dataset
+        self.dataset = None  # annotation dataset that keeps the image's flags, so they outlive this object
+        self.flags = {"isValid": True, "needsWork": False}  # used while the image is not part of a dataset
        
         self.isValid = True
         
@@ -21,6 +23,8 @@ class Image():
         self.height = None
         self.width = None
         self.channels = None
+        self.digest = None  # hash of the contents, set when the project keeps its images in the shared store
+        self.imageStore = None
 
         # Annotation related attributes
         self.annotated = False
@@ -28,6 +32,36 @@ class Image():
         
         if self.boundingBoxes:
             self.annotated = True
+
+    @property
+    def isValid(self) -> bool:
+        return self.__flag("isValid")
+
+    @isValid.setter
+    def isValid(self, value: bool) -> None:
+        self.__setFlag("isValid", value)
+
+    @property
+    def needsWork(self) -> bool:
+        return self.__flag("needsWork")
+
+    @needsWork.setter
+    def needsWork(self, value: bool) -> None:
+        self.__setFlag("needsWork", value)
+
+    def __flag(self, name: str) -> bool:
+        """ Returns a flag, from the dataset when the image belongs to one """
+        if self.dataset is not None:
+            return self.dataset.imageFlag(self.index, name, self.flags[name])
+        return self.flags[name]
+
+    def __setFlag(self, name: str, value: bool) -> None:
+        """ Sets a flag, in the dataset when the image belongs to one so every copy of the image sees it """
+        if self.dataset is not None:
+            if self.__flag(name) != value:
+                self.dataset.setImageFlag(self.index, name, value)
+        else:
+            self.flags[name] = value
     
 
     def updateBoundingBoxes(self, boundingBoxes) -> None:
@@ -37,21 +71,51 @@ class Image():
         if len(self.boundingBoxes) > 0:
             self.annotated = True
 
+    def dataPath(self) -> str:
+        """ Returns where the image's contents are read from, its copy in the image store if there is one """
+        if self.imageStore is not None and self.digest is not None and self.imageStore.contains(self.digest):
+            return self.imageStore.objectPath(self.digest)
+        return self.path
+
     def createMetadata(self) -> None:
         """ Creates basic metadata for the image"""
         
         if self.metadataCreated:
             return
-    
-        if not os.path.exists(self.path):
+
+        # worked out once for every project that shares the image
+        if self.imageStore is not None and self.digest is not None:
+            metadata = self.imageStore.metadata(self.digest)
+            if metadata is not None:
+                self.height, self.width, self.channels = metadata
+                self.metadataCreated = True
+                return
+
+        dataPath = self.dataPath()
+        if not imageExists(dataPath):
             print("not valid path")
             return
 
-        image = cv2.imread(self.path) 
+        # sized from the headers where the format is known, so only a few bytes are read and nothing is decoded
+        dimensions = probeImage(dataPath)
+        if dimensions is not None:
+            self.width, self.height = dimensions
+            self.channels = 3  # images are always decoded to bgr
+            self.metadataCreated = True
+            self.__storeMetadata()
+            return
+
+        image = loadImage(dataPath)
         if image is None:
             self.isValid = False
             return
 
         self.height, self.width, self.channels = image.shape
         self.metadataCreated = True
+        self.__storeMetadata()
+
+    def __storeMetadata(self) -> None:
+        """ Shares the metadata through the image store """
+        if self.imageStore is not None and self.digest is not None:
+            self.imageStore.putMetadata(self.digest, self.height, self.width, self.channels)
 
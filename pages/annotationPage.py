@@ -41,6 +41,10 @@ class AnnotationPage():
     """
         Class to set up the functionality for the annotation page
     """
+    PREFETCH_AHEAD = 3  # images prefetched in the direction of travel
+    PREFETCH_BEHIND = 1  # and in the opposite direction
+    PREFETCH_SEARCH_LIMIT = 4096  # images checked when predicting the next unannotated image
+
     def __init__(self, app) -> None:
         # TODO: fix up app type to yoloant app involes add future annotations and some if typing
         self.app = app
@@ -61,9 +65,11 @@ class AnnotationPage():
         # Page attributes:
         self.currentIndex = 0
         self.pageInitialised = False
+        self.navigationDirection = 1  # 1 when moving forwards through the dataset, -1 when moving backwards
         
-        # Dict to hold the unannotatedImages
+        # Dict to hold the unannotatedImages, keyed by path as image objects are rebuilt when their page is evicted
         self.unannotatedImages = {}
+        self.prefetchedIndexes = {}  # data path -> index of the images last prefetched, to match decode failures to images
 
         # Connecting signals and slots for the page
         self.__connectIconHover()
@@ -74,6 +80,8 @@ class AnnotationPage():
         self.annotationManager.classAddAnnoPageBtn.clicked.connect(self.__openCreateClassDialog)
         self.ui.editPageBtn.toggled.connect(lambda toggled: self.annotationManager.setEditMode(toggled))
         self.ui.annotationCanvas.new_annotation.connect(lambda annotation: self.annotationManager.generateAnnotationItem(annotation))
+        self.ui.annotationCanvas.prefetcher.decodeFailed.connect(lambda dataPath: self.__onDecodeFailed(self.prefetchedIndexes.get(dataPath), dataPath))
+        self.ui.annotationCanvas.imageDecodeFailed.connect(lambda image: self.__onDecodeFailed(image.index, image.dataPath()))
 
     def __connectImageNavigationButtons(self):
         """ Connects the buttons used to navigate throughout the canvas"""
@@ -103,6 +111,7 @@ class AnnotationPage():
         self.updateAnnotationToolSelected(Tools.mouseTool)
         # self.__updateImageInformationPanel()
         self.__updateAnnotationManager(self.app.project.annotationDataset[self.currentIndex])
+        self.__prefetchNeighbours()
 
     def updateAnnotationToolSelected(self, tool: Tools) -> None:
         """ Updates the mouse icon based on selected tool """
@@ -176,6 +185,10 @@ class AnnotationPage():
         #TODO: not the best place for this, but have to save the image somewhere else as well, i.e. not only when navigating :(
         #TODO: this logic assumes that a new image will be found only when moving next not previously
         self.__checkImageState(self.app.project.annotationDataset[self.currentIndex])
+        if navigationType in (NavigationModes.next, NavigationModes.nextUnannotated):
+            self.navigationDirection = 1
+        else:
+            self.navigationDirection = -1
         if navigationType is NavigationModes.next:
             if (self.currentIndex + 1) < len(self.app.project.imageDataset):
                 # Setup the next image
@@ -206,7 +219,7 @@ class AnnotationPage():
             # If we couldnt find anything in the cache, check annotation dataset 
             if closestIndex is None:
                 for i in range(self.currentIndex + 1, len(self.app.project.annotationDataset) - 1):
-                    if not self.app.project.annotationDataset[i].annotated:
+                    if not self.app.project.annotationDataset.isAnnotated(i):
                         closestIndex = i
                         break
             if closestIndex is not None:
@@ -225,7 +238,7 @@ class AnnotationPage():
             # if we couldnt find anything in the cache, check annotation dataset
             if closestIndex is None:
                 for i in range(self.currentIndex - 1, len(self.app.project.annotationDataset), -1):
-                    if not self.app.project.annotationDataset[i].annotated:
+                    if not self.app.project.annotationDataset.isAnnotated(i):
                         closestIndex = i
                         break
             if closestIndex is not None:
@@ -235,15 +248,55 @@ class AnnotationPage():
         # after switching image - update widgets
         self.__updateImageInformationPanel()
         self.__updateAnnotationManager(self.app.project.annotationDataset[self.currentIndex])
+        self.__prefetchNeighbours()
+
+    def __prefetchNeighbours(self) -> None:
+        """
+            Has the images most likely to be shown next decoded in the background: the next one in the direction
+            of travel, the unannotated image that skipping ahead would land on, then the rest either side. The
+            image shown comes first, it may still be being decoded to replace its preview.
+        """
+        annotationDataset = self.app.project.annotationDataset
+        ahead = [self.currentIndex + self.navigationDirection * step for step in range(1, self.PREFETCH_AHEAD + 1)]
+        behind = [self.currentIndex - self.navigationDirection * step for step in range(1, self.PREFETCH_BEHIND + 1)]
+
+        unannotatedIndex = None
+        searchStop = min(max(self.currentIndex + self.navigationDirection * self.PREFETCH_SEARCH_LIMIT, -1), len(annotationDataset))
+        for index in range(self.currentIndex + self.navigationDirection, searchStop, self.navigationDirection):
+            if not annotationDataset.isAnnotated(index):
+                unannotatedIndex = index
+                break
+
+        indexes = [self.currentIndex] + ahead[:1] + ([unannotatedIndex] if unannotatedIndex is not None else []) + ahead[1:] + behind
+        self.prefetchedIndexes = {}
+        for index in dict.fromkeys(indexes):
+            if 0 <= index < len(annotationDataset):
+                image = annotationDataset[index]
+                if image.isValid:  # images known to be unreadable are not worth the attempt
+                    self.prefetchedIndexes[image.dataPath()] = index
+        self.app.ui.annotationCanvas.prefetcher.prefetch(list(self.prefetchedIndexes))
+
+    def __onDecodeFailed(self, index, dataPath: str) -> None:
+        """ Marks an image that was read but would not decode as invalid, so it is skipped from now on """
+        project = self.app.project
+        # the failure may be for a project, or a version of the dataset, that has since been replaced
+        if project is None or index is None or index >= len(project.annotationDataset):
+            return
+        image = project.annotationDataset[index]
+        if image.dataPath() != dataPath or not image.isValid:
+            return
+        project.markImageInvalid(index)
+        if index == self.currentIndex:
+            self.app.notificationManager.raiseNotification(f"Image {image.path} is not valid")
 
     def __checkImageState(self, image) -> None:
         """ Checks the current images state and updates related properties """
         # this removes the image from the unannotated list if it has been annotated
-        if image.annotated and (image in self.unannotatedImages):
-            self.unannotatedImages.pop(image)
+        if image.annotated and (image.path in self.unannotatedImages):
+            self.unannotatedImages.pop(image.path)
         # adds image to unannotated list if not annotated
         if not image.annotated:
-            self.unannotatedImages.update({self.app.project.annotationDataset[self.currentIndex]:self.currentIndex})
+            self.unannotatedImages.update({image.path:self.currentIndex})
     
     def __openCreateClassDialog(self) -> None:
         """ Opens the create class dialog """
@@ -251,7 +304,9 @@ class AnnotationPage():
         self.createClassDialog.exec()
         if self.createClassDialog.isValid:
             _class = MLClass(self.createClassDialog.className, self.createClassDialog.selectedColour)
-            self.app.project.classesDataset.append(_class) 
+            if not self.app.project.addClass(_class):
+                self.app.notificationManager.raiseNotification("Classes are looked after by another annotator of this project")
+                return
             self.annotationManager.generateClassItem(_class.className, _class.classColour)
 
     def __setupPagePalette(self) -> None:
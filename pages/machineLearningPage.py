@@ -64,42 +64,49 @@ class MachineLearningPage():
         if not self.model or self.loading:
             return
         self.model.batchSize = self.batchsizeLineEdit.text()
+        self.app.project.modelsDirty = True
 
     def __updateModelEpochs(self) -> None:
         """ Updates epochs member on a model object """
         if not self.model or self.loading:
             return
         self.model.epochs = self.epochsLineEdit.text()
+        self.app.project.modelsDirty = True
 
     def __updateModelImageWidth(self) -> None:
         """ Updates image width member on a model object """
         if not self.model or self.loading:
             return
         self.model.dimensions[0] = self.widthLineEdit.text()
+        self.app.project.modelsDirty = True
 
     def __updateModelImageHeight(self) -> None:
         """ Updates image height member on a model object """
         if not self.model or self.loading:
             return
         self.model.dimensions[1] = self.heightLineEdit.text()
+        self.app.project.modelsDirty = True
 
     def __updateModelWorkers(self) -> None:
         """ Updates workers member on a model object """
         if not self.model or self.loading:
             return
         self.model.workers = self.workersLineEdit.text()
+        self.app.project.modelsDirty = True
 
     def __updateModelModelType(self, modelType) -> None:
         """ Updates model type member on a model object """
         if not self.model or self.loading:
             return
         self.model.modelType = modelType
+        self.app.project.modelsDirty = True
 
     def __updateModelDevice(self, device) -> None:
         """ Updates device member on a model object """
         if not self.model or self.loading:
             return
         self.model.device = device
+        self.app.project.modelsDirty = True
 
     def __setEditMode(self, toggled):
         """ Connects the edit button to editable widgets """ 
@@ -121,7 +128,7 @@ class MachineLearningPage():
         if self.createModelDialog.result() == 1:
             model = Model(self.createModelDialog.modelName)
             # Update internally tracked model dataset
-            self.app.project.modelDataset.append(model)
+            self.app.project.addModel(model)
  
             # Reload page with model
             self.loadPage(model)
@@ -178,10 +185,7 @@ class MachineLearningPage():
  
     def __populateAttributesPanel(self, model) -> None:
         """ Populates the attributes panel"""
-        annotatedImagesCount = 0  # Probably should do this better - but a TODO
-        for image in self.app.project.annotationDataset:
-            if image.annotated:
-                annotatedImagesCount = annotatedImagesCount + 1
+        annotatedImagesCount = self.app.project.countAnnotatedImages()
         self.imagesAnnoInfoLabel.setText(str(annotatedImagesCount))
 
     def __updateModelComboBox(self) -> None:
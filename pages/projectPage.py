@@ -2,11 +2,12 @@
     projectPage.py
 """
 
+import os
 import cv2
 import sys
 
 from PyQt6 import QtWidgets, QtCore, QtGui
-from PyQt6.QtWidgets import QListWidget, QSizePolicy, QVBoxLayout, QSpacerItem, QGraphicsDropShadowEffect, QHBoxLayout, QFileDialog
+from PyQt6.QtWidgets import QListWidget, QSizePolicy, QVBoxLayout, QSpacerItem, QGraphicsDropShadowEffect, QHBoxLayout, QFileDialog, QMessageBox, QPushButton, QMenu, QInputDialog, QProgressDialog
 from PyQt6.QtGui import QCursor, QFont, QColor, QIcon
 from pyqtgraph import PlotWidget, plot
 
@@ -21,6 +22,8 @@ from custom_widgets.customBaseObjects.customPanelQTextEdit import CustomPanelQTe
 from custom_widgets.projectClassListItemWidget import ProjectClassListItemWidget
 from custom_widgets.projectImagePushButton import ProjectImagePushButton
 from dialogs.createClassDialog import CreateClassDialog
+from storage.annotationMerge import MergePolicies
+from bundleExporter import BundleExporter
 
 class ProjectPage():
     """
@@ -42,9 +45,13 @@ class ProjectPage():
 
         self.numOfClasses = 30
         self.readOnly = True
+        self.bundleExporter = None
+        self.exportProgressDialog = None
 
         # Connect signals and slots
         self.ui.addClassBtn.clicked.connect(lambda: self.__instantiateCreateClassDialog())
+        self.__createExportBundleButton()
+        self.__createVersionsButton()
         self.ui.editPageBtn.toggled.connect(lambda toggled: self.setEditMode(toggled))
         self.projectImageBtn.clicked.connect(lambda: self.__updateProjectIcon())
 
@@ -61,10 +68,12 @@ class ProjectPage():
         
     def __updateClassList(self) -> None:
         self.classListWidget.clear()
+        classCounts = self.app.project.countAnnotationsPerClass()
+        numOfAnnotations = sum(classCounts.values())
         for mlClass in self.app.project.classesDataset:
             classListItem = ProjectClassListItemWidget(mlClass.className,
-                                                       0,
-                                                       0,
+                                                       classCounts.get(mlClass.className, 0),
+                                                       numOfAnnotations,
                                                        mlClass.classColour,
                                                        self.app.theme.colours,
                                                        self.app.fontTypeRegular,
@@ -77,6 +86,147 @@ class ProjectPage():
             self.__populateWidgets()
             self.__createPlot()
 
+    def __createExportBundleButton(self) -> None:
+        """ Adds a button alongside add class to export the project as a bundle """
+        self.exportBundleBtn = QPushButton("Export", parent=self.ui.frame_5)
+        self.exportBundleBtn.setMinimumSize(QtCore.QSize(90, 30))
+        self.exportBundleBtn.setMaximumSize(QtCore.QSize(90, 16777215))
+        self.exportBundleBtn.setCursor(QCursor(QtCore.Qt.CursorShape.PointingHandCursor))
+        self.exportBundleBtn.setStyleSheet(self.ui.addClassBtn.styleSheet())
+        self.exportBundleBtn.clicked.connect(self.__exportBundle)
+        self.ui.horizontalLayout_17.insertWidget(self.ui.horizontalLayout_17.indexOf(self.ui.addClassBtn), self.exportBundleBtn)
+
+    def __exportBundle(self) -> None:
+        """ Writes the project out as a single bundle file in the background, showing progress until it has finished """
+        if not self.app.project or (self.bundleExporter and self.bundleExporter.isRunning()):
+            return
+        bundlePath = QFileDialog.getSaveFileName(self.app, "Export Project Bundle", self.app.project.name + ".zip",
+                                                 filter="Project bundles (*.zip)")[0]
+        if not bundlePath:
+            return
+        includeImages = QMessageBox.question(self.app, "Export bundle", "Include the images in the bundle?") == QMessageBox.StandardButton.Yes
+
+        self.bundleExporter = BundleExporter(self.app.project, bundlePath, includeImages)
+        self.exportProgressDialog = QProgressDialog("Exporting project", "Cancel", 0, 0, self.app)
+        self.exportProgressDialog.setWindowTitle("Export bundle")
+        self.exportProgressDialog.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        self.exportProgressDialog.setMinimumDuration(500)  # only shown for exports that take a noticeable time
+        self.exportProgressDialog.canceled.connect(self.bundleExporter.cancel)
+
+        self.bundleExporter.progress.connect(self.__updateExportProgress)
+        self.bundleExporter.exported.connect(lambda path: self.app.notificationManager.raiseNotification(f"Exported project to {path}"))
+        self.bundleExporter.failed.connect(lambda error: self.app.notificationManager.raiseNotification(f"Could not export project: {error}"))
+        self.bundleExporter.finished.connect(self.exportProgressDialog.reset)
+        self.exportBundleBtn.setEnabled(False)
+        self.bundleExporter.finished.connect(lambda: self.exportBundleBtn.setEnabled(True))
+        self.bundleExporter.start()
+
+    def __updateExportProgress(self, phase, done: int, total: int) -> None:
+        """ Updates the export progress dialog, only bundling images reports how far it has got """
+        if self.exportProgressDialog.wasCanceled():
+            return
+        if total > 0:
+            self.exportProgressDialog.setMaximum(total)
+            self.exportProgressDialog.setValue(done)
+        else:
+            self.exportProgressDialog.setMaximum(0)
+
+    def __createVersionsButton(self) -> None:
+        """ Adds a button alongside export with a menu to save and restore versions of the annotations """
+        self.versionsBtn = QPushButton("Versions", parent=self.ui.frame_5)
+        self.versionsBtn.setMinimumSize(QtCore.QSize(90, 30))
+        self.versionsBtn.setMaximumSize(QtCore.QSize(90, 16777215))
+        self.versionsBtn.setCursor(QCursor(QtCore.Qt.CursorShape.PointingHandCursor))
+        self.versionsBtn.setStyleSheet(self.ui.addClassBtn.styleSheet())
+        self.versionsMenu = QMenu(self.versionsBtn)
+        self.versionsMenu.aboutToShow.connect(self.__populateVersionsMenu)
+        self.versionsBtn.setMenu(self.versionsMenu)
+        self.ui.horizontalLayout_17.insertWidget(self.ui.horizontalLayout_17.indexOf(self.exportBundleBtn), self.versionsBtn)
+
+    def __populateVersionsMenu(self) -> None:
+        """ Lists the saved versions each time the menu opens, so versions saved since show up """
+        self.versionsMenu.clear()
+        project = self.app.project
+        if not project or not project.annotationVersions:
+            return
+        editable = not project.readOnly
+        self.versionsMenu.addAction("Save version...", self.__createAnnotationVersion).setEnabled(editable)
+        restoreMenu = self.versionsMenu.addMenu("Restore version")
+        names = project.annotationVersions.names()
+        restoreMenu.setEnabled(editable and len(names) > 0)
+        for name in reversed(names):
+            restoreMenu.addAction(name, lambda name=name: self.__restoreAnnotationVersion(name))
+        self.versionsMenu.addSeparator()
+        self.versionsMenu.addAction("Merge from project...", self.__mergeAnnotations).setEnabled(editable and len(names) > 0)
+
+    def __createAnnotationVersion(self) -> None:
+        """ Saves the current annotations as a named version """
+        name, accepted = QInputDialog.getText(self.app, "Save Version", "Version name:")
+        name = name.strip()
+        if not accepted or not name:
+            return
+        try:
+            if self.app.project.createAnnotationVersion(name):
+                self.app.notificationManager.raiseNotification(f"Saved annotations as version {name}")
+            else:
+                self.app.notificationManager.raiseNotification(f"A version named {name} already exists")
+        except Exception as exc:
+            print(exc)
+            self.app.notificationManager.raiseNotification(f"Could not save version {name}: {exc}")
+
+    def __restoreAnnotationVersion(self, name: str) -> None:
+        """ Replaces the annotations with those of a saved version """
+        if QMessageBox.question(self.app, "Restore Version", f"Replace the current annotations with version {name}?") != QMessageBox.StandardButton.Yes:
+            return
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.CursorShape.WaitCursor)
+        try:
+            skipped = self.app.project.restoreAnnotationVersion(name)
+            if skipped:
+                self.app.notificationManager.raiseNotification(f"Restored version {name}, {len(skipped)} images are held by another annotator and were left as they are")
+            else:
+                self.app.notificationManager.raiseNotification(f"Restored version {name}")
+            self.__updateClassList()
+        except Exception as exc:
+            print(exc)
+            self.app.notificationManager.raiseNotification(f"Could not restore version {name}: {exc}")
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
+    def __mergeAnnotations(self) -> None:
+        """ Merges the annotations of another copy of the project, from a version both copies started from """
+        project = self.app.project
+        theirProjectDir = QFileDialog.getExistingDirectory(self.app, "Select Project to Merge", os.getcwd() + "/projects",
+                                                           options=QFileDialog.Option.DontUseNativeDialog)
+        if not theirProjectDir:
+            return
+        if os.path.abspath(theirProjectDir) == os.path.abspath(os.path.dirname(project.projectFile)):
+            self.app.notificationManager.raiseNotification("Cannot merge a project with itself")
+            return
+        baseVersion, accepted = QInputDialog.getItem(self.app, "Merge Annotations", "Version both copies started from:",
+                                                     list(reversed(project.annotationVersions.names())), 0, False)
+        if not accepted:
+            return
+        policyName, accepted = QInputDialog.getItem(self.app, "Merge Annotations", "Boxes changed on both sides keep:",
+                                                    [policy.value for policy in MergePolicies], 0, False)
+        if not accepted:
+            return
+
+        QtWidgets.QApplication.setOverrideCursor(QtCore.Qt.CursorShape.WaitCursor)
+        try:
+            result, skipped = project.mergeAnnotations(theirProjectDir, baseVersion, MergePolicies(policyName))
+            message = f"Merged annotations from {os.path.basename(theirProjectDir)}, {result.conflicts} conflicts resolved"
+            if result.renumbered:
+                message = message + f", {result.renumbered} boxes renumbered"
+            if skipped:
+                message = message + f", {len(skipped)} images held by another annotator were left as they are"
+            self.app.notificationManager.raiseNotification(message)
+            self.__updateClassList()
+        except Exception as exc:
+            print(exc)
+            self.app.notificationManager.raiseNotification(f"Could not merge annotations: {exc}")
+        finally:
+            QtWidgets.QApplication.restoreOverrideCursor()
+
     def __updateProjectIcon(self) -> None:
         """ Updates the projects icon """
         if self.readOnly:
@@ -94,6 +244,7 @@ class ProjectPage():
                 self.projectImageBtn.setIcon(QtGui.QIcon(iconPath))
                 self.projectImageBtn.setIconSize(QtCore.QSize(140,140))
                 self.app.project.imageIconPath = iconPath
+                self.app.project.projectDirty = True
 
     def __connectTrackedEditableWidgets(self) -> None:
         """ Connects tracked editable widgets """
@@ -105,11 +256,13 @@ class ProjectPage():
         # Note this only updates the project yaml and in app, the project dir still remains the setObjectName
         if self.app.project:
             self.app.project.name = self.projectNameLineEdit.text()
+            self.app.project.projectDirty = True
 
     def __updateProjectDescription(self) -> None:
         """ Updates the project's description """
         if self.app.project:
             self.app.project.description = self.projectDescriptionEdit.toPlainText()
+            self.app.project.projectDirty = True
 
     def __createPlot(self) -> None: 
         """ Creates a plot """
@@ -144,12 +297,19 @@ class ProjectPage():
         self.createClassDialog.exec()
         if self.createClassDialog.isValid:
             mlClass = MLClass(self.createClassDialog.className, self.createClassDialog.selectedColour)
-            self.app.project.classesDataset.append(mlClass) 
+            if not self.app.project.addClass(mlClass):
+                self.app.notificationManager.raiseNotification("Classes are looked after by another annotator of this project")
+                return
             self.__populateWidgets()
 
     def setEditMode(self, toggled) -> None:
         """ Enables edit mode for the project page """
-        self.readOnly = not self.readOnly
+        if toggled and self.app.project and not self.app.project.ownsSharedFiles():
+            # the project file is written by the annotator looking after the shared files
+            self.app.notificationManager.raiseNotification("The project details are looked after by another annotator of this project")
+            self.ui.editPageBtn.setChecked(False)
+            return
+        self.readOnly = not toggled
         self.projectNameLineEdit.setEditMode(toggled)
         self.projectDescriptionEdit.setEditMode(toggled)
         self.projectImageBtn.setEditMode(toggled)
@@ -5,9 +5,15 @@
 import os
 import sys
 
-from project import Project
-from PyQt6.QtGui import QCursor
-from PyQt6.QtWidgets import QFileDialog
+from project import Project, LoadPhases
+from projectLoader import ProjectLoader
+from dataset.datasetWatcher import DatasetRescanner, DatasetWatcher, MetadataPrecomputer
+from dataset.imageSource import ARCHIVE_EXTENSIONS
+from dataset.remoteSource import isRemote
+from storage.projectBundle import BundleReader
+from PyQt6 import QtCore
+from PyQt6.QtGui import QCursor, QIcon
+from PyQt6.QtWidgets import QFileDialog, QProgressDialog, QFrame, QLabel, QListWidget, QListWidgetItem, QVBoxLayout, QPushButton, QMessageBox
 from yoloAnt_ui import Ui_MainWindow
 from dialogs.createProjectDialog import CreateProjectDialog
 
@@ -23,47 +29,243 @@ class StartPage():
 
         # Member variables
         self.project = None
+        self.projectLoader = None  # worker loading or creating a project
+        self.progressDialog = None
+        self.datasetRescanner = None  # compares the dataset directory with the open project
+        self.datasetWatcher = None
+        self.metadataPrecomputer = None  # fills the metadata cache of the open project
 
         # Connecting signals and slots for the page
         self.__connectProjectButtons()
         self.__connectIconHover()
 
+        self.__createRecentProjectsList()
+        self.loadRecentProjects()
+
     def __connectProjectButtons(self) -> None:
         """ Connects the create and open project buttons"""
         self.ui.createProjectBtn.clicked.connect(lambda: self.__handleProject(True))
         self.ui.openProjecBtn.clicked.connect(lambda: self.__handleProject(False))
 
+        # bundles are opened from beneath the open project button
+        self.openBundleBtn = QPushButton("Open bundle", parent=self.ui.openProjectFrame)
+        self.openBundleBtn.setCursor(QCursor(QtCore.Qt.CursorShape.PointingHandCursor))
+        self.openBundleBtn.setStyleSheet("QPushButton{"
+                                         f"font: 75 bold 10pt {self.app.fontTypeHeader};"
+                                         "border-radius: 10px; padding: 5px;}"
+                                         "QPushButton::hover{"
+                                         f"background-color : {self.app.theme.colours['app.hover']};}}")
+        self.openBundleBtn.clicked.connect(self.__openBundle)
+        self.ui._2.addWidget(self.openBundleBtn)
+
     def __handleProject(self, createProject: bool) -> None:
         """ Handles the flow of project operation"""
-        self.project = Project()
+        if self.projectLoader and self.projectLoader.isRunning():
+            return
+
         if(createProject):
             # opens a new dialog to set up the project
             createProjectDialog = CreateProjectDialog()
             createProjectDialog.exec()
             if createProjectDialog.result() == 1:
-                self.project.createProject(createProjectDialog.projectName, createProjectDialog.imageDirectory)
-                self.app.project = self.project
-                # update navigation panel and switch dir TODO: create functions that wrap the navigation as below
-                self.ui.mlTabBtn.setChecked(False)
-                self.ui.annotTabBtn.setChecked(False)
-                self.ui.projectsTabBtn.setChecked(True)
-                self.ui.stackedWidget.setCurrentIndex(2)
-                self.app.projectPage.loadPage()
+                self.__startLoading(ProjectLoader(projectName=createProjectDialog.projectName,
+                                                  imageDirectory=createProjectDialog.imageDirectory,
+                                                  useImageStore=createProjectDialog.useImageStore))
         else:
             # opens file explorer
             projectDir = str(QFileDialog.getExistingDirectory(self.app, "Select Directory"))        
             if os.path.exists(projectDir + "/project.yaml"): 
-                self.project.loadProject(projectDir)  # attempt to load project
-                self.app.project = self.project
-                # update navigation panel and switch dir TODO: create functions that wrap the navigation as below
-                self.ui.mlTabBtn.setChecked(False)
-                self.ui.annotTabBtn.setChecked(False)
-                self.ui.projectsTabBtn.setChecked(True)
-                self.ui.stackedWidget.setCurrentIndex(2)
-                self.app.projectPage.loadPage()
+                self.__startLoading(ProjectLoader(projectDir=projectDir))  # attempt to load project
             else:
                 self.app.notificationManager.raiseNotification(f"Could not find a .project file in {projectDir}")
 
+    def __openBundle(self) -> None:
+        """ Imports a project bundle, or opens it read-only without unpacking anything """
+        if self.projectLoader and self.projectLoader.isRunning():
+            return
+        bundlePath = QFileDialog.getOpenFileName(self.app, "Select Project Bundle", filter="Project bundles (*.zip)")[0]
+        if not bundlePath:
+            return
+
+        messageBox = QMessageBox(QMessageBox.Icon.Question, "Open bundle",
+                                 "Import the bundle as a new project, or open it read-only?", parent=self.app)
+        importBtn = messageBox.addButton("Import", QMessageBox.ButtonRole.AcceptRole)
+        readOnlyBtn = messageBox.addButton("Read-only", QMessageBox.ButtonRole.AcceptRole)
+        messageBox.addButton(QMessageBox.StandardButton.Cancel)
+        messageBox.exec()
+        if messageBox.clickedButton() is importBtn:
+            try:
+                bundleInfo = BundleReader(bundlePath).info
+            except Exception as exc:
+                print(exc)
+                self.app.notificationManager.raiseNotification(f"Could not import {bundlePath}: {exc}")
+                return
+            datasetDir = None
+            if not bundleInfo["ImagesBundled"] and not isRemote(bundleInfo["DatasetDir"]):
+                # the bundle only records where the dataset was on the machine it was exported from
+                datasetDir = self.__askDatasetLocation(bundleInfo["DatasetDir"])
+                if not datasetDir:
+                    return
+            self.__startLoading(ProjectLoader(bundlePath=bundlePath, imageDirectory=datasetDir))
+        elif messageBox.clickedButton() is readOnlyBtn:
+            self.__startLoading(ProjectLoader(bundlePath=bundlePath, readOnly=True))
+
+    def __askDatasetLocation(self, exportedDir: str) -> str:
+        """ Asks where the dataset of a bundle without images is kept on this machine, empty if cancelled """
+        startDir = exportedDir if os.path.exists(exportedDir) else ""
+        caption = f"Select where the dataset exported from {exportedDir} is on this machine"
+        if exportedDir.lower().endswith(ARCHIVE_EXTENSIONS):
+            return QFileDialog.getOpenFileName(self.app, caption, startDir, filter="Archives (*.zip *.tar)")[0]
+        return QFileDialog.getExistingDirectory(self.app, caption, startDir)
+
+    def __createRecentProjectsList(self) -> None:
+        """ Adds a list of recently used projects alongside the create and open buttons """
+        self.recentProjectsFrame = QFrame(parent=self.ui.entryPage)
+        layout = QVBoxLayout(self.recentProjectsFrame)
+        recentProjectsLbl = QLabel("Recent projects", parent=self.recentProjectsFrame)
+        recentProjectsLbl.setStyleSheet("QLabel{"
+                                        f"font: 75 bold 12pt {self.app.fontTypeHeader};"
+                                        f"color: {self.app.theme.colours['font.header']};}}")
+        self.recentProjectsList = QListWidget(parent=self.recentProjectsFrame)
+        self.recentProjectsList.setIconSize(QtCore.QSize(48, 48))
+        self.recentProjectsList.setMinimumWidth(300)
+        self.recentProjectsList.setCursor(QCursor(QtCore.Qt.CursorShape.PointingHandCursor))
+        self.recentProjectsList.setStyleSheet("QListWidget{"
+                                              "border-radius: 5px;"
+                                              f"background-color: {self.app.theme.colours['panel.background']};"
+                                              f"color: {self.app.theme.colours['font.regular']};}}"
+                                              "QListWidget::item{padding: 5px;}"
+                                              "QListWidget::item:hover{"
+                                              f"background-color: {self.app.theme.colours['app.hover']};}}")
+        self.recentProjectsList.itemClicked.connect(self.__openRecentProject)
+        layout.addWidget(recentProjectsLbl)
+        layout.addWidget(self.recentProjectsList)
+        # before the trailing spacer
+        self.ui.horizontalLayout_2.insertWidget(self.ui.horizontalLayout_2.count() - 1, self.recentProjectsFrame)
+
+    def loadRecentProjects(self) -> None:
+        """ Lists the recent projects from the index, no project files are read """
+        self.recentProjectsList.clear()
+        for entry in self.app.recentProjects.entries():
+            item = QListWidgetItem(f"{entry['Name']}\n"
+                                   f"{entry['ImageCount']} images, {entry['AnnotatedCount']} annotated\n"
+                                   f"Updated {entry['LastUpdated']:%d %b %Y %H:%M}")
+            if entry["ImageIconPath"]:
+                item.setIcon(QIcon(entry["ImageIconPath"]))
+            item.setData(QtCore.Qt.ItemDataRole.UserRole, entry["ProjectDir"])
+            self.recentProjectsList.addItem(item)
+        self.recentProjectsFrame.setVisible(self.recentProjectsList.count() > 0)
+
+    def __openRecentProject(self, item: QListWidgetItem) -> None:
+        """ Opens a project picked from the recent projects list """
+        if self.projectLoader and self.projectLoader.isRunning():
+            return
+        projectDir = item.data(QtCore.Qt.ItemDataRole.UserRole)
+        if not os.path.exists(projectDir + "/project.yaml"):
+            self.app.notificationManager.raiseNotification(f"Could not find a .project file in {projectDir}")
+            self.app.recentProjects.remove(projectDir)
+            self.loadRecentProjects()
+            return
+        self.__startLoading(ProjectLoader(projectDir=projectDir))
+
+    def __startLoading(self, projectLoader: ProjectLoader) -> None:
+        """ Loads a project in the background, showing progress until it has finished """
+        self.projectLoader = projectLoader
+        self.progressDialog = QProgressDialog(LoadPhases.metadata.value, "Cancel", 0, 0, self.app)
+        self.progressDialog.setWindowTitle("Opening project")
+        self.progressDialog.setWindowModality(QtCore.Qt.WindowModality.WindowModal)
+        self.progressDialog.setMinimumDuration(500)  # only shown for loads that take a noticeable time
+        self.progressDialog.canceled.connect(self.projectLoader.cancel)
+
+        self.projectLoader.progress.connect(self.__updateProgress)
+        self.projectLoader.loaded.connect(self.__onProjectLoaded)
+        self.projectLoader.failed.connect(lambda error: self.app.notificationManager.raiseNotification(f"Could not load project: {error}"))
+        self.projectLoader.finished.connect(self.progressDialog.reset)
+        self.projectLoader.start()
+
+    def __updateProgress(self, phase: LoadPhases, done: int, total: int) -> None:
+        """ Updates the progress dialog with the phase of loading """
+        if self.progressDialog.wasCanceled():
+            return
+        self.progressDialog.setLabelText(phase.value)
+        # a total of zero shows a busy indicator for phases that cannot be measured
+        if total > 0:
+            self.progressDialog.setMaximum(total)
+            self.progressDialog.setValue(done)
+        else:
+            self.progressDialog.setMaximum(0)
+
+    def __onProjectLoaded(self, project: Project) -> None:
+        """ Switches to the project once it has been completely loaded """
+        # save what is still pending in the previous project before it is replaced
+        self.app.autosaveManager.flush()
+        if self.app.project:
+            self.app.project.releaseShards()
+
+        self.project = project
+        self.app.project = self.project
+        self.app.recentProjects.update(project)
+        self.loadRecentProjects()
+        # update navigation panel and switch dir TODO: create functions that wrap the navigation as below
+        self.ui.mlTabBtn.setChecked(False)
+        self.ui.annotTabBtn.setChecked(False)
+        self.ui.projectsTabBtn.setChecked(True)
+        self.ui.stackedWidget.setCurrentIndex(2)
+        self.app.projectPage.loadPage()
+
+        # pick up images added to the dataset directory since the project was last open
+        if self.datasetWatcher:
+            self.datasetWatcher.stop()
+            self.datasetWatcher = None
+        self.__stopMetadataPrecomputer()
+        if project.readOnly:
+            return  # a bundle is a snapshot, it is not compared with wherever its dataset came from
+        self.datasetRescanner = DatasetRescanner(project)
+        self.datasetRescanner.rescanned.connect(lambda result: self.__onDatasetRescanned(project, result))
+        self.datasetRescanner.start()
+
+    def __onDatasetRescanned(self, project: Project, rescanResult) -> None:
+        """ Applies the changes found in the dataset directory and starts watching it if enabled """
+        if project is not self.app.project:
+            return  # another project was opened while scanning
+
+        project.applyRescan(rescanResult)
+        if rescanResult.hasChanges():
+            self.app.notificationManager.raiseNotification(f"Dataset changed: {len(rescanResult.added)} images added, "
+                                                           f"{len(rescanResult.removed)} missing, "
+                                                           f"{len(rescanResult.modified)} modified")
+        # with the stats up to date, images changed or never seen have their metadata worked out in bulk
+        self.__stopMetadataPrecomputer()
+        self.metadataPrecomputer = MetadataPrecomputer(project)
+        self.metadataPrecomputer.precomputed.connect(lambda imageIDs, imageStats, shapes: self.__onMetadataPrecomputed(project, imageIDs, imageStats, shapes))
+        self.metadataPrecomputer.completed.connect(lambda invalidCount: self.__onMetadataPrecomputeCompleted(project, invalidCount))
+        self.metadataPrecomputer.start()
+
+        if project.watchDataset:
+            self.datasetWatcher = DatasetWatcher(project)
+            self.datasetWatcher.imagesAdded.connect(lambda count: self.app.notificationManager.raiseNotification(f"{count} new images added to the project"))
+            self.datasetWatcher.start(rescanResult.directories)
+
+    def __onMetadataPrecomputed(self, project: Project, imageIDs: list, imageStats: list, shapes: list) -> None:
+        """ Records a batch of the metadata worked out in the background """
+        if project is not self.app.project:
+            return
+        project.applyImageMetadata(imageIDs, imageStats, shapes, save=False)
+
+    def __onMetadataPrecomputeCompleted(self, project: Project, invalidCount: int) -> None:
+        """ Saves the batches recorded, together rather than writing the whole cache for each, and reports any images that could not be read """
+        project.saveImageMetadata()  # also for a project since replaced, whose batches were recorded before it was
+        if project is self.app.project and invalidCount:
+            self.app.notificationManager.raiseNotification(f"{invalidCount} images could not be read")
+
+    def __stopMetadataPrecomputer(self) -> None:
+        """ Stops the metadata precomputer and waits for it, so it is not destroyed while its thread is still running """
+        if self.metadataPrecomputer is None:
+            return
+        self.metadataPrecomputer.stop()
+        self.metadataPrecomputer.wait()
+        self.metadataPrecomputer = None
+
     def __connectIconHover(self) -> None:
         """ Connects the hover over functionality to icons """
         # updating stylesheets initially
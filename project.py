@@ -2,7 +2,9 @@
     project.py
 """
 import os
+import shutil
 import yaml
+from enum import Enum
 from typing import Any
 from datetime import datetime
 from PyQt6.QtGui import QColor
@@ -11,14 +13,66 @@ from mlClass import MLClass
 from model import Model
 from image import Image
 from boundingBox import BoundingBox
+from annotationDataset import AnnotationDataset
+from storage.annotationJournal import AnnotationJournal
+from storage.columnarStore import ColumnarAnnotationStore
+from storage.sqliteBackend import SqliteProjectBackend
+from storage.sessionCache import SessionCache
+from storage.annotationVersions import AnnotationVersions
+from storage.annotationMerge import MergePolicies, mergeAnnotations
+from storage.shardedStore import ShardedAnnotationStore, ShardLeases
+from storage.imageManifest import ImageManifest
+from storage.imageStore import ImageStore
+from storage.projectBundle import BundleReader, BundleWriter, BUNDLE_INFO, BUNDLE_VERSION, IMAGES_PREFIX, memberPath
+from dataset.datasetScanner import DatasetScanner
+from dataset.imageSource import ArchiveScanner, ArchiveSource, isArchive, readImage
+from dataset.remoteSource import RemoteScanner, RemoteSource, isRemote
+from dataset.datasetRescan import ScanState
+from dataset.datasetIntegrity import DatasetHasher
+from dataset.imageMetadata import MetadataCache
+from storage import yamlStream
 
 
-class NoAliasDumper(yaml.SafeDumper):
+class NoAliasDumper(yamlStream.Dumper):
     """ Keep yaml unique to increase readability """
     def ignore_aliases(self, data):
         return True
 
 
+def dumpYaml(data, filePath: str) -> None:
+    """ Writes yaml to a temporary file and swaps it in, so a crash never leaves a partially written file """
+    tempFilePath = filePath + ".tmp"
+    with open(tempFilePath, "w") as file:
+        yaml.dump(data, file, sort_keys=False, Dumper=NoAliasDumper)  # Dont want sorting present
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tempFilePath, filePath)
+
+
+class StorageFormats(Enum):
+    """ Enum to represent the formats a project's annotations can be stored in """
+    yaml = "yaml"  # single annotations.yaml
+    numpy = "numpy"  # columnar .npy store that is memory mapped on load
+    sqlite = "sqlite"  # images, boxes, classes and models in an indexed project.db
+    sharded = "sharded"  # annotations split into shard files that annotators lease, for labelling a project together
+
+
+class LoadPhases(Enum):
+    """ Enum to represent the phases of loading a project, in the order they run """
+    scan = "Scanning dataset"  # only when creating a project
+    hash = "Hashing images"  # only when creating a project
+    store = "Adding images to the image store"  # only when creating a project that uses the store
+    metadata = "Reading project"
+    images = "Reading image list"
+    classes = "Reading classes"
+    models = "Reading models"
+    annotations = "Reading annotations"
+
+
+class LoadCancelled(Exception):
+    """ Raised from a load progress callback to abandon loading a project """
+
+
 class Project:
     """
         Gets project related information and provides related functionality
@@ -33,6 +87,12 @@ class Project:
         self.annotationsFilePath = None  # path to the annotations associated with the project
         self.modelsDir = None  # path to the directory which stores all of the models
         self.projectCreated = None  # datetime of project creation
+        self.lastUpdated = None  # datetime anything in the project was last saved
+        self.storageFormat = StorageFormats.yaml
+        self.watchDataset = False  # append images to the project as they are added to the dataset directory
+        self.useImageStore = False  # keep the images in the content addressed store shared by every project
+        self.imageStore = None
+        self.readOnly = False  # opened straight from a bundle or for reading only, nothing is written back
 
         self.imageDataset = []
         self.classesDataset = []
@@ -41,14 +101,43 @@ class Project:
         self.modelDataset = []
         self.projectFile = None
         self.highestID = 0
+        self.journal = None  # append-only log of annotation changes since the last snapshot
+        self.annotationVersions = None  # named versions of the annotations that can be restored
+        self.annotationStore = None  # columnar store backing the annotation dataset when using the numpy format
+        self.shardStore = None  # shards of the annotations when using the sharded format
+        self.unsavedAnnotationCount = 0  # journalled changes waiting on shards other annotators have leased
+        self.sharedFileMtimes = {}  # path -> mtime of the files all annotators of a sharded project share
+        self.loadedAnnotations = None  # image id -> stored box records the annotation dataset was built from
+        self.annotatedImageCount = None  # counted by countAnnotatedImages, then kept up to date as images are edited
+        self.database = None  # database backing the whole project when using the sqlite format
+        self.scanState = None  # stats of each image when the dataset was last scanned, used to find changes
+        self.metadataCache = None  # dimensions and validity of images, worked out in the background
+
+        # parts of the project changed since they were last saved, bounding box changes are tracked by the journal
+        self.projectDirty = False
+        self.imagesDirty = False
+        self.classesDirty = False
+        self.modelsDirty = False
+
+    def loadProject(self, projectDir: str, progressCallback=None, readOnly: bool = False) -> None:
+        """
+            Function to load a project's metadata, progressCallback(phase, done, total) is called as each of the
+            LoadPhases progresses and may raise LoadCancelled to stop loading part way. A project loaded readOnly
+            is left exactly as it is on disk, no caches or indexes are written for it.
+        """
+        def reportProgress(phase: LoadPhases, done: int = 0, total: int = 0) -> None:
+            if progressCallback:
+                progressCallback(phase, done, total)
 
-    def loadProject(self, projectDir: str) -> None:
-        """ Function to load a project's metadata """
         # check if project exists
         if not os.path.exists(projectDir):
             return None
 
-        #TODO: Add some project validation: dataset.yaml exists, annotations.yaml exists, hash over dataset file is same as stored
+        reportProgress(LoadPhases.metadata)
+        self.readOnly = readOnly
+
+        #TODO: Add some project validation: dataset.yaml exists, annotations.yaml exists
+        # image contents are checked against their stored hashes by the rescan that follows opening a project
 
         self.projectFile = projectDir + "/project.yaml"
 
@@ -65,58 +154,206 @@ class Project:
                 self.annotationsFilePath = project["AnnotationsFilePath"]
                 self.modelsDir = project["ModelsDir"]
                 self.projectCreated = project["ProjectCreated"]
+                self.lastUpdated = project.get("LastUpdated", self.projectCreated)
+                self.storageFormat = StorageFormats(project.get("StorageFormat", StorageFormats.yaml.value))
+                self.watchDataset = project.get("WatchDataset", False)
+                self.useImageStore = project.get("ImageStore", False)
                 self.projectValidated = True
             except Exception as exc:
                 print(exc)
 
-        # read image dataset
-        with open(self.datasetFilePath, "r") as stream:
-            try:
-                self.imageDataset = yaml.safe_load(stream)
-            except Exception as exc:
-                print(exc)
+        if self.storageFormat is StorageFormats.sqlite:
+            self.database = SqliteProjectBackend(self.annotationsFilePath, readOnly)
 
-        # load classes from project
-        with open(self.classesFilePath, "r") as stream:
+        if isArchive(self.datasetDir):
+            # images are read in place from the archive through its member index
             try:
-                classesYaml = yaml.safe_load(stream)
-                classes = classesYaml["Classes"]
-                for _class in classes:
-                    self.classesDataset.append(MLClass(_class[0], tuple(_class[1])))
-            except Exception as exc:
+                ArchiveSource.open(self.datasetDir, None if readOnly else projectDir + "/archiveIndex.npz")
+            except OSError as exc:
                 print(exc)
 
-        # load models stored
-        availableModels = os.listdir(self.modelsDir)
-        for modelFile in availableModels:
-            with open(self.modelsDir + "/" + modelFile, "r") as stream:
+        # yaml sources that have not changed since the last session are read from a binary cache instead
+        sessionCache = None if self.database else SessionCache(projectDir, readOnly)
+
+        # read image dataset
+        reportProgress(LoadPhases.images)
+        if self.database:
+            self.imageDataset = ImageManifest.fromYaml(self.datasetDir, self.database.readImagePaths())
+        else:
+            datasetKey = sessionCache.sourceKey([self.datasetFilePath])
+            images = sessionCache.get("Images", datasetKey)
+            imageDataset = None
+            if images is not None:
                 try:
-                    modelYaml = yaml.safe_load(stream)
-                    model = Model(modelYaml["Name"])
-                    model.modelType = modelYaml["Type"]
-                    model.device = modelYaml["Device"]
-                    model.dimensions = modelYaml["Dimensions"]
-                    model.epochs = modelYaml["Epochs"]
-                    model.batchSize = modelYaml["BatchSize"]
-                    model.workers = modelYaml["Workers"]
-                    if model.isValid():
-                        self.modelDataset.append(model)
-                    else:
-                        print(f"Could not load model from {modelFile}")
+                    imageDataset = ImageManifest.fromColumns(self.datasetDir, images["Manifest"])
                 except Exception as exc:
                     print(exc)
+            if imageDataset is None:
+                with open(self.datasetFilePath, "r") as stream:
+                    try:
+                        datasetYaml = yaml.load(stream, Loader=yamlStream.Loader)
+                        imageDataset = ImageManifest.fromYaml(self.datasetDir, datasetYaml)
+                        images = {"Manifest": imageDataset.toColumns(),
+                                  "IsManifest": ImageManifest.isManifest(datasetYaml)}
+                        sessionCache.put("Images", datasetKey, images)
+                    except Exception as exc:
+                        print(exc)
+            if imageDataset is not None:
+                self.imageDataset = imageDataset
+                # older projects stored a list of absolute paths, they are rewritten as a manifest on the next save
+                self.imagesDirty = not images["IsManifest"]
+                # paths are built from the dataset directory in project.yaml so the dataset can be moved
+                self.imageDataset.datasetDir = self.datasetDir
+
+        self.scanState = ScanState(projectDir + "/integrity.npz")
+        self.scanState.load()
+        self.metadataCache = MetadataCache(projectDir + "/metadata.npz")
+        self.metadataCache.load()
+        if self.useImageStore:
+            self.imageStore = ImageStore.shared()
 
-        # read annotation dataset
-        with open(self.annotationsFilePath, "r") as stream:
+        # load classes from project
+        reportProgress(LoadPhases.classes)
+        if self.database:
+            for className, classColour in self.database.readClasses():
+                self.classesDataset.append(MLClass(className, classColour))
+        else:
+            classesKey = sessionCache.sourceKey([self.classesFilePath])
+            classes = sessionCache.get("Classes", classesKey)
+            if classes is None:
+                with open(self.classesFilePath, "r") as stream:
+                    try:
+                        classesYaml = yaml.safe_load(stream)
+                        classes = classesYaml["Classes"]
+                        sessionCache.put("Classes", classesKey, classes)
+                    except Exception as exc:
+                        print(exc)
+            for _class in classes or []:
+                self.classesDataset.append(MLClass(_class[0], tuple(_class[1])))
+
+        # load models stored
+        reportProgress(LoadPhases.models)
+        if self.database:
+            modelYamls = self.database.readModels()
+        else:
+            availableModels = os.listdir(self.modelsDir)
+            modelsKey = sessionCache.sourceKey([self.modelsDir + "/" + modelFile for modelFile in sorted(availableModels)])
+            modelYamls = sessionCache.get("Models", modelsKey)
+            if modelYamls is None:
+                modelYamls = []
+                for modelFile in availableModels:
+                    with open(self.modelsDir + "/" + modelFile, "r") as stream:
+                        try:
+                            modelYamls.append(yaml.safe_load(stream))
+                        except Exception as exc:
+                            print(exc)
+                sessionCache.put("Models", modelsKey, modelYamls)
+        self.__loadModels(modelYamls)
+
+        # changes made since the annotations were last compacted
+        reportProgress(LoadPhases.annotations)
+        self.journal = AnnotationJournal(os.path.splitext(self.annotationsFilePath)[0] + ".journal", self.imageID)
+        self.annotationVersions = AnnotationVersions(projectDir + "/versions")
+
+        if self.database:
+            # the database is written transactionally so there is never a journal to recover, boxes are
+            # queried a page at a time through the path index as images are accessed
+            self.annotationDataset = AnnotationDataset(self.imageDataset,
+                                                       self.__loadDatabaseAnnotations,
+                                                       self.__createBoundingBoxes)
+            self.__attachImageData()
+            self.highestID = self.database.highestID()
+            self.annotatedImageCount = self.database.countAnnotatedImages()
+            return
+
+        if self.storageFormat is StorageFormats.sharded:
+            # every shard is read so other annotators' work shows, changes are written straight to leased shards
+            self.shardStore = ShardedAnnotationStore(self.annotationsFilePath)
+            annotations = self.shardStore.load(lambda shardsRead, shardCount: reportProgress(LoadPhases.annotations, shardsRead, shardCount))
+            # changes that could not be saved last session, as their shard was leased, are still waiting to be
+            self.unsavedAnnotationCount = self.journal.replay(annotations)
+            # the first annotator to open the project looks after the files everyone shares
+            self.sharedFileMtimes = self.__sharedFileMtimes()
+            if not readOnly:
+                self.shardStore.leases.acquire(ShardLeases.MANIFEST)
+            self.createAnnotationDataset(self.imageDataset, {"Annotations": annotations})
+            self.__saveSessionCache(sessionCache)
+            return
+
+        if self.storageFormat is StorageFormats.numpy:
+            # boxes are viewed straight from the memory mapped columns, only journalled images are rebuilt
+            self.annotationStore = ColumnarAnnotationStore(self.annotationsFilePath)
+            self.annotationStore.load()
+            changedImages = self.journal.imageKeys()
+            changedAnnotations = {imageID: self.annotationStore.records(imageID) for imageID in changedImages}
+            self.journal.replay(changedAnnotations)
+            self.createColumnarAnnotationDataset(changedImages, changedAnnotations)
+            self.__saveSessionCache(sessionCache)
+            return
+
+        annotationsKey = sessionCache.sourceKey([self.annotationsFilePath])
+        cachedAnnotations = sessionCache.getAnnotations(annotationsKey)
+        if cachedAnnotations is None:
+            # streamed straight into the session cache, so only one image's records are held at a time
             try:
-                annotationsDataset = yaml.safe_load(stream)
+                sessionCache.putAnnotations(annotationsKey, self.__readAnnotations(self.annotationsFilePath,
+                                            lambda bytesRead, totalBytes: reportProgress(LoadPhases.annotations, bytesRead, totalBytes)))
+                self.__saveSessionCache(sessionCache)
+                cachedAnnotations = sessionCache.getAnnotations(annotationsKey)
+            except LoadCancelled:
+                raise
             except Exception as exc:
                 print(exc)
 
+        if cachedAnnotations is not None:
+            # records are decoded from the cache a page at a time, only journalled images are rebuilt up front
+            self.createCachedAnnotationDataset(cachedAnnotations)
+            self.__saveSessionCache(sessionCache)
+            return
+
+        # the cache could not be written, so the annotations are held in memory instead
+        annotations = {}
+        try:
+            annotations = dict(self.__readAnnotations(self.annotationsFilePath,
+                                                      lambda bytesRead, totalBytes: reportProgress(LoadPhases.annotations, bytesRead, totalBytes)))
+        except LoadCancelled:
+            raise
+        except Exception as exc:
+            print(exc)
+
+        # recover any changes made since the annotations were last compacted
+        self.journal.replay(annotations)
+
         # create dataset that is used for annotating
-        self.createAnnotationDataset(self.imageDataset, annotationsDataset)
+        self.createAnnotationDataset(self.imageDataset, {"Annotations": annotations})
+
+    def __loadModels(self, modelYamls: list) -> None:
+        """ Adds the models described by a list of model dicts, as stored on disk """
+        for modelYaml in modelYamls:
+            try:
+                model = Model(modelYaml["Name"])
+                model.modelType = modelYaml["Type"]
+                model.device = modelYaml["Device"]
+                model.dimensions = modelYaml["Dimensions"]
+                model.epochs = modelYaml["Epochs"]
+                model.batchSize = modelYaml["BatchSize"]
+                model.workers = modelYaml["Workers"]
+                if model.isValid():
+                    self.modelDataset.append(model)
+                else:
+                    print(f"Could not load model {modelYaml['Name']}")
+            except Exception as exc:
+                print(exc)
+
+    def __saveSessionCache(self, sessionCache: SessionCache) -> None:
+        """ Writes out any sections of the session cache that were parsed during this load """
+        try:
+            sessionCache.save()
+        except Exception as exc:
+            print(exc)
                 
-    def createProject(self, name: str, dataset: str) -> None:
+    def createProject(self, name: str, dataset: str, storageFormat: StorageFormats = StorageFormats.yaml, progressCallback=None,
+                      useImageStore: bool = False) -> None:
         """ Creates a new project"""
         currDatetime = datetime.now()
         # check that project doesnt exist
@@ -127,16 +364,26 @@ class Project:
 
         # create a projects directory
         os.makedirs(projectPath)
-        
+        try:
+            self.__buildProject(projectPath, name, dataset, storageFormat, progressCallback, useImageStore, currDatetime)
+        except BaseException:
+            # a cancelled or failed create leaves nothing behind, so the name can be used again
+            if self.database:
+                self.database.close()
+                self.database = None
+            shutil.rmtree(projectPath, ignore_errors=True)
+            raise
+
+    def __buildProject(self, projectPath: str, name: str, dataset: str, storageFormat: StorageFormats, progressCallback,
+                       useImageStore: bool, currDatetime: datetime) -> None:
+        """ Writes out the files of a new project at projectPath and loads it """
         # create a machine learning models directory
         modelsDir = projectPath + "/models"
         os.makedirs(modelsDir)
 
         # yaml file paths 
         projectFile = projectPath + "/project.yaml"
-        annotationsFilePath = projectPath + "/annotations.yaml"
-        datasetFilePath = projectPath + "/dataset.yaml"
-        classesFilePath = projectPath + "/classes.yaml"
+        datasetFilePath, classesFilePath, annotationsFilePath = self.__storagePaths(projectPath, storageFormat)
 
         # create project file
         project = {"Name": name,  
@@ -147,6 +394,9 @@ class Project:
                    "ImageIconPath": "",
                    "AnnotationsFilePath":annotationsFilePath,
                    "ModelsDir":modelsDir,
+                   "StorageFormat":storageFormat.value,
+                   "WatchDataset":False,
+                   "ImageStore":useImageStore,
                    "ProjectCreated":currDatetime, 
                    "LastUpdated":currDatetime }
         with open(projectFile, "x") as file:
@@ -156,14 +406,61 @@ class Project:
                 print(exc)
 
         # create dataset yaml file and write out image paths
-        imageDataset = []
-        imageFiles = os.listdir(dataset)
-        for image in imageFiles:
-            imageDataset.append(dataset + "/" + image)
+        # the whole tree is walked in parallel, images are added to the manifest a directory at a time
+        imageDataset = ImageManifest(dataset)
+        def reportScanProgress(directoriesScanned: int, imagesFound: int) -> None:
+            if progressCallback:
+                progressCallback(LoadPhases.scan, imagesFound, 0)
+
+        # stats are recorded so later rescans can tell which images changed
+        scanState = ScanState(projectPath + "/integrity.npz")
+        if isRemote(dataset):
+            # objects are listed from the store, images are only fetched as they are viewed
+            scanner = RemoteScanner(RemoteSource.open(dataset), progressCallback=reportScanProgress)
+        elif isArchive(dataset):
+            # the archive is indexed once and read in place, its index is kept with the project
+            scanner = ArchiveScanner(ArchiveSource.open(dataset, projectPath + "/archiveIndex.npz"), progressCallback=reportScanProgress)
+        else:
+            scanner = DatasetScanner(dataset, progressCallback=reportScanProgress, collectStats=True)
+        for directory, fileNames, fileStats in scanner.scan():
+            for fileName, stat in zip(fileNames, fileStats):
+                imageID = imageDataset.append(directory + "/" + fileName if directory else fileName)
+                scanState.setStat(imageID, stat)
+        scanState.reserve(len(imageDataset))
+
+        # and the contents hashed, so an image replaced under the same name is caught rather than trusted
+        def reportHashProgress(imagesHashed: int, imageCount: int) -> None:
+            if progressCallback:
+                progressCallback(LoadPhases.hash, imagesHashed, imageCount)
+
+        # files another project already hashed are known to the image store and not read again
+        imagePaths = list(imageDataset)
+        imageStats = [scanState.stat(imageID) for imageID in range(len(imagePaths))]
+        imageStore = ImageStore.shared() if useImageStore else None
+        digests = imageStore.knownDigests(imagePaths, imageStats) if imageStore else [None] * len(imagePaths)
+        unknown = [imageID for imageID, digest in enumerate(digests) if digest is None]
+        hashed = DatasetHasher(progressCallback=reportHashProgress).hash([imagePaths[imageID] for imageID in unknown])
+        for imageID, digest in zip(unknown, hashed):
+            digests[imageID] = digest
+        for imageID, digest in enumerate(digests):
+            scanState.setHash(imageID, digest)
+        scanState.save()
+
+        if imageStore:
+            imageStore.rememberDigests(imagePaths, imageStats, digests)
+            self.__addToImageStore(imageStore, imagePaths, digests, progressCallback)
+
+        if storageFormat is StorageFormats.sqlite:
+            # dataset, classes and annotations all live in the database
+            database = SqliteProjectBackend(datasetFilePath)
+            database.writeImages(list(imageDataset))
+            database.close()
+            self.loadProject(projectPath, progressCallback)
+            return
 
         with open(datasetFilePath, "x") as file:
             try:
-                yaml.dump(imageDataset, file, sort_keys=False, Dumper=NoAliasDumper)
+                yaml.dump(imageDataset.toYaml(), file, sort_keys=False, Dumper=NoAliasDumper)
             except Exception as exc:
                 print(exc)
 
@@ -176,54 +473,612 @@ class Project:
                 print(exc)
 
         # create annotations file
-        annotationInfo = {"Project": name, "LastUpdated":currDatetime, "Annotations":{}}
-        with open(annotationsFilePath, "x") as file:
-            try:
-                yaml.dump(annotationInfo, file, sort_keys=False, Dumper=NoAliasDumper)
-            except Exception as exc:
-                print(exc)
+        if storageFormat is StorageFormats.sharded:
+            ShardedAnnotationStore.create(annotationsFilePath)
+        elif storageFormat is StorageFormats.numpy:
+            ColumnarAnnotationStore.write(annotationsFilePath, len(imageDataset), {}, [])
+        else:
+            annotationInfo = {"Project": name, "LastUpdated":currDatetime, "Annotations":{}}
+            with open(annotationsFilePath, "x") as file:
+                try:
+                    yaml.dump(annotationInfo, file, sort_keys=False, Dumper=NoAliasDumper)
+                except Exception as exc:
+                    print(exc)
         # load project
-        self.loadProject(projectPath)
+        self.loadProject(projectPath, progressCallback)
+
+    def exportBundle(self, bundlePath: str, includeImages: bool = False, includeCaches: bool = True, progressCallback=None) -> None:
+        """
+            Writes the project out as a single bundle file that can be imported or opened on another machine.
+            Images are only bundled if asked for, otherwise the dataset directory is recorded as a hint. The
+            caches are the integrity hashes, so imported images are verified, and any metadata in the image
+            store. progressCallback(phase, done, total) is called as images are added.
+        """
+        bundle = BundleWriter(bundlePath)
+        try:
+            iconName = None
+            if self.imageIconPath and os.path.isfile(self.imageIconPath):
+                iconName = "icon" + os.path.splitext(self.imageIconPath)[1]
+                bundle.writeFile(iconName, self.imageIconPath, compress=False)
+
+            bundle.writeBytes("dataset.yaml", yaml.dump(self.imageDataset.toYaml(), sort_keys=False, Dumper=NoAliasDumper).encode())
+            classesInfo = {"Classes": self.__classInfos(), "LastUpdated": datetime.now()}
+            bundle.writeBytes("classes.yaml", yaml.dump(classesInfo, sort_keys=False, Dumper=NoAliasDumper).encode())
+            for modelInfo in self.__modelInfos():
+                bundle.writeBytes("models/" + modelInfo["Name"] + ".yaml", yaml.dump(modelInfo, sort_keys=False, Dumper=NoAliasDumper).encode())
+
+            # annotations are streamed from the dataset, so pending changes are included whatever the storage format
+            annotationsPath = bundle.tempPath + ".annotations.yaml"
+            annotationItems = ((imageID, [boundingBox.toRecord() for boundingBox in boundingBoxes])
+                               for imageID, _, boundingBoxes in self.annotationDataset.iterBoundingBoxes()
+                               if len(boundingBoxes) > 0)
+            yamlStream.dumpAnnotations(annotationsPath, {"Project": self.name, "LastUpdated": datetime.now()}, annotationItems)
+            bundle.writeFile("annotations.yaml", annotationsPath)
+            os.remove(annotationsPath)
+
+            if includeCaches:
+                scanState = self.scanState.copy()
+                scanState.filePath = bundle.tempPath + ".integrity.npz"
+                scanState.save()
+                bundle.writeFile("integrity.npz", scanState.filePath, compress=False)
+                os.remove(scanState.filePath)
+                if self.imageStore is not None:
+                    metadata = {}
+                    for imageID in range(len(self.imageDataset)):
+                        digest = self.scanState.hash(imageID)
+                        imageMetadata = self.imageStore.metadata(digest) if digest is not None else None
+                        if imageMetadata is not None:
+                            metadata[digest.hex()] = list(imageMetadata)
+                    bundle.writeBytes("metadata.yaml", yaml.safe_dump(metadata).encode())
+
+            imagesBundled = 0
+            if includeImages:
+                # images are compressed already, so they are stored as they are and read back without inflating
+                imageCount = len(self.imageDataset)
+                for imageID in range(imageCount):
+                    relativePath = self.imageDataset.relativePath(imageID)
+                    data = None if relativePath.startswith("/") else readImage(self.imageDataset[imageID])
+                    if data is None:
+                        print(f"Could not bundle {self.imageDataset[imageID]}")
+                    else:
+                        bundle.writeBytes(IMAGES_PREFIX + relativePath, data, compress=False)
+                        imagesBundled = imagesBundled + 1
+                    if progressCallback and ((imageID + 1) % 256 == 0 or imageID + 1 == imageCount):
+                        progressCallback(LoadPhases.images, imageID + 1, imageCount)
+
+            bundleInfo = {"BundleVersion": BUNDLE_VERSION,
+                          "Name": self.name,
+                          "Description": self.description,
+                          "DatasetDir": os.path.abspath(self.datasetDir) if not isRemote(self.datasetDir) else self.datasetDir,
+                          "StorageFormat": self.storageFormat.value,
+                          "ImageStore": self.useImageStore,
+                          "ImageCount": len(self.imageDataset),
+                          "ImagesBundled": imagesBundled,
+                          "Icon": iconName,
+                          "ProjectCreated": self.projectCreated,
+                          "Exported": datetime.now()}
+            bundle.writeBytes(BUNDLE_INFO, yaml.dump(bundleInfo, sort_keys=False, Dumper=NoAliasDumper).encode())
+        except BaseException:
+            bundle.abort()
+            raise
+        bundle.close()
+
+    def importBundle(self, bundlePath: str, name: str = None, datasetDir: str = None, progressCallback=None) -> None:
+        """
+            Creates a project from a bundle and loads it. Bundled images are unpacked into datasetDir, by default
+            the project's images directory, otherwise datasetDir is where this machine keeps the dataset and
+            defaults to where it was when the bundle was exported.
+        """
+        reader = BundleReader(bundlePath)
+        name = name or reader.info["Name"]
+        projectPath = os.getcwd() + "/projects/" + name
+        if os.path.exists(projectPath):
+            return None
+        os.makedirs(projectPath + "/models")
+        try:
+            self.__unpackBundle(reader, projectPath, name, datasetDir, progressCallback)
+        except BaseException:
+            # a rejected, failed or cancelled import leaves nothing behind, as with createProject
+            if self.database:
+                self.database.close()
+                self.database = None
+            shutil.rmtree(projectPath, ignore_errors=True)
+            raise
+
+    def __unpackBundle(self, reader: BundleReader, projectPath: str, name: str, datasetDir: str, progressCallback) -> None:
+        """ Unpacks a bundle into a new project directory and loads it, every member name is checked to stay inside it """
+        bundleInfo = reader.info
+        if bundleInfo["ImagesBundled"]:
+            datasetDir = datasetDir or projectPath + "/images"
+            imageNames = reader.names(IMAGES_PREFIX)
+            for index, imageName in enumerate(imageNames):
+                imagePath = memberPath(datasetDir, imageName[len(IMAGES_PREFIX):])
+                os.makedirs(os.path.dirname(imagePath), exist_ok=True)
+                with open(imagePath, "wb") as file:
+                    file.write(reader.read(imageName))
+                if progressCallback and ((index + 1) % 256 == 0 or index + 1 == len(imageNames)):
+                    progressCallback(LoadPhases.images, index + 1, len(imageNames))
+        datasetDir = datasetDir or bundleInfo["DatasetDir"]
+
+        # the bundle holds the yaml format, the project is converted to its own format once loaded
+        datasetFilePath, classesFilePath, annotationsFilePath = self.__storagePaths(projectPath, StorageFormats.yaml)
+        fileNames = {"dataset.yaml": datasetFilePath, "classes.yaml": classesFilePath, "annotations.yaml": annotationsFilePath,
+                     "integrity.npz": projectPath + "/integrity.npz"}
+        fileNames.update({modelName: memberPath(projectPath + "/models", modelName[len("models/"):]) for modelName in reader.names("models/")})
+        imageIconPath = ""
+        if bundleInfo["Icon"]:
+            imageIconPath = memberPath(projectPath, bundleInfo["Icon"])
+            fileNames[bundleInfo["Icon"]] = imageIconPath
+        for fileName, filePath in fileNames.items():
+            data = reader.read(fileName)
+            if data is not None:
+                with open(filePath, "wb") as file:
+                    file.write(data)
+
+        currDatetime = datetime.now()
+        project = {"Name": name,
+                   "Description": bundleInfo["Description"],
+                   "DatasetDir": datasetDir,
+                   "DatasetFilePath": datasetFilePath,
+                   "ClassesFilePath": classesFilePath,
+                   "ImageIconPath": imageIconPath,
+                   "AnnotationsFilePath": annotationsFilePath,
+                   "ModelsDir": projectPath + "/models",
+                   "StorageFormat": StorageFormats.yaml.value,
+                   "WatchDataset": False,
+                   "ImageStore": False,
+                   "ProjectCreated": bundleInfo["ProjectCreated"],
+                   "LastUpdated": currDatetime}
+        dumpYaml(project, projectPath + "/project.yaml")
+
+        self.loadProject(projectPath, progressCallback)
+        if not self.projectValidated:
+            return
+        self.convertStorageFormat(StorageFormats(bundleInfo["StorageFormat"]))
+        if bundleInfo["ImageStore"]:
+            # the bundled metadata is shared through the store, so images need not be decoded to size them
+            metadata = reader.readYaml("metadata.yaml") or {}
+            imageStore = ImageStore.shared()
+            for hexDigest, (height, width, channels) in metadata.items():
+                imageStore.putMetadata(bytes.fromhex(hexDigest), height, width, channels)
+            self.__enableImageStore(progressCallback)
+            self.writeProject()
+
+    def openBundle(self, bundlePath: str, progressCallback=None) -> None:
+        """
+            Opens a bundle read-only without unpacking it. Members are read through a memory map of the bundle,
+            as are bundled images, so a large bundle opens in the time it takes to parse its annotations.
+        """
+        def reportProgress(phase: LoadPhases, done: int = 0, total: int = 0) -> None:
+            if progressCallback:
+                progressCallback(phase, done, total)
+
+        reportProgress(LoadPhases.metadata)
+        reader = BundleReader(bundlePath)
+        bundleInfo = reader.info
+        self.readOnly = True
+        self.name = bundleInfo["Name"]
+        self.description = bundleInfo["Description"]
+        self.projectCreated = bundleInfo["ProjectCreated"]
+        self.imageIconPath = ""
+        self.datasetDir = reader.imagesDir() if bundleInfo["ImagesBundled"] else bundleInfo["DatasetDir"]
+
+        reportProgress(LoadPhases.images)
+        self.imageDataset = ImageManifest.fromYaml(self.datasetDir, reader.readYaml("dataset.yaml"))
+        self.scanState = ScanState(reader.bundlePath + "/integrity.npz")  # not loaded, a read-only project is never rescanned
+
+        reportProgress(LoadPhases.classes)
+        for _class in reader.readYaml("classes.yaml")["Classes"]:
+            self.classesDataset.append(MLClass(_class[0], tuple(_class[1])))
+
+        reportProgress(LoadPhases.models)
+        self.__loadModels([reader.readYaml(modelName) for modelName in reader.names("models/")])
+
+        reportProgress(LoadPhases.annotations)
+        # there is nowhere to cache a read-only project, so its annotations are held in memory
+        annotations = dict(self.__readAnnotations(reader.bundlePath + "/annotations.yaml",
+                                                  lambda bytesRead, totalBytes: reportProgress(LoadPhases.annotations, bytesRead, totalBytes),
+                                                  reader.read("annotations.yaml")))
+        self.createAnnotationDataset(self.imageDataset, {"Annotations": annotations})
+        self.projectValidated = True
 
     def createAnnotationDataset(self, imageDataset, annotationsDataset):
-        """ Creates a list of image objects to be used for annotating """
-        # create working annotation dataset from dataset.yaml
-        for path in imageDataset:
-            boundingBoxes = []
-            # check for annotations on image, and generate bounding boxes if so
-            annotations = annotationsDataset["Annotations"].get(path)
-            if annotations:
-                for annotation in annotations:
-                    boundingBoxes.append(BoundingBox(annotation[0], 
-                                                     annotation[1],
-                                                     annotation[2],
-                                                     annotation[3],
-                                                     QColor(annotation[4][0], 
-                                                            annotation[4][1],
-                                                            annotation[4][2],
-                                                            annotation[4][3]),
-                                                     annotation[5],
-                                                     int(annotation[6])))
-                    if int(annotation[6]) > self.highestID:
-                        self.highestID = int(annotation[6])
-
-            self.annotationDataset.append(Image(path, boundingBoxes))          
-
-    def getNextAnnotationID(self) -> int:
-        """ Returns the next ID to be used for an annotation """
+        """ Creates the dataset of image objects to be used for annotating, images are built as they are accessed """
+        annotations = annotationsDataset["Annotations"]
+        for records in annotations.values():
+            for annotation in records:
+                if int(annotation[6]) > self.highestID:
+                    self.highestID = int(annotation[6])
+
+        self.loadedAnnotations = annotations
+        self.annotatedImageCount = sum(1 for records in annotations.values() if records)
+        self.annotationDataset = AnnotationDataset(imageDataset,
+                                                   lambda start, stop: [annotations.get(imageID, []) for imageID in range(start, stop)],
+                                                   self.__createBoundingBoxes)
+        self.__attachImageData()
+
+    def createColumnarAnnotationDataset(self, changedImages: set, changedAnnotations: dict) -> None:
+        """ Creates the dataset of image objects whose bounding boxes are views over the columnar store """
+        self.annotationDataset = AnnotationDataset(self.imageDataset,
+                                                   lambda start, stop: [self.annotationStore.boundingBoxes(index) for index in range(start, stop)],
+                                                   lambda boundingBoxes: boundingBoxes)
+        self.__attachImageData()
+        for imageID in changedImages:
+            self.annotationDataset.updateAnnotations(imageID, changedAnnotations.get(imageID, []))
+
+        self.highestID = self.annotationStore.highestID()
+        # counted from the store's offsets, with journalled images as they now are
+        self.annotatedImageCount = self.annotationStore.annotatedImageCount
+        for imageID in changedImages:
+            start, stop = self.annotationStore.boxRange(imageID)
+            self.annotatedImageCount = self.annotatedImageCount + bool(changedAnnotations.get(imageID)) - (stop > start)
+        for annotations in changedAnnotations.values():
+            for annotation in annotations:
+                self.highestID = max(self.highestID, int(annotation[6]))
+
+    def createCachedAnnotationDataset(self, cachedAnnotations) -> None:
+        """ Creates the dataset of image objects from annotations held in the session cache """
+        changedImages = self.journal.imageKeys()
+        changedAnnotations = {imageID: cachedAnnotations.records(imageID) for imageID in changedImages}
+        self.journal.replay(changedAnnotations)
+
+        self.annotationDataset = AnnotationDataset(self.imageDataset,
+                                                   lambda start, stop: [cachedAnnotations.records(imageID) for imageID in range(start, stop)],
+                                                   self.__createBoundingBoxes)
+        self.__attachImageData()
+        for imageID in changedImages:
+            self.annotationDataset.updateAnnotations(imageID, changedAnnotations.get(imageID, []))
+
+        self.highestID = cachedAnnotations.highestID
+        # the cache only holds annotated images, journalled images are counted as they now are
+        self.annotatedImageCount = len(cachedAnnotations.rows)
+        for imageID in changedImages:
+            self.annotatedImageCount = self.annotatedImageCount + bool(changedAnnotations.get(imageID)) - (imageID in cachedAnnotations.rows)
+        for annotations in changedAnnotations.values():
+            for annotation in annotations:
+                self.highestID = max(self.highestID, int(annotation[6]))
+
+    def __attachImageData(self) -> None:
+        """
+            Has the annotation dataset's images read from the shared image store, if the project uses it, and
+            their metadata filled from the cache
+        """
+        if self.metadataCache is not None:
+            self.annotationDataset.imageMetadata = lambda imageID: self.metadataCache.get(imageID, self.scanState.stat(imageID))
+        if self.imageStore is not None:
+            self.annotationDataset.imageStore = self.imageStore
+            self.annotationDataset.imageDigest = lambda imageID: self.scanState.hash(imageID)
+
+    def __enableImageStore(self, progressCallback=None) -> None:
+        """ Adds the project's images to the shared image store and reads them from there from now on """
+        self.imageStore = ImageStore.shared()
+        imagePaths = list(self.imageDataset)
+        imageStats = [self.scanState.stat(imageID) for imageID in range(len(imagePaths))]
+        # images never hashed, e.g. appended by the watcher, are hashed and added by the next rescan
+        digests = [self.scanState.hash(imageID) for imageID in range(len(imagePaths))]
+        self.imageStore.rememberDigests(imagePaths, imageStats, digests)
+        self.__addToImageStore(self.imageStore, imagePaths, digests, progressCallback)
+
+        self.useImageStore = True
+        self.projectDirty = True
+        self.__attachImageData()
+        self.annotationDataset.invalidate(range(0, len(self.annotationDataset), AnnotationDataset.PAGE_SIZE))
+
+    @staticmethod
+    def __addToImageStore(imageStore: ImageStore, imagePaths: list, digests: list, progressCallback=None) -> None:
+        """ Adds images to the image store by digest, images without a digest are skipped """
+        for index, (imagePath, digest) in enumerate(zip(imagePaths, digests)):
+            if digest is not None and not imageStore.add(imagePath, digest):
+                print(f"Could not add {imagePath} to the image store")
+            if progressCallback and ((index + 1) % 256 == 0 or index + 1 == len(imagePaths)):
+                progressCallback(LoadPhases.store, index + 1, len(imagePaths))
+
+    def imagesWithoutMetadata(self) -> tuple:
+        """
+            Returns the ids, paths and stats of the images whose metadata is not cached for their current stats.
+            The stats are copied so results can be recorded against them after a rescan has moved on.
+        """
+        if self.metadataCache is None:
+            return [], [], []
+        imageIDs = self.metadataCache.missing(self.scanState)
+        return imageIDs, [self.imageDataset[imageID] for imageID in imageIDs], [self.scanState.stat(imageID) for imageID in imageIDs]
+
+    def applyImageMetadata(self, imageIDs: list, imageStats: list, shapes: list, save: bool = True) -> None:
+        """ Records the (height, width, channels) worked out for images, None for invalid ones, and saves the cache if save """
+        for imageID, stat, shape in zip(imageIDs, imageStats, shapes):
+            cached = self.metadataCache.get(imageID, stat)
+            if cached is not None and not cached[3]:
+                continue  # found not to decode, which a probe of its headers does not overrule
+            self.metadataCache.set(imageID, stat, shape)
+        self.annotationDataset.refreshMetadata()
+        if save:
+            self.saveImageMetadata()
+
+    def saveImageMetadata(self) -> None:
+        """ Writes the metadata cache out """
+        if self.metadataCache is None:
+            return
+        try:
+            self.metadataCache.save()
+        except Exception as exc:
+            print(exc)
+
+    def markImageInvalid(self, imageID: int) -> None:
+        """ Records that an image would not decode, in the metadata cache so it is still known when the project is reopened """
+        self.annotationDataset[imageID].isValid = False
+        if self.metadataCache is not None:
+            self.applyImageMetadata([imageID], [self.scanState.stat(imageID)], [None])
+
+    def __loadDatabaseAnnotations(self, start: int, stop: int) -> list:
+        """ Queries the box records of a range of images from the database """
+        imagePaths = self.imageDataset[start:stop]
+        annotations = self.database.readAnnotations(imagePaths)
+        return [annotations.get(path, []) for path in imagePaths]
+
+    def imageID(self, imageKey):
+        """ Returns the id of an image from an annotation key, older projects keyed annotations by absolute path """
+        if isinstance(imageKey, int):
+            return imageKey
+        return self.imageDataset.imageID(imageKey)
+
+    def __readAnnotations(self, filePath: str, progressCallback=None, data: bytes = None):
+        """ Yields (image id, box records) from an annotations file as it is parsed """
+        for imageKey, records in yamlStream.AnnotationsReader(filePath, progressCallback, data):
+            imageID = self.imageID(imageKey)
+            if imageID is None:
+                print(f"Annotations for {imageKey} do not match an image in the dataset")
+                continue
+            yield imageID, records
+
+    def __keyAnnotationsByID(self, annotations: dict) -> dict:
+        """ Re-keys a dict of annotations by image id """
+        annotationsByID = {}
+        for imageKey, records in annotations.items():
+            imageID = self.imageID(imageKey)
+            if imageID is None:
+                print(f"Annotations for {imageKey} do not match an image in the dataset")
+                continue
+            annotationsByID[imageID] = records
+        return annotationsByID
+
+    def __createBoundingBoxes(self, records: list) -> list:
+        """ Creates bounding boxes from stored records """
+        return [BoundingBox.fromRecord(record) for record in records]
+
+    def convertStorageFormat(self, storageFormat: StorageFormats) -> None:
+        """ Rewrites the project's dataset, classes, models and annotations in another storage format """
+        if not self.projectValidated or storageFormat is self.storageFormat:
+            return
+
+        # absolute so the old paths, stored absolute, are not mistaken for new ones when a relative dir was opened
+        projectPath = os.path.abspath(os.path.dirname(self.projectFile))
+        oldFilePaths = {self.datasetFilePath, self.classesFilePath, self.annotationsFilePath}
+        oldJournal = self.journal
+        oldDatabase = self.database
+        oldShardStore = self.shardStore
+        # put back if the conversion fails part way
+        oldAttributes = (self.storageFormat, self.datasetFilePath, self.classesFilePath, self.annotationsFilePath,
+                         oldJournal, oldDatabase, oldShardStore)
+        oldLoadAnnotations = self.annotationDataset.loadAnnotations
+        oldLoadedAnnotations = self.loadedAnnotations
+
+        if oldDatabase:
+            # images are read through the database being replaced, so they are gathered, edits included, beforehand
+            annotations = {imageID: [boundingBox.toRecord() for boundingBox in boundingBoxes]
+                           for imageID, _, boundingBoxes in self.annotationDataset.iterBoundingBoxes() if len(boundingBoxes) > 0}
+            self.loadedAnnotations = annotations
+            self.annotationDataset.loadAnnotations = lambda start, stop: [annotations.get(imageID, []) for imageID in range(start, stop)]
+
+        self.storageFormat = storageFormat
+        self.datasetFilePath, self.classesFilePath, self.annotationsFilePath = self.__storagePaths(projectPath, storageFormat)
+        newFilePaths = {self.datasetFilePath, self.classesFilePath, self.annotationsFilePath} - oldFilePaths
+        try:
+            self.journal = AnnotationJournal(os.path.splitext(self.annotationsFilePath)[0] + ".journal")
+            self.database = SqliteProjectBackend(self.annotationsFilePath) if storageFormat is StorageFormats.sqlite else None
+            # ids from before sharding stay as they are, each shard's range starts above them
+            self.shardStore = ShardedAnnotationStore.create(self.annotationsFilePath, self.highestID) if storageFormat is StorageFormats.sharded else None
+            if self.shardStore:
+                self.shardStore.leases.acquire(ShardLeases.MANIFEST)
+            self.writeImageDataset()
+            self.writeClasses()
+            self.writeModels()
+            self.writeAnnotationSnapshot()
+            self.writeProject()
+        except Exception:
+            # the project carries on in its old format, anything written in the new one is removed
+            if self.database is not oldDatabase and self.database:
+                self.database.close()
+            if self.shardStore is not oldShardStore and self.shardStore:
+                self.shardStore.leases.releaseAll()
+            (self.storageFormat, self.datasetFilePath, self.classesFilePath, self.annotationsFilePath,
+             self.journal, self.database, self.shardStore) = oldAttributes
+            self.annotationDataset.loadAnnotations = oldLoadAnnotations
+            self.loadedAnnotations = oldLoadedAnnotations
+            self.__removeStorageFiles(newFilePaths)
+            raise
+
+        # everything was folded into the new format so the old files are no longer needed
+        oldFilePaths -= {self.datasetFilePath, self.classesFilePath, self.annotationsFilePath}
+        oldJournal.reset()
+        if oldDatabase:
+            oldDatabase.close()
+        if oldShardStore:
+            oldShardStore.leases.releaseAll()
+        self.__removeStorageFiles(oldFilePaths)
+
+    def __removeStorageFiles(self, filePaths: set) -> None:
+        """ Removes the files and directories of a storage format """
+        for filePath in filePaths:
+            if os.path.isdir(filePath):
+                shutil.rmtree(filePath)
+            elif os.path.exists(filePath):
+                os.remove(filePath)
+                # sqlite keeps its write ahead log alongside the database
+                for suffix in ("-wal", "-shm"):
+                    if os.path.exists(filePath + suffix):
+                        os.remove(filePath + suffix)
+
+    def countAnnotationsPerClass(self) -> dict:
+        """ Returns a dict of class name -> number of bounding boxes of that class """
+        if self.database and not self.journal.hasPending():
+            return self.database.countAnnotationsPerClass()
+
+        counts = {}
+        for _, _, boundingBoxes in self.annotationDataset.iterBoundingBoxes():
+            for boundingBox in boundingBoxes:
+                counts[boundingBox.className] = counts.get(boundingBox.className, 0) + 1
+        return counts
+
+    def countAnnotatedImages(self) -> int:
+        """ Returns the number of images with at least one bounding box """
+        if self.database and not self.journal.hasPending():
+            self.annotatedImageCount = self.database.countAnnotatedImages()
+        else:
+            self.annotatedImageCount = sum(1 for index in range(len(self.annotationDataset)) if self.annotationDataset.isAnnotated(index))
+        return self.annotatedImageCount
+
+    def __storagePaths(self, projectPath: str, storageFormat: StorageFormats) -> tuple:
+        """ Returns the dataset, classes and annotations paths used by a storage format """
+        if storageFormat is StorageFormats.sqlite:
+            databasePath = projectPath + "/project.db"
+            return databasePath, databasePath, databasePath
+        if storageFormat is StorageFormats.numpy:
+            return projectPath + "/dataset.yaml", projectPath + "/classes.yaml", projectPath + "/annotations"
+        if storageFormat is StorageFormats.sharded:
+            return projectPath + "/dataset.yaml", projectPath + "/classes.yaml", projectPath + "/shards"
+        return projectPath + "/dataset.yaml", projectPath + "/classes.yaml", projectPath + "/annotations.yaml"
+
+    def addImages(self, imagePaths: list, imageStats: list, imageHashes: list = None) -> list:
+        """
+            Appends images, given relative to the dataset directory, with their (mtime, size, inode) and content
+            hashes, returns their ids. Images added without hashes are hashed by the next rescan. In a sharded
+            project only the annotator looking after the shared files adds images, the others pick them up from
+            the manifest so every annotator numbers them the same.
+        """
+        if not self.ownsSharedFiles():
+            return []
+        imageIDs = []
+        for index, (imagePath, stat) in enumerate(zip(imagePaths, imageStats)):
+            imageID = self.annotationDataset.append(imagePath)
+            self.scanState.setStat(imageID, stat)
+            if imageHashes:
+                self.scanState.setHash(imageID, imageHashes[index])
+            imageIDs.append(imageID)
+        if imageIDs:
+            self.imagesDirty = True
+        return imageIDs
+
+    def applyRescan(self, rescanResult) -> None:
+        """ Applies the differences found by a dataset rescan """
+        self.scanState.mtimes = rescanResult.scanState.mtimes
+        self.scanState.sizes = rescanResult.scanState.sizes
+        self.scanState.inodes = rescanResult.scanState.inodes
+        self.scanState.hashes = rescanResult.scanState.hashes
+        addedIDs = self.addImages(rescanResult.added, rescanResult.addedStats, rescanResult.addedHashes)
+        if self.imageStore is not None:
+            imageIDs = addedIDs + rescanResult.modified
+            imagePaths = [self.imageDataset[imageID] for imageID in imageIDs]
+            digests = [self.scanState.hash(imageID) for imageID in imageIDs]
+            self.imageStore.rememberDigests(imagePaths, [self.scanState.stat(imageID) for imageID in imageIDs], digests)
+            self.__addToImageStore(self.imageStore, imagePaths, digests)
+        # modified images are rebuilt from disk the next time they are accessed, removed ones fail to load as before
+        self.annotationDataset.invalidate(rescanResult.modified)
+        if not self.ownsSharedFiles():
+            return
+        try:
+            self.scanState.save()
+        except Exception as exc:
+            print(exc)
+
+    def createAnnotationVersion(self, name: str) -> bool:
+        """ Stores the current annotations as a named version, returns false if the name is already taken """
+        return self.annotationVersions.create(name, len(self.imageDataset), self.annotationDataset.modifiedAnnotations.keys(),
+                                              lambda imageID: [boundingBox.toRecord() for boundingBox in self.annotationDataset[imageID].boundingBoxes])
+
+    def restoreAnnotationVersion(self, name: str) -> list:
+        """
+            Replaces the annotations with those of a named version, saved with the next write like any edit.
+            Returns the ids of images that could not be restored as another annotator holds their shard.
+        """
+        annotations = {imageID: records for imageID, records in self.annotationVersions.restore(name).items()
+                       if imageID < len(self.imageDataset)}
+        # box ids keep counting up from the current highest so boxes made after a restore never reuse an id
+        return self.__replaceAnnotations(annotations)
+
+    def mergeAnnotations(self, theirProjectDir: str, baseVersion: str, policy: MergePolicies = MergePolicies.ours):
+        """
+            Three-way merges the annotations of another copy of this project into this one, saved with the next
+            write like any edit. baseVersion names the annotation version both copies started from, images are
+            matched by their path within the dataset. The other copy is only read. Returns the MergeResult and the
+            ids of images that could not be changed as another annotator holds their shard.
+        """
+        theirProject = Project()
+        theirProject.loadProject(theirProjectDir, readOnly=True)
+        try:
+            if not theirProject.projectValidated:
+                raise ValueError(f"Could not load project {theirProjectDir}")
+            theirs = self.__annotationsByPath(theirProject)
+        finally:
+            if theirProject.database:
+                theirProject.database.close()
+
+        imageIDs = {self.imageDataset.relativePath(imageID): imageID for imageID in range(len(self.imageDataset))}
+        base = {self.imageDataset.relativePath(imageID): records
+                for imageID, records in self.annotationVersions.read(baseVersion).items() if imageID < len(self.imageDataset)}
+        ours = self.__annotationsByPath(self)
+        result = mergeAnnotations(base, ours, theirs, policy)
+
+        annotations = {}
+        for imagePath, records in result.annotations.items():
+            imageID = imageIDs.get(imagePath)
+            if imageID is None:
+                print(f"Annotations for {imagePath} do not match an image in the dataset")
+                continue
+            annotations[imageID] = records
+
+        # ids are unique across the project, but each copy handed out ids from the same point, so a box drawn on
+        # one image in theirs can share its id with a box on another image in ours
+        for imageID, records in annotations.items():
+            for record in records:
+                self.highestID = max(self.highestID, int(record[6]))
+                if self.shardStore:
+                    self.shardStore.noteIDs(self.shardStore.shardOf(imageID), [record[6]])
+        owners = {int(record[6]): imageIDs[imagePath] for imagePath, records in ours.items() for record in records}
+        for imageID in sorted(annotations):
+            records = annotations[imageID]
+            for index, record in enumerate(records):
+                if owners.setdefault(int(record[6]), imageID) != imageID:
+                    records[index] = list(record[:6]) + [self.getNextAnnotationID(imageID)]
+                    result.renumbered = result.renumbered + 1
+        return result, self.__replaceAnnotations(annotations)
+
+    @staticmethod
+    def __annotationsByPath(project: "Project") -> dict:
+        """ Returns the annotated images of a project as a dict of path within the dataset -> box records """
+        return {project.imageDataset.relativePath(imageID): [boundingBox.toRecord() for boundingBox in boundingBoxes]
+                for imageID, _, boundingBoxes in project.annotationDataset.iterBoundingBoxes() if len(boundingBoxes) > 0}
+
+    def getNextAnnotationID(self, imageID: int = None) -> int:
+        """ Returns the next ID to be used for an annotation on an image, raises AnnotationIDsExhausted if a shard has none left """
+        if self.shardStore and imageID is not None:
+            # without the lease the box cannot be saved anyway, so an id from the shard's range is still safe
+            self.__leaseShard(imageID)
+            return self.shardStore.nextID(self.shardStore.shardOf(imageID))
+
         nextID = self.highestID + 1
         self.highestID = nextID
         return nextID
 
     def writeProject(self) -> None:
         """ Write project out to disk """
-        if not self.projectValidated:
+        if not self.projectValidated or self.readOnly:
             return
+        self.projectDirty = False
+        self.__writeProjectInfo(self.__projectInfo())
 
-        currDatetime = datetime.now()
-        
-        # create project file
-        projectInfo = {"Name": self.name,  
+    def __projectInfo(self) -> dict:
+        """ Returns the project metadata as it is stored in the project file """
+        return {"Name": self.name,  
                    "Description": self.description, 
                    "DatasetDir": self.datasetDir, 
                    "DatasetFilePath":self.datasetFilePath,
@@ -231,62 +1086,428 @@ class Project:
                    "ImageIconPath": self.imageIconPath,
                    "AnnotationsFilePath":self.annotationsFilePath,
                    "ModelsDir":self.modelsDir,
+                   "StorageFormat":self.storageFormat.value,
+                   "WatchDataset":self.watchDataset,
+                   "ImageStore":self.useImageStore,
                    "ProjectCreated":self.projectCreated, 
-                   "LastUpdated":currDatetime }
+                   "LastUpdated":self.lastUpdated }
 
-        with open(self.projectFile, "w") as file:
-            try:
-                yaml.dump(projectInfo, file, sort_keys=False, Dumper=NoAliasDumper)  # Dont want sorting present
-            except Exception as exc:
-                print(exc)
+    def __writeProjectInfo(self, projectInfo: dict) -> None:
+        """ Writes project metadata out to the project file """
+        try:
+            dumpYaml(projectInfo, self.projectFile)
+        except Exception as exc:
+            print(exc)
     
+    def writeImageDataset(self) -> None:
+        """ Writes the list of images out to disk """
+        self.imagesDirty = False
+        self.__writeImageManifest(self.imageDataset.toYaml())
+
+    def __writeImageManifest(self, manifestYaml: dict) -> None:
+        """ Writes the image manifest out to disk """
+        if self.database:
+            self.database.writeImages(list(ImageManifest.fromYaml(self.datasetDir, manifestYaml)))
+            return
+
+        try:
+            dumpYaml(manifestYaml, self.datasetFilePath)
+        except Exception as exc:
+            print(exc)
+
     def writeClasses(self) -> None:
         """ Writes all classes out to disk """
-        currDatetime = datetime.now()
+        self.classesDirty = False
+        self.__writeClassInfos(self.__classInfos())
+
+    def __classInfos(self) -> list:
+        """ Returns the classes as they are stored on disk """
         mlClasses = []
         for mlClass in self.classesDataset:
             mlClasses.append([mlClass.className, mlClass.classColour])
+        return mlClasses
+
+    def __writeClassInfos(self, mlClasses: list) -> None:
+        """ Writes a list of [class name, class colour] out to disk """
+        if self.database:
+            self.database.writeClasses(mlClasses)
+            return
+        currDatetime = datetime.now()
         classesInfo = {"Classes":mlClasses, "LastUpdated":currDatetime}
-        with open(self.classesFilePath, "w") as file:
+        try:
+            dumpYaml(classesInfo, self.classesFilePath)
+        except Exception as exc:
+            print(exc)
+
+    def addClass(self, mlClass: MLClass) -> bool:
+        """ Adds a class to the project, returns false if another annotator looks after the project's classes """
+        if not self.ownsSharedFiles():
+            return False
+        self.classesDataset.append(mlClass)
+        self.classesDirty = True
+        return True
+
+    def addModel(self, model: Model) -> None:
+        """ Adds a model to the project """
+        self.modelDataset.append(model)
+        self.modelsDirty = True
+
+    def updateImageAnnotations(self, image: Image, boundingBoxes: list) -> bool:
+        """
+            Updates an image's bounding boxes, journalling every box that was created, moved, resized or removed.
+            Returns false if the image belongs to a shard another annotator has leased, or the project is read-only.
+        """
+        if self.readOnly:
+            return False
+        if self.shardStore and image.index is not None and not self.__leaseShard(image.index):
+            return False
+
+        records = [boundingBox.toRecord() for boundingBox in boundingBoxes]
+        self.__journalAnnotations(image.index, [boundingBox.toRecord() for boundingBox in image.boundingBoxes], records)
+
+        if self.annotatedImageCount is not None:
+            self.annotatedImageCount = self.annotatedImageCount + (len(records) > 0) - (len(image.boundingBoxes) > 0)
+        image.updateBoundingBoxes(boundingBoxes)
+        if image.index is not None:
+            self.annotationDataset.updateAnnotations(image.index, records)
+        return True
+
+    def __journalAnnotations(self, imageID: int, previousRecords: list, records: list) -> None:
+        """ Journals every box of an image that was created, moved, resized or removed """
+        if not self.journal:
+            return
+        previous = {record[6]: record for record in previousRecords}
+        current = {record[6]: record for record in records}
+        for annotationID, record in current.items():
+            if previous.get(annotationID) != record:
+                self.journal.recordPut(imageID, record)
+        for annotationID in previous:
+            if annotationID not in current:
+                self.journal.recordDelete(imageID, annotationID)
+
+    def __replaceAnnotations(self, annotations: dict) -> list:
+        """
+            Brings every image's boxes to those in a dict of image id -> box records. Each changed image goes
+            through the journal like an edit, so it is written out in the project's storage format by the next
+            save. Returns the ids of images that could not be changed as another annotator holds their shard.
+        """
+        current = {imageID: [boundingBox.toRecord() for boundingBox in boundingBoxes]
+                   for imageID, _, boundingBoxes in self.annotationDataset.iterBoundingBoxes() if len(boundingBoxes) > 0}
+        changed = []
+        skipped = []
+        for imageID in sorted(set(current) | set(annotations)):
+            previousRecords = current.get(imageID, [])
+            records = [list(record) for record in annotations.get(imageID, [])]
+            if records == previousRecords:
+                continue
+            if self.shardStore and not self.__leaseShard(imageID):
+                skipped.append(imageID)
+                continue
+            self.__journalAnnotations(imageID, previousRecords, records)
+            self.annotationDataset.updateAnnotations(imageID, records)
+            if self.annotatedImageCount is not None:
+                self.annotatedImageCount = self.annotatedImageCount + (len(records) > 0) - (len(previousRecords) > 0)
+            for record in records:
+                self.highestID = max(self.highestID, int(record[6]))
+            changed.append(imageID)
+
+        # materialised images are rebuilt from the replaced boxes when next accessed
+        self.annotationDataset.invalidate(changed)
+        return skipped
+
+    def imageLeaseHolder(self, imageID: int):
+        """ Returns who holds the shard an image belongs to, None if it is free or the project is not sharded """
+        if not self.shardStore:
+            return None
+        shard = self.shardStore.shardOf(imageID)
+        return None if self.shardStore.leases.holds(shard) else self.shardStore.leases.holder(shard)
+
+    def syncShards(self) -> list:
+        """
+            Renews this instance's shard leases and picks up shards and shared files other annotators have written
+            since. Returns the shards whose lease was lost, edits to them are kept and retried with each write.
+        """
+        return self.applyShardChanges(self.readShardChanges())
+
+    def readShardChanges(self) -> dict:
+        """
+            The disk side of syncShards, safe to run off the GUI thread. Renews the leases and reads whatever other
+            annotators have written since, the result is handed to applyShardChanges on the GUI thread.
+        """
+        if not self.shardStore:
+            return {}
+        try:
+            lostShards = self.shardStore.leases.renew()
+            for shard in lostShards:
+                print(f"Lost the lease on annotation shard {shard}")
+            # whoever looked after the shared files may have left, their files are read again before taking over
+            sharedFiles = None
+            if not self.ownsSharedFiles():
+                self.shardStore.leases.acquire(ShardLeases.MANIFEST)
+                sharedFiles = self.__readSharedFiles()
+            changedShards = self.shardStore.refresh()
+        except Exception as exc:
+            print(exc)
+            return {}
+        return {"LostShards": lostShards, "SharedFiles": sharedFiles, "ChangedShards": changedShards}
+
+    def applyShardChanges(self, changes: dict) -> list:
+        """ Swaps in what readShardChanges read, returns the shards whose lease was lost """
+        if not changes:
+            return []
+        if changes["SharedFiles"] is not None:
+            self.__applySharedFiles(*changes["SharedFiles"])
+        for shard, annotations in changes["ChangedShards"].items():
+            # a shard leased since it was read has already been read again, and may hold edits made since
+            if not self.shardStore.leases.holds(shard):
+                self.__replaceShardAnnotations(shard, annotations)
+        return [shard for shard in changes["LostShards"] if shard != ShardLeases.MANIFEST]
+
+    def ownsSharedFiles(self) -> bool:
+        """
+            Returns true if this instance may write the files all annotators of a sharded project share, the
+            project, dataset, classes and integrity files. Other annotators only read them.
+        """
+        return self.shardStore is None or self.shardStore.leases.holds(ShardLeases.MANIFEST)
+
+    def __sharedFileMtimes(self) -> dict:
+        """ Returns the mtime of each file shared between annotators, None for one that is missing """
+        mtimes = {}
+        for path in (self.datasetFilePath, self.classesFilePath, self.scanState.filePath):
             try:
-                yaml.dump(classesInfo, file, sort_keys=False, Dumper=NoAliasDumper)
-            except Exception as exc:
-                print(exc)
+                mtimes[path] = os.stat(path).st_mtime_ns
+            except OSError:
+                mtimes[path] = None
+        return mtimes
+
+    def __readSharedFiles(self):
+        """
+            Reads the shared files if they changed since they were last read, returns the image manifest, scan
+            state and classes found in them, or None if nothing changed
+        """
+        mtimes = self.__sharedFileMtimes()
+        if mtimes == self.sharedFileMtimes:
+            return None
+        self.sharedFileMtimes = mtimes
+
+        with open(self.datasetFilePath, "r") as stream:
+            imageDataset = ImageManifest.fromYaml(self.datasetDir, yaml.load(stream, Loader=yamlStream.Loader))
+        scanState = ScanState(self.scanState.filePath)
+        scanState.load()
+        with open(self.classesFilePath, "r") as stream:
+            classesYaml = yaml.safe_load(stream)
+        return imageDataset, scanState, classesYaml
+
+    def __applySharedFiles(self, imageDataset: ImageManifest, scanState: ScanState, classesYaml: dict) -> None:
+        """ Picks up images and classes added to the shared files since they were last read """
+        # images are only ever appended, so the manifest on disk extends the one in memory
+        imageCount = len(self.imageDataset)
+        if len(imageDataset) > imageCount:
+            if imageCount and imageDataset.relativePath(imageCount - 1) != self.imageDataset.relativePath(imageCount - 1):
+                print(f"The image manifest in {self.datasetFilePath} no longer matches this project's images")
+                return
+            for imageID in range(imageCount, len(imageDataset)):
+                self.annotationDataset.append(imageDataset.relativePath(imageID))
+            scanState.reserve(len(self.imageDataset))
+            self.scanState = scanState
+
+        classNames = {mlClass.className for mlClass in self.classesDataset}
+        for _class in classesYaml["Classes"]:
+            if _class[0] not in classNames:
+                self.classesDataset.append(MLClass(_class[0], tuple(_class[1])))
+
+    def __leaseShard(self, imageID: int) -> bool:
+        """ Leases the shard of an image, picking up whatever was written to it before the lease was taken """
+        shard = self.shardStore.shardOf(imageID)
+        if self.shardStore.leases.holds(shard):
+            return True
+        if not self.shardStore.leases.acquire(shard):
+            return False
+        self.__replaceShardAnnotations(shard, self.shardStore.readShard(shard))
+        return True
+
+    def __replaceShardAnnotations(self, shard: int, annotations: dict) -> None:
+        """ Swaps in a shard's annotations as read from disk, its images are rebuilt when next accessed """
+        start = shard * self.shardStore.shardSize
+        stop = min(start + self.shardStore.shardSize, len(self.annotationDataset))
+        previousCount = sum(1 for imageID in range(start, stop) if self.loadedAnnotations.get(imageID))
+        for imageID in range(start, stop):
+            self.loadedAnnotations.pop(imageID, None)
+        self.loadedAnnotations.update(annotations)
+        self.annotationDataset.invalidate(range(start, stop))
+        if self.annotatedImageCount is not None:
+            self.annotatedImageCount = self.annotatedImageCount + sum(1 for records in annotations.values() if records) - previousCount
+
+    def releaseShards(self) -> None:
+        """ Gives up this instance's shard leases so other annotators can take them """
+        if self.shardStore:
+            self.shardStore.leases.releaseAll()
 
     def writeAnnotations(self) -> None:
-        """ Writes out all annotations to disk """
-        annotations = {} 
-        for image in self.annotationDataset:
-            if image.annotated:
-                boundingBoxes = []
-                for boundingBox in image.boundingBoxes:
-                    boundingBoxes.append([boundingBox.x, boundingBox.y, boundingBox.width, boundingBox.height, boundingBox.colour.getRgb(), boundingBox.className, boundingBox.id])
-                annotations.update({image.path:boundingBoxes})
-        
+        """ Writes out annotation changes to the journal, folding it into the annotations file once it grows """
+        if not self.journal:
+            self.writeAnnotationSnapshot()
+            return
+        self.__writeAnnotationRecords(self.journal.takePending())
+
+    def __writeAnnotationRecords(self, records: list) -> None:
+        """ Writes journal records taken from the pending changes out to disk """
+        self.annotationVersions.recordChanged(record["image"] for record in records)
+        if self.shardStore:
+            # leased shards are small, so each is rewritten rather than journalled where others would append too.
+            # Changes to shards another annotator holds stay in the journal and are retried with every write
+            unsaved = self.shardStore.applyRecords(self.journal.readRecords() + records)
+            self.journal.rewrite(unsaved)
+            self.unsavedAnnotationCount = len(unsaved)
+            return
+
+        if self.database:
+            # the database takes the pending changes directly in a single transaction, it indexes images by path
+            self.database.applyJournal([dict(record, image=self.imageDataset[record["image"]]) for record in records])
+            return
+
+        self.journal.append(records)
+        if self.journal.shouldCompact():
+            self.journal.compact(self.__readAnnotationSnapshot, self.__writeAnnotationSnapshot)
+
+    def writeAnnotationSnapshot(self) -> None:
+        """ Writes out all annotations to disk, replacing the journal """
+        # images are serialised one at a time as they are read from the dataset
+        annotationItems = ((imageID, [boundingBox.toRecord() for boundingBox in boundingBoxes])
+                           for imageID, _, boundingBoxes in self.annotationDataset.iterBoundingBoxes()
+                           if len(boundingBoxes) > 0)
+
+        if self.journal:
+            self.journal.waitForCompaction()
+        self.__writeAnnotationSnapshot(annotationItems)
+        if self.journal:
+            self.journal.reset()
+
+    def __readAnnotationSnapshot(self):
+        """ Returns an iterable of (image id, box records) currently stored on disk """
+        if self.database:
+            return self.__keyAnnotationsByID(self.database.readAnnotations()).items()
+
+        if self.shardStore:
+            return self.shardStore.load().items()
+
+        if self.storageFormat is StorageFormats.numpy:
+            annotationStore = ColumnarAnnotationStore(self.annotationsFilePath)
+            annotationStore.load()
+            return annotationStore.readAnnotations().items()
+
+        return self.__readAnnotations(self.annotationsFilePath)
+
+    def __writeAnnotationSnapshot(self, annotationItems) -> None:
+        """ Writes an iterable of (image id, bounding box records) out as the annotations file """
+        if self.database:
+            self.database.writeAnnotations({self.imageDataset[imageID]: records for imageID, records in annotationItems})
+            return
+
+        if self.shardStore:
+            self.shardStore.writeAll(dict(annotationItems))
+            return
+
+        if self.storageFormat is StorageFormats.numpy:
+            classes = [(mlClass.className, mlClass.classColour) for mlClass in self.classesDataset]
+            ColumnarAnnotationStore.write(self.annotationsFilePath, len(self.imageDataset), dict(annotationItems), classes)
+            return
+
+        # streamed out and swapped in so a crash never leaves a half written snapshot behind the journal
         currDatetime = datetime.now() 
-        annotationInfo = {"Project": self.name, "LastUpdated":currDatetime, "Annotations":annotations}
-        with open(self.annotationsFilePath, "w") as file:
-            try:
-                yaml.dump(annotationInfo, file, sort_keys=False, Dumper=NoAliasDumper)
-            except Exception as exc:
-                print(exc)
+        try:
+            yamlStream.dumpAnnotations(self.annotationsFilePath, {"Project": self.name, "LastUpdated":currDatetime}, annotationItems)
+        except Exception as exc:
+            print(exc)
 
     def writeModels(self) -> None:
         """ Writes out all models to disk """
+        self.modelsDirty = False
+        self.__writeModelInfos(self.__modelInfos())
+
+    def __modelInfos(self) -> list:
+        """ Returns the models as they are stored on disk """
         currDatetime = datetime.now()
+        modelInfos = []
         for model in self.modelDataset:
-            modelFilePath = self.modelsDir + "/" + model.modelName + ".yaml"
-            modelInfo = {"Name": model.modelName,
-                         "Type": model.modelType,
-                         "Device": model.device,
-                         "Dimensions": model.dimensions,
-                         "Epochs": model.epochs,
-                         "BatchSize": model.batchSize,
-                         "Workers": model.workers,
-                         "LastUpdated": currDatetime}
-            with open(modelFilePath, "w") as file:
-                try:
-                    yaml.dump(modelInfo, file, sort_keys=False, Dumper=NoAliasDumper)
-                except:
-                    print(exc)
+            modelInfos.append({"Name": model.modelName,
+                               "Type": model.modelType,
+                               "Device": model.device,
+                               "Dimensions": list(model.dimensions),
+                               "Epochs": model.epochs,
+                               "BatchSize": model.batchSize,
+                               "Workers": model.workers,
+                               "LastUpdated": currDatetime})
+        return modelInfos
+
+    def __writeModelInfos(self, modelInfos: list) -> None:
+        """ Writes a list of model dicts out to disk """
+        if self.database:
+            self.database.writeModels(modelInfos)
+            return
+
+        for modelInfo in modelInfos:
+            modelFilePath = self.modelsDir + "/" + modelInfo["Name"] + ".yaml"
+            try:
+                dumpYaml(modelInfo, modelFilePath)
+            except Exception as exc:
+                print(exc)
+
+    def isDirty(self) -> bool:
+        """ Returns true if anything has changed since the project was last saved """
+        if self.readOnly:
+            return False
+        journalPending = self.journal is not None and (self.journal.hasPending() or self.unsavedAnnotationCount > 0)
+        return self.projectDirty or self.imagesDirty or self.classesDirty or self.modelsDirty or journalPending
+
+    def takeDirtySnapshot(self) -> dict:
+        """
+            Copies everything changed since the last save and marks it clean. The snapshot shares no state with
+            the project so it can be written out by writeSnapshot on another thread.
+        """
+        snapshot = {}
+        if not self.projectValidated or self.readOnly:
+            return snapshot
+        if self.imagesDirty or self.classesDirty or self.modelsDirty or (self.journal and self.journal.hasPending()):
+            # the project file records when anything in the project was last changed
+            self.lastUpdated = datetime.now()
+            self.projectDirty = True
+        if not self.ownsSharedFiles():
+            # another annotator writes the shared files, whatever this instance changed there is picked up from them
+            self.projectDirty = self.imagesDirty = self.classesDirty = False
+        if self.projectDirty:
+            snapshot["Project"] = self.__projectInfo()
+            self.projectDirty = False
+        if self.imagesDirty:
+            snapshot["Images"] = self.imageDataset.toYaml()
+            snapshot["ScanState"] = self.scanState.copy()
+            self.imagesDirty = False
+        if self.classesDirty:
+            snapshot["Classes"] = self.__classInfos()
+            self.classesDirty = False
+        if self.modelsDirty:
+            snapshot["Models"] = self.__modelInfos()
+            self.modelsDirty = False
+        if self.journal and (self.journal.hasPending() or self.unsavedAnnotationCount > 0):
+            # taken even when empty so changes waiting on a leased shard are retried
+            snapshot["Annotations"] = self.journal.takePending()
+        return snapshot
+
+    def writeSnapshot(self, snapshot: dict) -> None:
+        """ Writes out a snapshot taken by takeDirtySnapshot """
+        if "Project" in snapshot:
+            self.__writeProjectInfo(snapshot["Project"])
+        if "Images" in snapshot:
+            self.__writeImageManifest(snapshot["Images"])
+        if "ScanState" in snapshot:
+            try:
+                snapshot["ScanState"].save()
+            except Exception as exc:
+                print(exc)
+        if "Classes" in snapshot:
+            self.__writeClassInfos(snapshot["Classes"])
+        if "Models" in snapshot:
+            self.__writeModelInfos(snapshot["Models"])
+        if "Annotations" in snapshot:
+            self.__writeAnnotationRecords(snapshot["Annotations"])
 
@@ -0,0 +1,75 @@
+"""
+    projectLoader.py
+    Loads or creates a project on a worker thread so the UI stays responsive
+"""
+
+from PyQt6.QtCore import QThread, pyqtSignal
+
+from project import Project, LoadPhases, LoadCancelled
+
+
+class ProjectLoader(QThread):
+    """
+        Builds a project off the GUI thread. The project is only handed over through loaded once it is
+        complete, a failed or cancelled load never exposes the partly built project.
+    """
+    progress = pyqtSignal(object, int, int)  # LoadPhases, done, total (0 when unknown)
+    loaded = pyqtSignal(object)  # fully loaded project
+    failed = pyqtSignal(str)
+    cancelled = pyqtSignal()
+
+    def __init__(self, projectDir: str = None, projectName: str = None, imageDirectory: str = None,
+                 bundlePath: str = None, readOnly: bool = False, useImageStore: bool = False) -> None:
+        """
+            init, opens projectDir or creates a project called projectName over imageDirectory, keeping its
+            images in the shared image store if useImageStore. A bundle at bundlePath is imported as a project,
+            with imageDirectory as where its dataset is if the images are not bundled, or opened in place if readOnly.
+        """
+        super().__init__()
+        self.projectDir = projectDir
+        self.projectName = projectName
+        self.imageDirectory = imageDirectory
+        self.bundlePath = bundlePath
+        self.readOnly = readOnly
+        self.useImageStore = useImageStore
+        self.cancelRequested = False
+
+    def cancel(self) -> None:
+        """ Requests the load stops at the next progress report """
+        self.cancelRequested = True
+
+    def run(self) -> None:
+        """ Worker """
+        project = Project()
+        try:
+            if self.bundlePath and self.readOnly:
+                project.openBundle(self.bundlePath, self.__reportProgress)
+            elif self.bundlePath:
+                project.importBundle(self.bundlePath, self.projectName, self.imageDirectory, progressCallback=self.__reportProgress)
+            elif self.projectDir:
+                project.loadProject(self.projectDir, self.__reportProgress)
+            else:
+                project.createProject(self.projectName, self.imageDirectory, progressCallback=self.__reportProgress,
+                                      useImageStore=self.useImageStore)
+        except LoadCancelled:
+            if project.database:
+                project.database.close()
+            self.cancelled.emit()
+            return
+        except Exception as exc:
+            print(exc)
+            self.failed.emit(str(exc))
+            return
+
+        if self.cancelRequested:
+            self.cancelled.emit()
+        elif not project.projectValidated:
+            self.failed.emit(f"Could not load project {self.projectDir or self.bundlePath or self.projectName}")
+        else:
+            self.loaded.emit(project)
+
+    def __reportProgress(self, phase: LoadPhases, done: int, total: int) -> None:
+        """ Forwards progress to the GUI thread and stops loading if cancelled """
+        if self.cancelRequested:
+            raise LoadCancelled()
+        self.progress.emit(phase, done, total)
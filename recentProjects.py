@@ -0,0 +1,73 @@
+"""
+    recentProjects.py
+    An index of recently used projects, so the start page can list them without opening any project files
+"""
+
+import os
+import threading
+
+import yaml
+
+
+class RecentProjects:
+    """
+        Keeps a summary of each recently used project (name, icon, image and annotated counts, last updated)
+        in a single small index file. It is refreshed whenever a project is opened or written.
+    """
+    MAX_PROJECTS = 20
+
+    def __init__(self, indexPath: str = None) -> None:
+        """ init """
+        self.indexPath = indexPath or os.getcwd() + "/projects/recentProjects.yaml"
+        self.projects = []  # summaries, most recently used first
+        self.lock = threading.Lock()  # projects are written from the autosave thread
+
+        try:
+            with open(self.indexPath, "r") as stream:
+                self.projects = yaml.safe_load(stream) or []
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            print(exc)
+
+    def entries(self) -> list:
+        """ Returns the summary of every recent project, most recently used first """
+        with self.lock:
+            return list(self.projects)
+
+    def update(self, project) -> None:
+        """ Moves a project to the top of the index with its current summary """
+        if not project.projectValidated or project.readOnly:
+            return
+        projectDir = os.path.dirname(os.path.abspath(project.projectFile))
+        with self.lock:
+            previous = next((entry for entry in self.projects if entry["ProjectDir"] == projectDir), {})
+            annotatedCount = project.annotatedImageCount
+            if annotatedCount is None:
+                annotatedCount = previous.get("AnnotatedCount", 0)  # not counted yet this session
+            entry = {"ProjectDir": projectDir,
+                     "Name": project.name,
+                     "ImageIconPath": project.imageIconPath,
+                     "ImageCount": len(project.imageDataset),
+                     "AnnotatedCount": annotatedCount,
+                     "LastUpdated": project.lastUpdated}
+            self.projects = [entry] + [other for other in self.projects if other["ProjectDir"] != projectDir]
+            del self.projects[self.MAX_PROJECTS:]
+            self.__write()
+
+    def remove(self, projectDir: str) -> None:
+        """ Drops a project from the index, e.g. once it has been deleted """
+        with self.lock:
+            self.projects = [entry for entry in self.projects if entry["ProjectDir"] != projectDir]
+            self.__write()
+
+    def __write(self) -> None:
+        """ Writes the index out to disk """
+        try:
+            os.makedirs(os.path.dirname(self.indexPath), exist_ok=True)
+            tempPath = self.indexPath + ".tmp"
+            with open(tempPath, "w") as file:
+                yaml.safe_dump(self.projects, file, sort_keys=False)
+            os.replace(tempPath, self.indexPath)
+        except Exception as exc:
+            print(exc)
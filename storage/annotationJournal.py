@@ -0,0 +1,218 @@
+"""
+    annotationJournal.py
+    An append-only journal of annotation changes that is folded back into the annotations snapshot
+"""
+
+import os
+import json
+import threading
+
+
+class AnnotationJournal:
+    """
+        Records bounding box changes as small records, replays them on load and compacts them into the snapshot
+    """
+    COMPACTION_THRESHOLD = 4 * 1024 * 1024  # size of the journal in bytes before it is folded into the snapshot
+
+    def __init__(self, journalPath: str, imageKey=None) -> None:
+        """ init, imageKey maps the image of a stored record to the key used in memory, None to drop the record """
+        self.journalPath = journalPath
+        self.imageKey = imageKey
+        self.compactingPath = journalPath + ".compacting"  # journal that is currently being folded into the snapshot
+
+        self.pending = {}  # records not yet written, keyed by (image, annotation id) so repeated edits coalesce
+        self.pendingLock = threading.Lock()
+        self.fileLock = threading.Lock()  # guards appending to and rotating the journal file
+        self.compactionThread = None
+
+    def recordPut(self, imageKey, record: list) -> None:
+        """ Records the creation or update (move / resize) of a bounding box """
+        with self.pendingLock:
+            self.pending[(imageKey, record[6])] = {"op": "put", "image": imageKey, "box": record}
+
+    def recordDelete(self, imageKey, annotationID: int) -> None:
+        """ Records the removal of a bounding box """
+        with self.pendingLock:
+            self.pending[(imageKey, annotationID)] = {"op": "delete", "image": imageKey, "id": annotationID}
+
+    def hasPending(self) -> bool:
+        """ Returns true if there are records that have not been written to the journal """
+        return len(self.pending) > 0
+
+    def takePending(self) -> list:
+        """ Returns and clears the records that have not been written yet """
+        with self.pendingLock:
+            records = list(self.pending.values())
+            self.pending = {}
+        return records
+
+    def flush(self) -> int:
+        """ Appends all pending records to the journal, returns the number of records written """
+        return self.append(self.takePending())
+
+    def append(self, records: list) -> int:
+        """ Appends records previously taken with takePending to the journal, returns the number written """
+        if not records:
+            return 0
+
+        lines = "".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records)
+        with self.fileLock:
+            with open(self.journalPath, "a") as file:
+                file.write(lines)
+                file.flush()
+                os.fsync(file.fileno())
+        return len(records)
+
+    def readRecords(self) -> list:
+        """ Returns the records written to the journal """
+        return list(self.__readRecords(self.journalPath))
+
+    def rewrite(self, records: list) -> None:
+        """ Replaces the journal with records, for stores that take records out as they apply them """
+        with self.fileLock:
+            if not records:
+                if os.path.exists(self.journalPath):
+                    os.remove(self.journalPath)
+                return
+            tempPath = self.journalPath + ".tmp"
+            with open(tempPath, "w") as file:
+                file.write("".join(json.dumps(record, separators=(",", ":")) + "\n" for record in records))
+                file.flush()
+                os.fsync(file.fileno())
+            os.replace(tempPath, self.journalPath)
+
+    def replay(self, annotations: dict) -> int:
+        """ Applies the journal (including an interrupted compaction) to a snapshot of annotations """
+        count = 0
+        for path in (self.compactingPath, self.journalPath):
+            for record in self.__readRecords(path):
+                applyRecord(annotations, record)
+                count = count + 1
+        return count
+
+    def imageKeys(self) -> set:
+        """ Returns every image that has records in the journal """
+        return {record["image"] for path in (self.compactingPath, self.journalPath) for record in self.__readRecords(path)}
+
+    def shouldCompact(self) -> bool:
+        """ Returns true once the journal has grown large enough to be folded into the snapshot """
+        try:
+            return os.path.getsize(self.journalPath) >= self.COMPACTION_THRESHOLD
+        except OSError:
+            return False
+
+    def isCompacting(self) -> bool:
+        """ Returns true while a background compaction is running """
+        return self.compactionThread is not None and self.compactionThread.is_alive()
+
+    def compact(self, readSnapshot, writeSnapshot) -> None:
+        """
+            Folds the journal into the snapshot on a background thread. readSnapshot returns an iterable of
+            (image, box records) stored on disk and writeSnapshot writes such an iterable back out, images are
+            passed through one at a time so the snapshot is never held in memory as a whole.
+        """
+        if self.isCompacting():
+            return
+
+        # Rotate the journal so new records keep being appended while the old ones are folded in
+        with self.fileLock:
+            if os.path.exists(self.journalPath):
+                if os.path.exists(self.compactingPath):
+                    # A previous compaction was interrupted, carry the newer records along with it
+                    with open(self.journalPath, "r") as journal, open(self.compactingPath, "a") as compacting:
+                        compacting.write(journal.read())
+                    os.remove(self.journalPath)
+                else:
+                    os.replace(self.journalPath, self.compactingPath)
+            elif not os.path.exists(self.compactingPath):
+                return
+
+        self.compactionThread = threading.Thread(target=self.__compact, args=(readSnapshot, writeSnapshot))
+        self.compactionThread.start()
+
+    def waitForCompaction(self) -> None:
+        """ Blocks until any running compaction has finished """
+        if self.compactionThread is not None:
+            self.compactionThread.join()
+
+    def reset(self) -> None:
+        """ Discards the journal, used once a full snapshot has been written from memory """
+        self.waitForCompaction()
+        with self.pendingLock:
+            self.pending = {}
+        with self.fileLock:
+            for path in (self.compactingPath, self.journalPath):
+                if os.path.exists(path):
+                    os.remove(path)
+
+    def __compact(self, readSnapshot, writeSnapshot) -> None:
+        """ Compaction worker """
+        try:
+            changes = {}  # image -> its journal records, the journal is small next to the snapshot
+            for record in self.__readRecords(self.compactingPath):
+                changes.setdefault(record["image"], []).append(record)
+            writeSnapshot(applyChanges(readSnapshot(), changes))
+            # Records are idempotent so a crash before this point just replays them onto the new snapshot
+            os.remove(self.compactingPath)
+        except Exception as exc:
+            print(exc)
+
+    def __readRecords(self, path: str):
+        """ Yields the records stored in a journal file """
+        if not os.path.exists(path):
+            return
+        validLength = 0
+        with open(path, "rb") as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                validLength = validLength + len(line)
+                if self.imageKey:
+                    record["image"] = self.imageKey(record["image"])
+                    if record["image"] is None:
+                        continue
+                yield record
+
+        # A crash can leave a torn record at the end, cut it off so later appends start on a clean line
+        if os.path.getsize(path) != validLength:
+            with self.fileLock:
+                os.truncate(path, validLength)
+
+
+def applyChanges(annotationItems, changes: dict):
+    """ Yields (image, box records) from an iterable of them with each image's journal records applied """
+    for image, records in annotationItems:
+        annotations = {image: records}
+        for record in changes.pop(image, []):
+            applyRecord(annotations, record)
+        if annotations.get(image):
+            yield image, annotations[image]
+    # images that were only annotated since the snapshot
+    for image, records in changes.items():
+        annotations = {}
+        for record in records:
+            applyRecord(annotations, record)
+        if annotations.get(image):
+            yield image, annotations[image]
+
+
+def applyRecord(annotations: dict, record: dict) -> None:
+    """ Applies a single journal record to an annotations dict of image -> list of box records """
+    boxes = annotations.get(record["image"], [])
+    if record["op"] == "put":
+        box = record["box"]
+        for index, existing in enumerate(boxes):
+            if int(existing[6]) == int(box[6]):
+                boxes[index] = box
+                break
+        else:
+            boxes.append(box)
+    elif record["op"] == "delete":
+        boxes = [existing for existing in boxes if int(existing[6]) != int(record["id"])]
+
+    if boxes:
+        annotations[record["image"]] = boxes
+    else:
+        annotations.pop(record["image"], None)
@@ -0,0 +1,263 @@
+"""
+    annotationMerge.py
+    Diffs and three-way merges of annotation sets keyed by image and annotation id, computed over numpy columns
+"""
+
+from enum import Enum
+from operator import itemgetter
+
+import numpy as np
+
+MATCH_IOU = 0.5  # overlap above which two boxes sharing an id are taken to be the same box
+
+
+class MergePolicies(Enum):
+    """ Enum to represent how a box that was changed differently on both sides of a merge is resolved """
+    ours = "ours"
+    theirs = "theirs"
+    union = "union"  # keep both versions of the box, a change wins over a removal
+
+
+class AnnotationColumns:
+    """
+        A set of annotations (image -> box records) flattened into columns, one row per box. Once keyed by
+        keyColumns the rows are sorted by their (image, box id) pair so rows can be matched between sets with
+        searchsorted.
+    """
+    def __init__(self, annotations: dict, imageIndexes: dict, classIndexes: dict) -> None:
+        """ init, imageIndexes and classIndexes are shared between the sets being compared and grow as needed """
+        imageCounts = []
+        records = []
+        for image, imageRecords in annotations.items():
+            imageIndexes.setdefault(image, len(imageIndexes))
+            imageCounts.append(len(imageRecords))
+            records.extend(imageRecords)
+        imageRows = np.fromiter(map(imageIndexes.__getitem__, annotations), dtype=np.int64, count=len(annotations))
+
+        count = len(records)
+        classNames = list(map(itemgetter(5), records))
+        for className in set(classNames):
+            classIndexes.setdefault(className, len(classIndexes))
+        self.imageRows = np.repeat(imageRows, imageCounts)
+        self.ids = np.fromiter(map(itemgetter(6), records), dtype=np.int64, count=count)
+        self.keys = None
+        self.rows = None  # sorted row -> index into records
+        self.records = records
+        self.boxes = np.stack([np.fromiter(map(itemgetter(column), records), dtype=np.float64, count=count)
+                               for column in range(4)], axis=1)
+        self.classes = np.fromiter(map(classIndexes.__getitem__, classNames), dtype=np.int64, count=count)
+
+    def sortByKeys(self, keys: np.ndarray) -> None:
+        """ Orders the rows by their key, keys are given in the order the records were added """
+        order = np.argsort(keys, kind="stable")
+        self.keys = keys[order]
+        self.ids = self.ids[order]
+        self.imageRows = self.imageRows[order]
+        self.rows = order
+        self.boxes = self.boxes[order]
+        self.classes = self.classes[order]
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def record(self, row: int) -> list:
+        """ Returns the box record at a sorted row """
+        return self.records[self.rows[row]]
+
+    def lookup(self, keys: np.ndarray) -> tuple:
+        """ Returns the row of each key and whether the key is present at all """
+        rows = np.minimum(np.searchsorted(self.keys, keys), max(len(self) - 1, 0))
+        present = self.keys[rows] == keys if len(self) > 0 else np.zeros(len(keys), dtype=bool)
+        return rows, present
+
+
+class AnnotationDiff:
+    """
+        The boxes added, removed and moved between two annotation sets. A box is moved when its geometry or class
+        changed but it still overlaps its old self, a box whose id was reused for an unrelated box is reported
+        as one removal and one addition.
+    """
+    def __init__(self) -> None:
+        """ init """
+        self.added = []  # (image, record)
+        self.removed = []  # (image, record)
+        self.moved = []  # (image, old record, new record)
+
+    def hasChanges(self) -> bool:
+        """ Returns true if the sets differ """
+        return len(self.added) > 0 or len(self.removed) > 0 or len(self.moved) > 0
+
+
+class MergeResult:
+    """ The outcome of a three-way merge """
+    def __init__(self) -> None:
+        """ init """
+        self.annotations = {}  # merged image -> box records
+        self.conflicts = 0  # boxes changed differently on both sides, resolved by the policy
+        self.collisions = 0  # unrelated boxes added on both sides with the same id, both kept
+        self.renumbered = 0  # boxes from theirs given a new id so they could be kept alongside ours
+
+
+def boxIoU(a: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """ Returns the intersection over union of each pair of (x, y, width, height) rows """
+    left = np.maximum(a[:, 0], b[:, 0])
+    top = np.maximum(a[:, 1], b[:, 1])
+    right = np.minimum(a[:, 0] + a[:, 2], b[:, 0] + b[:, 2])
+    bottom = np.minimum(a[:, 1] + a[:, 3], b[:, 1] + b[:, 3])
+    intersection = np.clip(right - left, 0, None) * np.clip(bottom - top, 0, None)
+    union = a[:, 2] * a[:, 3] + b[:, 2] * b[:, 3] - intersection
+    return np.divide(intersection, union, out=np.zeros(len(a)), where=union > 0)
+
+
+def keyColumns(*columnSets) -> np.ndarray:
+    """
+        Numbers every (image, box id) pair found in several sets, in sorted order, and keys each set's rows by
+        their pair's number. Returns the pairs, so a key's image is pairs[key, 0].
+    """
+    imageRows = np.concatenate([columns.imageRows for columns in columnSets])
+    ids = np.concatenate([columns.ids for columns in columnSets])
+    order = np.lexsort((ids, imageRows))
+    sortedImages, sortedIDs = imageRows[order], ids[order]
+    first = np.ones(len(order), dtype=bool)
+    first[1:] = (sortedImages[1:] != sortedImages[:-1]) | (sortedIDs[1:] != sortedIDs[:-1])
+    inverse = np.empty(len(order), dtype=np.int64)
+    inverse[order] = np.cumsum(first) - 1
+    uniquePairs = np.stack((sortedImages[first], sortedIDs[first]), axis=1)
+
+    offset = 0
+    for columns in columnSets:
+        columns.sortByKeys(inverse[offset:offset + len(columns.records)])
+        offset = offset + len(columns.records)
+    return uniquePairs
+
+
+def diffAnnotations(base: dict, other: dict, matchIoU: float = MATCH_IOU) -> AnnotationDiff:
+    """ Compares two annotation sets of image -> box records """
+    imageIndexes, classIndexes = {}, {}
+    baseColumns = AnnotationColumns(base, imageIndexes, classIndexes)
+    otherColumns = AnnotationColumns(other, imageIndexes, classIndexes)
+    pairs = keyColumns(baseColumns, otherColumns)
+    images = list(imageIndexes)
+
+    keys = unionKeys(baseColumns.keys, otherColumns.keys)
+    baseRows, inBase = baseColumns.lookup(keys)
+    otherRows, inOther = otherColumns.lookup(keys)
+
+    both = inBase & inOther
+    changed = both & ~sameBoxes(baseColumns, baseRows, otherColumns, otherRows)
+    overlap = boxIoU(baseColumns.boxes[baseRows[changed]], otherColumns.boxes[otherRows[changed]]) if changed.any() else np.zeros(0)
+    moved = np.zeros(len(keys), dtype=bool)
+    moved[changed] = overlap >= matchIoU
+    reused = changed & ~moved
+
+    diff = AnnotationDiff()
+    for index in np.flatnonzero((inOther & ~inBase) | reused):
+        diff.added.append((images[pairs[keys[index], 0]], otherColumns.record(otherRows[index])))
+    for index in np.flatnonzero((inBase & ~inOther) | reused):
+        diff.removed.append((images[pairs[keys[index], 0]], baseColumns.record(baseRows[index])))
+    for index in np.flatnonzero(moved):
+        diff.moved.append((images[pairs[keys[index], 0]], baseColumns.record(baseRows[index]), otherColumns.record(otherRows[index])))
+    return diff
+
+
+def mergeAnnotations(base: dict, ours: dict, theirs: dict, policy: MergePolicies = MergePolicies.ours,
+                     matchIoU: float = MATCH_IOU) -> MergeResult:
+    """
+        Three-way merges annotation sets of image -> box records that both descend from base. A box changed on
+        one side only takes that change, boxes changed differently on both sides are resolved by policy.
+    """
+    imageIndexes, classIndexes = {}, {}
+    baseColumns = AnnotationColumns(base, imageIndexes, classIndexes)
+    ourColumns = AnnotationColumns(ours, imageIndexes, classIndexes)
+    theirColumns = AnnotationColumns(theirs, imageIndexes, classIndexes)
+    pairs = keyColumns(baseColumns, ourColumns, theirColumns)
+    images = list(imageIndexes)
+
+    keys = unionKeys(baseColumns.keys, ourColumns.keys, theirColumns.keys)
+    baseRows, inBase = baseColumns.lookup(keys)
+    ourRows, inOurs = ourColumns.lookup(keys)
+    theirRows, inTheirs = theirColumns.lookup(keys)
+
+    oursMatchTheirs = sameState(ourColumns, ourRows, inOurs, theirColumns, theirRows, inTheirs)
+    oursMatchBase = sameState(ourColumns, ourRows, inOurs, baseColumns, baseRows, inBase)
+    theirsMatchBase = sameState(theirColumns, theirRows, inTheirs, baseColumns, baseRows, inBase)
+
+    # 0 drops the box, 1 takes ours, 2 takes theirs, 3 keeps both with theirs renumbered
+    source = np.zeros(len(keys), dtype=np.int8)
+    takeOurs = oursMatchTheirs | theirsMatchBase
+    takeTheirs = ~takeOurs & oursMatchBase
+    conflict = ~takeOurs & ~takeTheirs
+    source[takeOurs & inOurs] = 1
+    source[takeTheirs & inTheirs] = 2
+
+    overlapping = np.zeros(len(keys), dtype=bool)
+    bothPresent = inOurs & inTheirs
+    if bothPresent.any():
+        overlapping[bothPresent] = boxIoU(ourColumns.boxes[ourRows[bothPresent]], theirColumns.boxes[theirRows[bothPresent]]) >= matchIoU
+
+    # both sides drew a box and happened to give it the same id, unless they overlap they are different boxes
+    collision = conflict & ~inBase & bothPresent & ~overlapping
+    source[collision] = 3
+    conflict = conflict & ~collision
+    if policy is MergePolicies.ours:
+        source[conflict] = np.where(inOurs[conflict], 1, 0)
+    elif policy is MergePolicies.theirs:
+        source[conflict] = np.where(inTheirs[conflict], 2, 0)
+    else:
+        source[conflict & inOurs] = 1
+        source[conflict & ~inOurs & inTheirs] = 2
+        source[conflict & bothPresent & ~overlapping] = 3
+
+    result = MergeResult()
+    result.conflicts = int(conflict.sum())
+    result.collisions = int(collision.sum())
+
+    # renumbered boxes count up from the highest id on any side
+    renumbered = np.flatnonzero(source == 3)
+    highestID = max([int(columns.ids.max()) for columns in (baseColumns, ourColumns, theirColumns) if len(columns) > 0] or [0])
+    newIDs = dict(zip(renumbered.tolist(), range(highestID + 1, highestID + 1 + len(renumbered))))
+    result.renumbered = len(renumbered)
+
+    # every kept record is picked from one pool of both sides' records, then sliced up per image
+    annotations = result.annotations
+    selected = np.flatnonzero(source)
+    recordPool = ourColumns.records + theirColumns.records
+    poolIndexes = np.where(source[selected] == 2,
+                           len(ourColumns.records) + theirColumns.rows[theirRows[selected]] if len(theirColumns) > 0 else 0,
+                           ourColumns.rows[ourRows[selected]] if len(ourColumns) > 0 else 0)
+    mergedRecords = list(map(recordPool.__getitem__, poolIndexes.tolist()))
+    imageNumbers = pairs[keys[selected], 0]
+    boundaries = np.flatnonzero(np.diff(imageNumbers)) + 1
+    starts = [0] + boundaries.tolist()
+    stops = boundaries.tolist() + [len(selected)]
+    for start, stop in zip(starts, stops):
+        if stop > start:
+            annotations[images[imageNumbers[start]]] = mergedRecords[start:stop]
+
+    for index in renumbered.tolist():
+        record = list(theirColumns.record(theirRows[index]))
+        record[6] = newIDs[index]
+        annotations[images[pairs[keys[index], 0]]].append(record)
+    return result
+
+
+def sameBoxes(columnsA: AnnotationColumns, rowsA: np.ndarray, columnsB: AnnotationColumns, rowsB: np.ndarray) -> np.ndarray:
+    """ Returns true for each pair of rows holding the same geometry and class """
+    if len(columnsA) == 0 or len(columnsB) == 0:
+        return np.zeros(len(rowsA), dtype=bool)
+    return (columnsA.boxes[rowsA] == columnsB.boxes[rowsB]).all(axis=1) & (columnsA.classes[rowsA] == columnsB.classes[rowsB])
+
+
+def sameState(columnsA: AnnotationColumns, rowsA: np.ndarray, presentA: np.ndarray,
+                columnsB: AnnotationColumns, rowsB: np.ndarray, presentB: np.ndarray) -> np.ndarray:
+    """ Returns true for each key that is absent from both sets or present in both with the same box """
+    return (~presentA & ~presentB) | (presentA & presentB & sameBoxes(columnsA, rowsA, columnsB, rowsB))
+
+
+def unionKeys(*keyArrays) -> np.ndarray:
+    """ Returns the sorted unique keys of several sorted key arrays """
+    keys = np.concatenate(keyArrays)
+    keys.sort()
+    if len(keys) == 0:
+        return keys
+    return keys[np.concatenate(([True], keys[1:] != keys[:-1]))]
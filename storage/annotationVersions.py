@@ -0,0 +1,168 @@
+"""
+    annotationVersions.py
+    Named versions of a project's annotations, stored as content addressed objects that versions share
+"""
+
+import os
+import json
+import zlib
+import hashlib
+import threading
+from datetime import datetime
+
+import yaml
+
+
+class AnnotationVersions:
+    """
+        Keeps versions of the annotations in the manner of git objects. Each image's box records are a block
+        object, a page object lists the blocks of PAGE_SIZE consecutive images and a version's tree lists its
+        pages. Objects are named by the hash of their contents, so a block or page that did not change between
+        versions is stored once. A new version only writes the blocks and pages of images edited since the last.
+    """
+    PAGE_SIZE = 1024
+
+    def __init__(self, versionsDir: str) -> None:
+        """ init """
+        self.versionsDir = versionsDir
+        self.objectsDir = versionsDir + "/objects"
+        self.indexPath = versionsDir + "/versions.yaml"
+        self.changedPath = versionsDir + "/changed"  # ids of images edited since the head, one per line
+        self.head = None  # tree the annotations were last versioned as or restored from
+        self.versions = []  # dicts of Name, Tree, ImageCount and Created, oldest first
+        self.lock = threading.Lock()  # edits are recorded from the autosave thread
+
+        try:
+            with open(self.indexPath, "r") as stream:
+                index = yaml.safe_load(stream)
+            self.head = index["Head"]
+            self.versions = index["Versions"]
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            print(exc)
+
+    def names(self) -> list:
+        """ Returns the name of every version, oldest first """
+        return [version["Name"] for version in self.versions]
+
+    def recordChanged(self, imageIDs) -> None:
+        """ Notes images whose annotations were written since the head, so the next version can skip the rest """
+        if self.head is None:
+            return  # the first version stores every image anyway
+        lines = "".join(f"{imageID}\n" for imageID in set(imageIDs))
+        if not lines:
+            return
+        with self.lock:
+            with open(self.changedPath, "a") as file:
+                file.write(lines)
+
+    def create(self, name: str, imageCount: int, editedImageIDs, readRecords) -> bool:
+        """
+            Stores the current annotations as a new version. editedImageIDs are images changed in memory that may
+            not have been written yet and readRecords(imageID) returns an image's current box records.
+            Returns false if the name is already taken.
+        """
+        if name in self.names():
+            print(f"An annotation version named {name} already exists")
+            return False
+
+        with self.lock:
+            if self.head is None:
+                changed = set(range(imageCount))
+                pages = {}
+            else:
+                changed = self.__readChanged() | set(editedImageIDs)
+                pages = self.__readObject(self.head)["Pages"]
+
+            changedByPage = {}
+            for imageID in changed:
+                if imageID < imageCount:
+                    changedByPage.setdefault(imageID // self.PAGE_SIZE, []).append(imageID)
+
+            for pageNumber, imageIDs in changedByPage.items():
+                pageKey = str(pageNumber)
+                blocks = self.__readObject(pages[pageKey])["Blocks"] if pageKey in pages else {}
+                for imageID in imageIDs:
+                    # numbers are normalised so the same boxes read from any storage format hash the same
+                    records = [[float(record[0]), float(record[1]), float(record[2]), float(record[3]),
+                                [int(channel) for channel in record[4]], record[5], int(record[6])]
+                               for record in readRecords(imageID)]
+                    if records:
+                        blocks[str(imageID)] = self.__writeObject({"Records": records})
+                    else:
+                        blocks.pop(str(imageID), None)
+                if blocks:
+                    pages[pageKey] = self.__writeObject({"Blocks": blocks})
+                else:
+                    pages.pop(pageKey, None)
+
+            tree = self.__writeObject({"Pages": pages})
+            self.versions.append({"Name": name, "Tree": tree, "ImageCount": imageCount, "Created": datetime.now()})
+            self.__setHead(tree)
+        return True
+
+    def read(self, name: str) -> dict:
+        """ Returns the annotations of a version as a dict of image id -> box records """
+        version = self.__version(name)
+        annotations = {}
+        for pageHash in self.__readObject(version["Tree"])["Pages"].values():
+            for imageID, blockHash in self.__readObject(pageHash)["Blocks"].items():
+                annotations[int(imageID)] = self.__readObject(blockHash)["Records"]
+        return annotations
+
+    def restore(self, name: str) -> dict:
+        """ Returns the annotations of a version and makes it the head that the next version is based on """
+        annotations = self.read(name)
+        version = self.__version(name)
+        with self.lock:
+            self.__setHead(version["Tree"])
+        return annotations
+
+    def __version(self, name: str) -> dict:
+        """ Returns the entry of a version """
+        for version in self.versions:
+            if version["Name"] == name:
+                return version
+        raise KeyError(f"No annotation version named {name}")
+
+    def __setHead(self, tree: str) -> None:
+        """ Writes out the index with a new head, images changed since the old head are forgotten """
+        self.head = tree
+        os.makedirs(self.versionsDir, exist_ok=True)
+        tempPath = self.indexPath + ".tmp"
+        with open(tempPath, "w") as file:
+            yaml.safe_dump({"Head": self.head, "Versions": self.versions}, file, sort_keys=False)
+        os.replace(tempPath, self.indexPath)
+        if os.path.exists(self.changedPath):
+            os.remove(self.changedPath)
+
+    def __readChanged(self) -> set:
+        """ Returns the ids of images recorded as changed since the head """
+        try:
+            with open(self.changedPath, "r") as file:
+                return {int(line) for line in file if line.strip()}
+        except FileNotFoundError:
+            return set()
+
+    def __objectPath(self, objectHash: str) -> str:
+        """ Returns the path of an object, fanned out over directories by its first two characters """
+        return self.objectsDir + "/" + objectHash[:2] + "/" + objectHash[2:]
+
+    def __writeObject(self, value: dict) -> str:
+        """ Stores a value as an object unless an identical one already exists, returns its hash """
+        data = json.dumps(value, separators=(",", ":"), sort_keys=True).encode()
+        objectHash = hashlib.blake2b(data, digest_size=20).hexdigest()
+        objectPath = self.__objectPath(objectHash)
+        if not os.path.exists(objectPath):
+            os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+            tempPath = objectPath + ".tmp"
+            with open(tempPath, "wb") as file:
+                file.write(zlib.compress(data))
+            os.replace(tempPath, objectPath)
+        return objectHash
+
+    def __readObject(self, objectHash: str) -> dict:
+        """ Reads an object back """
+        with open(self.__objectPath(objectHash), "rb") as file:
+            return json.loads(zlib.decompress(file.read()))
@@ -0,0 +1,260 @@
+"""
+    columnarStore.py
+    Struct-of-arrays storage of bounding boxes, memory mapped from .npy files
+"""
+
+import os
+import shutil
+import numpy as np
+from collections.abc import Sequence
+from PyQt6.QtGui import QColor
+
+from boundingBox import BoundingBox
+
+
+class ColumnarAnnotationStore:
+    """
+        Stores every bounding box of a project as columns, with an offset table mapping images to rows.
+        The boxes of image i are rows imageOffsets[i]:imageOffsets[i + 1], in the order of the image dataset.
+        Each write goes to a new snapshot directory that a pointer file is then swapped to, so the columns,
+        offsets and classes read are always from the same write.
+    """
+    COLUMNS = {"x": np.float32,
+               "y": np.float32,
+               "width": np.float32,
+               "height": np.float32,
+               "classIndex": np.int32,
+               "id": np.int64}
+    CURRENT = "current"  # pointer file naming the snapshot directory in use
+    SNAPSHOT_PREFIX = "snapshot-"
+
+    def __init__(self, storeDir: str) -> None:
+        """ init """
+        self.storeDir = storeDir
+        self.columns = {}
+        self.imageOffsets = np.zeros(1, dtype=np.int64)
+        self.classNames = []
+        self.classColours = []  # rgba tuple per class index
+        self.__colourCache = {}  # rgba -> QColor, shared by every box of that colour
+
+    @staticmethod
+    def snapshotDir(storeDir: str) -> str:
+        """ Returns the snapshot directory the pointer file names """
+        with open(os.path.join(storeDir, ColumnarAnnotationStore.CURRENT), "r") as file:
+            return os.path.join(storeDir, file.read().strip())
+
+    def load(self) -> None:
+        """ Memory maps the stored columns, nothing is read until a box is accessed """
+        snapshotDir = self.snapshotDir(self.storeDir)
+        for name in list(self.COLUMNS) + ["colour"]:
+            self.columns[name] = np.load(os.path.join(snapshotDir, name + ".npy"), mmap_mode="r")
+        self.imageOffsets = np.load(os.path.join(snapshotDir, "imageOffsets.npy"), mmap_mode="r")
+        with np.load(os.path.join(snapshotDir, "classes.npz")) as classes:
+            self.classNames = [str(className) for className in classes["names"]]
+            self.classColours = [tuple(int(channel) for channel in colour) for colour in classes["colours"]]
+        self.__colourCache = {}
+
+    @property
+    def imageCount(self) -> int:
+        """ Number of images covered by the offset table """
+        return len(self.imageOffsets) - 1
+
+    @property
+    def boxCount(self) -> int:
+        """ Total number of boxes in the store """
+        return int(self.imageOffsets[-1])
+
+    @property
+    def annotatedImageCount(self) -> int:
+        """ Number of images with at least one box """
+        return int(np.count_nonzero(np.diff(self.imageOffsets)))
+
+    def highestID(self) -> int:
+        """ Returns the highest annotation id in the store """
+        if self.boxCount == 0:
+            return 0
+        return int(self.columns["id"].max())
+
+    def boxRange(self, imageIndex: int) -> tuple:
+        """ Returns the rows occupied by an image's boxes """
+        if imageIndex >= self.imageCount:
+            return 0, 0
+        return int(self.imageOffsets[imageIndex]), int(self.imageOffsets[imageIndex + 1])
+
+    def boundingBoxes(self, imageIndex: int) -> "BoundingBoxArrayView":
+        """ Returns a view over an image's boxes """
+        start, stop = self.boxRange(imageIndex)
+        return BoundingBoxArrayView(self, start, stop)
+
+    def colour(self, row: int) -> QColor:
+        """ Returns the colour of a box, boxes of the same colour share one QColor """
+        rgba = tuple(int(channel) for channel in self.columns["colour"][row])
+        colour = self.__colourCache.get(rgba)
+        if colour is None:
+            colour = QColor(*rgba)
+            self.__colourCache[rgba] = colour
+        return colour
+
+    def record(self, row: int) -> list:
+        """ Returns a row as the list stored in the annotations file """
+        return [float(self.columns["x"][row]),
+                float(self.columns["y"][row]),
+                float(self.columns["width"][row]),
+                float(self.columns["height"][row]),
+                [int(channel) for channel in self.columns["colour"][row]],
+                self.classNames[int(self.columns["classIndex"][row])],
+                int(self.columns["id"][row])]
+
+    def records(self, imageIndex: int) -> list:
+        """ Returns an image's boxes as annotation file records """
+        start, stop = self.boxRange(imageIndex)
+        return [self.record(row) for row in range(start, stop)]
+
+    def readAnnotations(self) -> dict:
+        """ Returns a dict of image id -> records for every annotated image """
+        annotations = {}
+        for imageIndex in np.flatnonzero(np.diff(self.imageOffsets)):
+            annotations[int(imageIndex)] = self.records(int(imageIndex))
+        return annotations
+
+    @staticmethod
+    def write(storeDir: str, imageCount: int, annotations: dict, classes: list) -> None:
+        """
+            Writes a dict of image id -> records out as columns. classes is a list of (name, rgba) used to
+            seed the class table, any other class found in the records is appended to it.
+        """
+        classNames = [className for className, _ in classes]
+        classColours = [toRgba(colour) for _, colour in classes]
+        classIndexes = {className: index for index, className in enumerate(classNames)}
+
+        counts = np.zeros(imageCount, dtype=np.int64)
+        rows = []
+        colours = []
+        for imageIndex in range(imageCount):
+            boxes = annotations.get(imageIndex)
+            if not boxes:
+                continue
+            counts[imageIndex] = len(boxes)
+            for box in boxes:
+                classIndex = classIndexes.get(box[5])
+                if classIndex is None:
+                    classIndex = len(classNames)
+                    classIndexes[box[5]] = classIndex
+                    classNames.append(box[5])
+                    classColours.append(toRgba(box[4]))
+                rows.append((box[0], box[1], box[2], box[3], classIndex, int(box[6])))
+                colours.append(toRgba(box[4]))
+
+        imageOffsets = np.zeros(imageCount + 1, dtype=np.int64)
+        np.cumsum(counts, out=imageOffsets[1:])
+
+        # the whole snapshot is written to a directory of its own, then the pointer is swapped to it
+        table = np.array(rows, dtype=np.float64).reshape(-1, len(ColumnarAnnotationStore.COLUMNS))
+        os.makedirs(storeDir, exist_ok=True)
+        snapshotName = ColumnarAnnotationStore.__nextSnapshotName(storeDir)
+        snapshotDir = os.path.join(storeDir, snapshotName)
+        if os.path.exists(snapshotDir):
+            shutil.rmtree(snapshotDir)  # left by a write that never finished
+        os.makedirs(snapshotDir)
+        for columnIndex, (name, dtype) in enumerate(ColumnarAnnotationStore.COLUMNS.items()):
+            ColumnarAnnotationStore.__save(snapshotDir, name + ".npy", table[:, columnIndex].astype(dtype))
+        ColumnarAnnotationStore.__save(snapshotDir, "colour.npy", np.array(colours, dtype=np.uint8).reshape(-1, 4))
+        ColumnarAnnotationStore.__save(snapshotDir, "imageOffsets.npy", imageOffsets)
+
+        # Class table is tiny so it is kept compressed together
+        with open(os.path.join(snapshotDir, "classes.npz"), "wb") as file:
+            np.savez(file,
+                     names=np.array(classNames, dtype=np.str_),
+                     colours=np.array(classColours, dtype=np.uint8).reshape(-1, 4))
+            file.flush()
+            os.fsync(file.fileno())
+
+        tempPath = os.path.join(storeDir, ColumnarAnnotationStore.CURRENT + ".tmp")
+        with open(tempPath, "w") as file:
+            file.write(snapshotName)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tempPath, os.path.join(storeDir, ColumnarAnnotationStore.CURRENT))
+
+        # memory maps of older snapshots keep their files until they are closed
+        for fileName in os.listdir(storeDir):
+            if fileName.startswith(ColumnarAnnotationStore.SNAPSHOT_PREFIX) and fileName != snapshotName:
+                shutil.rmtree(os.path.join(storeDir, fileName), ignore_errors=True)
+
+    @staticmethod
+    def __nextSnapshotName(storeDir: str) -> str:
+        """ Returns the name of the snapshot directory after the current one """
+        try:
+            current = os.path.basename(ColumnarAnnotationStore.snapshotDir(storeDir))
+            number = int(current[len(ColumnarAnnotationStore.SNAPSHOT_PREFIX):]) + 1
+        except (OSError, ValueError):
+            number = 0
+        return ColumnarAnnotationStore.SNAPSHOT_PREFIX + str(number)
+
+    @staticmethod
+    def __save(snapshotDir: str, fileName: str, array: np.ndarray) -> None:
+        """ Saves an array into a snapshot, synced so the pointer is never swapped to a file not yet on disk """
+        with open(os.path.join(snapshotDir, fileName), "wb") as file:
+            np.save(file, array)
+            file.flush()
+            os.fsync(file.fileno())
+
+
+def toRgba(colour) -> tuple:
+    """ Pads an rgb colour out to rgba """
+    return (tuple(colour) + (255,))[:4]
+
+
+class BoundingBoxView(BoundingBox):
+    """ A bounding box that reads its values from a row of the columnar store instead of holding them """
+    def __init__(self, store: ColumnarAnnotationStore, row: int) -> None:
+        self.store = store
+        self.row = row
+
+    @property
+    def x(self) -> float:
+        return float(self.store.columns["x"][self.row])
+
+    @property
+    def y(self) -> float:
+        return float(self.store.columns["y"][self.row])
+
+    @property
+    def width(self) -> float:
+        return float(self.store.columns["width"][self.row])
+
+    @property
+    def height(self) -> float:
+        return float(self.store.columns["height"][self.row])
+
+    @property
+    def id(self) -> int:
+        return int(self.store.columns["id"][self.row])
+
+    @property
+    def className(self) -> str:
+        return self.store.classNames[int(self.store.columns["classIndex"][self.row])]
+
+    @property
+    def colour(self) -> QColor:
+        return self.store.colour(self.row)
+
+
+class BoundingBoxArrayView(Sequence):
+    """ A read only list of an image's bounding boxes, boxes are only created when accessed """
+    def __init__(self, store: ColumnarAnnotationStore, start: int, stop: int) -> None:
+        self.store = store
+        self.start = start
+        self.stop = stop
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return BoundingBoxView(self.store, self.start + index)
@@ -0,0 +1,145 @@
+"""
+    imageManifest.py
+    The list of images in a project, stored relative to the dataset directory and grouped by subdirectory
+"""
+
+import os
+import sys
+from array import array
+from collections.abc import Sequence
+
+
+class ImageManifest(Sequence):
+    """
+        Holds each image as an interned subdirectory index and a file name relative to the dataset directory.
+        Absolute paths are only built as they are accessed. An image's id is its position in the manifest and
+        images are only ever appended, so ids are stable and used to key annotations.
+    """
+    VERSION = 1
+
+    def __init__(self, datasetDir: str) -> None:
+        """ init """
+        self.datasetDir = datasetDir
+        self.directories = []  # interned subdirectories relative to the dataset directory, "" for the root
+                               # images outside of the dataset directory keep their absolute directory
+        self.directoryIndexes = {}  # subdirectory -> index into directories
+        self.imageDirectories = array("I")  # directory index per image
+        self.fileNames = []  # file name per image
+        self.__imageIDs = None  # absolute path -> image id, built on the first lookup
+
+    def __len__(self) -> int:
+        return len(self.fileNames)
+
+    def __getitem__(self, index):
+        """ Returns the absolute path of an image, or a list of paths for a slice """
+        if isinstance(index, slice):
+            return [self.__absolutePath(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index = index + len(self)
+        if not 0 <= index < len(self):
+            raise IndexError(index)
+        return self.__absolutePath(index)
+
+    def relativePath(self, imageID: int) -> str:
+        """ Returns the path of an image relative to the dataset directory """
+        directory = self.directories[self.imageDirectories[imageID]]
+        if directory:
+            return directory + "/" + self.fileNames[imageID]
+        return self.fileNames[imageID]
+
+    def append(self, imagePath: str) -> int:
+        """ Adds an image given as an absolute path or relative to the dataset directory, returns its id """
+        relativePath = imagePath
+        rootPrefix = self.datasetDir + "/"
+        if imagePath.startswith(rootPrefix):
+            relativePath = imagePath[len(rootPrefix):]
+        directory, _, fileName = relativePath.rpartition("/")
+        return self.__add(directory, fileName)
+
+    def extend(self, imagePaths) -> None:
+        """ Adds several images """
+        for imagePath in imagePaths:
+            self.append(imagePath)
+
+    def imageID(self, imagePath: str):
+        """ Returns the id of an image from its absolute path, None if it is not in the manifest """
+        if self.__imageIDs is None:
+            self.__imageIDs = {os.path.normpath(self.__absolutePath(imageID)): imageID for imageID in range(len(self))}
+        return self.__imageIDs.get(os.path.normpath(imagePath))
+
+    def fileNamesIn(self, directory: str) -> set:
+        """ Returns the file names of the images in a subdirectory relative to the dataset directory """
+        directoryIndex = self.directoryIndexes.get(directory)
+        if directoryIndex is None:
+            return set()
+        return {fileName for index, fileName in zip(self.imageDirectories, self.fileNames) if index == directoryIndex}
+
+    def toYaml(self) -> dict:
+        """ Returns the manifest as stored in the dataset file, consecutive images sharing a directory are grouped """
+        groups = []
+        previousDirectory = None
+        for directoryIndex, fileName in zip(self.imageDirectories, self.fileNames):
+            if directoryIndex != previousDirectory:
+                groups.append({"Directory": self.directories[directoryIndex], "Files": []})
+                previousDirectory = directoryIndex
+            groups[-1]["Files"].append(fileName)
+        return {"ManifestVersion": self.VERSION, "Images": groups}
+
+    @staticmethod
+    def fromYaml(datasetDir: str, datasetYaml) -> "ImageManifest":
+        """ Builds a manifest from a dataset file, which may also be the older list of absolute paths """
+        manifest = ImageManifest(datasetDir)
+        if isinstance(datasetYaml, list):
+            manifest.extend(datasetYaml)
+            return manifest
+
+        for group in datasetYaml["Images"]:
+            directory = group["Directory"]
+            for fileName in group["Files"]:
+                manifest.__add(directory, fileName)
+        return manifest
+
+    def toColumns(self) -> dict:
+        """ Returns the manifest as plain lists, as kept in the session cache """
+        return {"Directories": list(self.directories),
+                "ImageDirectories": self.imageDirectories.tolist(),
+                "FileNames": list(self.fileNames)}
+
+    @staticmethod
+    def fromColumns(datasetDir: str, columns: dict) -> "ImageManifest":
+        """ Builds a manifest from the lists returned by toColumns """
+        manifest = ImageManifest(datasetDir)
+        manifest.directories = [sys.intern(directory) for directory in columns["Directories"]]
+        manifest.directoryIndexes = {directory: index for index, directory in enumerate(manifest.directories)}
+        manifest.imageDirectories = array("I", columns["ImageDirectories"])
+        manifest.fileNames = list(columns["FileNames"])
+        if len(manifest.imageDirectories) != len(manifest.fileNames):
+            raise ValueError("Image manifest columns differ in length")
+        return manifest
+
+    @staticmethod
+    def isManifest(datasetYaml) -> bool:
+        """ Returns true if a dataset file is in the manifest format rather than a list of absolute paths """
+        return isinstance(datasetYaml, dict) and "ManifestVersion" in datasetYaml
+
+    def __absolutePath(self, imageID: int) -> str:
+        """ Builds the absolute path of an image """
+        relativePath = self.relativePath(imageID)
+        if relativePath.startswith("/"):
+            return relativePath
+        return self.datasetDir + "/" + relativePath
+
+    def __add(self, directory: str, fileName: str) -> int:
+        """ Adds an image from its subdirectory and file name, returns its id """
+        directoryIndex = self.directoryIndexes.get(directory)
+        if directoryIndex is None:
+            directoryIndex = len(self.directories)
+            self.directories.append(sys.intern(directory))
+            self.directoryIndexes[directory] = directoryIndex
+
+        imageID = len(self.fileNames)
+        self.imageDirectories.append(directoryIndex)
+        self.fileNames.append(fileName)
+        if self.__imageIDs is not None:
+            self.__imageIDs[os.path.normpath(self.__absolutePath(imageID))] = imageID
+        return imageID
@@ -0,0 +1,165 @@
+"""
+    imageStore.py
+    A content addressed store of images shared by every project, along with what is worked out from each image
+"""
+
+import os
+import json
+import stat
+import shutil
+import sqlite3
+import threading
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None  # windows, where images are always copied
+
+from dataset.imageSource import readImage, splitArchivePath
+from dataset.remoteSource import isRemote
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+    path TEXT PRIMARY KEY,
+    mtime INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest BLOB NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS derived (
+    digest BLOB NOT NULL,
+    kind TEXT NOT NULL,
+    value BLOB NOT NULL,
+    PRIMARY KEY (digest, kind)
+);
+"""
+
+FICLONE = 0x40049409  # linux ioctl that shares a file's blocks with a copy until either is written to
+
+
+class ImageStore:
+    """
+        Images kept once under objects/ by the digest of their contents. Each object is a read-only copy of the
+        dataset file, cloned where the filesystem supports it, so rewriting the dataset file never changes what
+        is stored under the old digest. Remote images are keyed by the digest of their etag, as they are not
+        downloaded to be hashed, so they are held apart from local copies of the same image. Anything worked
+        out from an image, such as its metadata, is kept by digest too so every project containing the image
+        shares it. The digest of each dataset file is remembered against its path and stat, so a file one
+        project has hashed is not hashed by another.
+    """
+    sharedStore = None
+    sharedLock = threading.Lock()
+
+    def __init__(self, storeDir: str) -> None:
+        """ init """
+        self.storeDir = storeDir
+        self.objectsDir = storeDir + "/objects"
+        os.makedirs(self.objectsDir, exist_ok=True)
+        # the connection is shared with background loaders, access is serialised through the lock
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(storeDir + "/index.db", check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    @staticmethod
+    def shared() -> "ImageStore":
+        """ Returns the store shared by every project, created on first use """
+        with ImageStore.sharedLock:
+            if ImageStore.sharedStore is None:
+                ImageStore.sharedStore = ImageStore(os.getcwd() + "/projects/.imageStore")
+            return ImageStore.sharedStore
+
+    def objectPath(self, digest: bytes) -> str:
+        """ Returns where an image is kept, fanned out over directories by the first byte of its digest """
+        hexDigest = digest.hex()
+        return self.objectsDir + "/" + hexDigest[:2] + "/" + hexDigest[2:]
+
+    def contains(self, digest: bytes) -> bool:
+        """ Returns true if the store holds an image """
+        return os.path.exists(self.objectPath(digest))
+
+    def add(self, imagePath: str, digest: bytes) -> bool:
+        """ Adds an image under its digest unless it is already held, returns false if it could not be read """
+        objectPath = self.objectPath(digest)
+        if os.path.exists(objectPath):
+            return True
+        os.makedirs(os.path.dirname(objectPath), exist_ok=True)
+        tempPath = f"{objectPath}.{threading.get_ident()}.tmp"
+        try:
+            if isRemote(imagePath) or splitArchivePath(imagePath) is not None:
+                data = readImage(imagePath)
+                if data is None:
+                    return False
+                with open(tempPath, "wb") as file:
+                    file.write(data)
+            else:
+                copyFile(imagePath, tempPath)
+            # objects are shared by every project, nothing should edit one in place
+            os.chmod(tempPath, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+            os.replace(tempPath, objectPath)
+        except OSError as exc:
+            print(exc)
+            try:
+                os.remove(tempPath)
+            except OSError:
+                pass
+            return False
+        return True
+
+    def knownDigests(self, imagePaths: list, imageStats: list) -> list:
+        """ Returns the remembered digest of each image, None where it is unknown or the file changed since """
+        digests = []
+        with self.lock:
+            for imagePath, stat in zip(imagePaths, imageStats):
+                row = self.connection.execute("SELECT mtime, size, inode, digest FROM files WHERE path = ?", (imagePath,)).fetchone()
+                digests.append(bytes(row[3]) if row is not None and stat is not None and tuple(row[:3]) == tuple(stat) else None)
+        return digests
+
+    def rememberDigests(self, imagePaths: list, imageStats: list, digests: list) -> None:
+        """ Remembers the digests of images against their paths and stats """
+        rows = [(imagePath, stat[0], stat[1], stat[2], digest)
+                for imagePath, stat, digest in zip(imagePaths, imageStats, digests) if stat is not None and digest is not None]
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO files (path, mtime, size, inode, digest) VALUES (?, ?, ?, ?, ?)", rows)
+
+    def derived(self, digest: bytes, kind: str):
+        """ Returns a value worked out from an image, e.g. its metadata, a thumbnail or a model's predictions """
+        with self.lock:
+            row = self.connection.execute("SELECT value FROM derived WHERE digest = ? AND kind = ?", (digest, kind)).fetchone()
+        return None if row is None else row[0]
+
+    def putDerived(self, digest: bytes, kind: str, value) -> None:
+        """ Stores a value worked out from an image """
+        with self.lock, self.connection:
+            self.connection.execute("INSERT OR REPLACE INTO derived (digest, kind, value) VALUES (?, ?, ?)", (digest, kind, value))
+
+    def metadata(self, digest: bytes):
+        """ Returns the (height, width, channels) of an image, None if it has not been worked out """
+        value = self.derived(digest, "metadata")
+        return None if value is None else tuple(json.loads(value))
+
+    def putMetadata(self, digest: bytes, height: int, width: int, channels: int) -> None:
+        """ Stores the (height, width, channels) of an image """
+        self.putDerived(digest, "metadata", json.dumps([height, width, channels]))
+
+    def thumbnail(self, digest: bytes):
+        """ Returns the encoded thumbnail of an image, None if none has been stored """
+        return self.derived(digest, "thumbnail")
+
+    def putThumbnail(self, digest: bytes, data: bytes) -> None:
+        """ Stores an encoded thumbnail of an image """
+        self.putDerived(digest, "thumbnail", data)
+
+
+def copyFile(sourcePath: str, targetPath: str) -> None:
+    """ Copies a file, as a clone sharing the source's blocks where the filesystem supports it """
+    with open(sourcePath, "rb") as source, open(targetPath, "wb") as target:
+        if fcntl is not None:
+            try:
+                fcntl.ioctl(target.fileno(), FICLONE, source.fileno())
+                return
+            except OSError:
+                pass  # not a filesystem with clones, or on another one
+        shutil.copyfileobj(source, target)
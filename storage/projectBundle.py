@@ -0,0 +1,93 @@
+"""
+    projectBundle.py
+    A whole project in a single file, so it can be moved between machines without fixing up its paths
+"""
+
+import os
+import zipfile
+
+import yaml
+
+from dataset.imageSource import ArchiveSource
+
+BUNDLE_VERSION = 1
+BUNDLE_INFO = "bundle.yaml"  # name of the member describing the bundle
+IMAGES_PREFIX = "images/"  # images kept in the bundle sit under this prefix, by their path in the dataset
+
+
+class BundleWriter:
+    """
+        Writes a bundle, a zip whose central directory indexes every member so any of them can be read in place.
+        Images are stored as they are, being compressed already, everything else is deflated. The bundle is
+        written alongside and swapped in once complete.
+    """
+    def __init__(self, bundlePath: str) -> None:
+        """ init """
+        self.bundlePath = os.path.abspath(bundlePath)
+        self.tempPath = self.bundlePath + ".tmp"
+        self.zipFile = zipfile.ZipFile(self.tempPath, "w", allowZip64=True)
+
+    def writeBytes(self, name: str, data: bytes, compress: bool = True) -> None:
+        """ Adds a member from its contents """
+        self.zipFile.writestr(name, data, compress_type=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+
+    def writeFile(self, name: str, filePath: str, compress: bool = True) -> None:
+        """ Adds a member from a file on disk """
+        self.zipFile.write(filePath, name, compress_type=zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED)
+
+    def close(self) -> None:
+        """ Finishes the bundle """
+        self.zipFile.close()
+        os.replace(self.tempPath, self.bundlePath)
+
+    def abort(self) -> None:
+        """ Abandons a bundle part way through """
+        self.zipFile.close()
+        if os.path.exists(self.tempPath):
+            os.remove(self.tempPath)
+
+
+class BundleReader:
+    """ Reads the members of a bundle straight from a memory map of it, nothing is unpacked """
+    def __init__(self, bundlePath: str) -> None:
+        """ init """
+        self.bundlePath = os.path.abspath(bundlePath)
+        self.source = ArchiveSource.open(self.bundlePath)
+        self.info = self.readYaml(BUNDLE_INFO)
+        if self.info is None:
+            raise ValueError(f"{bundlePath} is not a project bundle")
+        if self.info["BundleVersion"] > BUNDLE_VERSION:
+            raise ValueError(f"{bundlePath} was written by a newer version, bundle version {self.info['BundleVersion']}")
+
+    def read(self, name: str):
+        """ Returns a member's contents, None if there is no such member """
+        return self.source.read(name)
+
+    def readYaml(self, name: str):
+        """ Parses a yaml member, None if there is no such member """
+        data = self.read(name)
+        return None if data is None else yaml.safe_load(data)
+
+    def names(self, prefix: str = "") -> list:
+        """ Returns the names of the members starting with prefix """
+        return [name for name in self.source.names if name.startswith(prefix)]
+
+    def imagesDir(self) -> str:
+        """ Returns the path that images kept in the bundle are read from, as a dataset directory """
+        return self.bundlePath + "/" + IMAGES_PREFIX.rstrip("/")
+
+
+def memberPath(targetDir: str, memberName: str) -> str:
+    """
+        Returns where a member is unpacked to under targetDir. Names that are absolute, climb with "..", or
+        otherwise resolve outside targetDir raise ValueError, so a crafted bundle cannot write anywhere else.
+    """
+    parts = memberName.replace("\\", "/").split("/")
+    name = os.path.normpath("/".join(parts))
+    if not memberName or os.path.isabs(name) or ".." in parts:
+        raise ValueError(f"Bundle member {memberName!r} would be unpacked outside {targetDir}")
+    targetDir = os.path.realpath(targetDir)
+    path = os.path.realpath(os.path.join(targetDir, name))
+    if os.path.commonpath([targetDir, path]) != targetDir or path == targetDir:
+        raise ValueError(f"Bundle member {memberName!r} would be unpacked outside {targetDir}")
+    return path
@@ -0,0 +1,179 @@
+"""
+    sessionCache.py
+    A cache of a parsed project kept next to project.yaml, so reopening an unchanged project skips yaml parsing
+"""
+
+import os
+import json
+import mmap
+import time
+import numpy as np
+
+
+class SessionCache:
+    """
+        Caches each parsed section of a project (images, classes, models, annotations) together with the
+        mtime and size of the files it was parsed from. A section is only used while those files are unchanged.
+        Everything is stored as json or plain numpy arrays, so reading the cache never runs code from it.
+    """
+    VERSION = 3
+    STALE_BLOB_AGE = 24 * 60 * 60  # seconds before an unreferenced blob is assumed abandoned rather than in use
+
+    def __init__(self, projectDir: str, readOnly: bool = False) -> None:
+        """ init, a readOnly cache is only read from, sections put into it are kept in memory """
+        self.readOnly = readOnly
+        self.cacheDir = projectDir + "/.session"
+        self.metaPath = self.cacheDir + "/session.json"
+        self.sections = {}  # section name -> {"Key": source key, "Value": value}
+        self.modified = False
+        self.loadedBlob = None  # annotation blob referenced when the cache was read, replaced by a new write
+
+        try:
+            with open(self.metaPath, "r") as file:
+                meta = json.load(file)
+            if meta["Version"] == self.VERSION:
+                self.sections = meta["Sections"]
+                self.loadedBlob = self.__blobFile()
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            print(exc)
+
+    @staticmethod
+    def sourceKey(sourcePaths: list):
+        """ Returns the key of a set of source files, None if any of them is missing """
+        key = []
+        for path in sourcePaths:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                return None
+            key.append([path, stat.st_mtime_ns, stat.st_size])
+        return key
+
+    def get(self, section: str, key):
+        """ Returns the cached value of a section if it was parsed from sources matching key, otherwise None """
+        entry = self.sections.get(section)
+        if key is None or entry is None or entry["Key"] != key:
+            return None
+        return entry["Value"]
+
+    def put(self, section: str, key, value) -> None:
+        """ Caches the value of a section, key should be taken before the sources were read """
+        if key is None:
+            return
+        # round tripped now so the value returned by get is the same whether or not it came from disk
+        self.sections[section] = {"Key": key, "Value": json.loads(json.dumps(value, default=str))}
+        self.modified = True
+
+    def getAnnotations(self, key):
+        """ Returns the cached annotations if they were parsed from sources matching key, otherwise None """
+        index = self.get("Annotations", key)
+        if index is None:
+            return None
+        try:
+            return CachedAnnotations(self.cacheDir + "/" + index["BlobFile"], index)
+        except Exception as exc:
+            print(exc)
+            return None
+
+    def putAnnotations(self, key, annotationItems) -> None:
+        """ Caches an iterable of (image id, box records), each image is written out as it is consumed """
+        if key is None or self.readOnly:
+            return
+
+        # each image's records are encoded separately so they can be decoded as their page is accessed
+        imageIDs = []
+        offsets = [0]
+        highestID = 0
+
+        # a new blob file per write, so the session file never points at offsets from another write
+        blobFile = f"annotations-{os.getpid()}-{key[0][1]}"
+        os.makedirs(self.cacheDir, exist_ok=True)
+        tempPath = self.cacheDir + "/" + blobFile + ".tmp"
+        try:
+            with open(tempPath, "wb") as file:
+                for imageID, records in annotationItems:
+                    if not records:
+                        continue
+                    blob = json.dumps(records, separators=(",", ":")).encode()
+                    file.write(blob)
+                    imageIDs.append(imageID)
+                    offsets.append(offsets[-1] + len(blob))
+                    for record in records:
+                        highestID = max(highestID, int(record[6]))
+            # the offsets are kept beside the blob rather than in the session file, which is read on every load
+            np.savez(self.cacheDir + "/" + blobFile + ".npz",
+                     ImageIDs=np.array(imageIDs, dtype=np.int64), Offsets=np.array(offsets, dtype=np.int64))
+        except BaseException:
+            os.remove(tempPath)
+            raise
+        os.replace(tempPath, self.cacheDir + "/" + blobFile + ".bin")
+
+        self.put("Annotations", key, {"BlobFile": blobFile, "HighestID": highestID})
+
+    def save(self) -> None:
+        """ Writes the cache out if any section was updated """
+        if not self.modified or self.readOnly:
+            return
+        os.makedirs(self.cacheDir, exist_ok=True)
+        tempPath = f"{self.metaPath}.{os.getpid()}.tmp"
+        with open(tempPath, "w") as file:
+            json.dump({"Version": self.VERSION, "Sections": self.sections}, file)
+        os.replace(tempPath, self.metaPath)
+        self.modified = False
+
+        # the blob this cache replaced is no longer referenced, another process may have written the others
+        blobFile = self.__blobFile()
+        if self.loadedBlob and self.loadedBlob != blobFile:
+            self.__removeBlob(self.loadedBlob)
+        self.loadedBlob = blobFile
+
+        # blobs left by processes that never saved, e.g. killed mid load, are only removed once long abandoned
+        for fileName in os.listdir(self.cacheDir):
+            if not fileName.startswith("annotations-") or fileName.startswith(str(blobFile) + "."):
+                continue
+            try:
+                if time.time() - os.path.getmtime(self.cacheDir + "/" + fileName) > self.STALE_BLOB_AGE:
+                    os.remove(self.cacheDir + "/" + fileName)
+            except OSError:
+                pass  # removed by another process
+
+    def __blobFile(self):
+        """ Returns the name of the annotation blob the cache references, None if there is none """
+        annotationsEntry = self.sections.get("Annotations")
+        return annotationsEntry["Value"]["BlobFile"] if annotationsEntry else None
+
+    def __removeBlob(self, blobFile: str) -> None:
+        """ Removes an annotation blob and its offsets """
+        for extension in (".bin", ".npz"):
+            try:
+                os.remove(self.cacheDir + "/" + blobFile + extension)
+            except OSError:
+                pass
+
+
+class CachedAnnotations:
+    """
+        Annotations read from the session cache. The blob is memory mapped and an image's records are only
+        decoded when they are asked for.
+    """
+    def __init__(self, blobPath: str, index: dict) -> None:
+        """ init, blobPath is the blob's path without an extension """
+        self.highestID = index["HighestID"]
+        with np.load(blobPath + ".npz", allow_pickle=False) as offsets:
+            imageIDs = offsets["ImageIDs"]
+            self.offsets = offsets["Offsets"]
+        self.rows = {imageID: row for row, imageID in enumerate(imageIDs.tolist())}
+
+        self.blob = b""
+        if len(self.rows) > 0:
+            with open(blobPath + ".bin", "rb") as file:
+                self.blob = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def records(self, imageID: int) -> list:
+        """ Returns the cached box records of an image """
+        row = self.rows.get(imageID)
+        if row is None:
+            return []
+        return json.loads(self.blob[self.offsets[row]:self.offsets[row + 1]])
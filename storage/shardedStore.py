@@ -0,0 +1,321 @@
+"""
+    shardedStore.py
+    Annotations split into shards that annotators lease, so several instances can label one project at once
+"""
+
+import os
+import time
+import uuid
+import socket
+import threading
+from datetime import datetime
+
+import yaml
+
+from storage import yamlStream
+from storage.annotationJournal import applyRecord
+
+
+class AnnotationIDsExhausted(Exception):
+    """ Raised when a shard has handed out every box id in its range """
+
+
+class ShardsLeased(Exception):
+    """ Raised when shards could not be written as other annotators hold their leases """
+
+
+class ShardLeases:
+    """
+        Leases on shards held through lock files on the shared filesystem. A lock file is created exclusively
+        and names its owner, the lease is kept alive by touching it. One that has not been touched for
+        LEASE_TIMEOUT is taken to be abandoned, e.g. by a crashed instance, and can be taken over. The MANIFEST
+        lease is held by the one instance allowed to write the files every annotator shares.
+    """
+    LEASE_TIMEOUT = 5 * 60  # s without renewal before a lease may be taken over
+    MANIFEST = -1  # lease on the project's shared files rather than a shard
+
+    def __init__(self, leaseDir: str) -> None:
+        """ init """
+        self.leaseDir = leaseDir
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.held = set()  # shards leased by this instance
+        self.lock = threading.Lock()  # leases are renewed from the autosave timer and checked by writes
+
+    def acquire(self, shard: int) -> bool:
+        """ Leases a shard, returns false if another instance holds it """
+        with self.lock:
+            lockPath = self.__lockPath(shard)
+            if shard in self.held:
+                if self.__readOwner(lockPath) == self.owner:
+                    return True
+                self.held.discard(shard)  # taken over while this instance was not renewing it
+
+            # the lock file is only ever created exclusively, an abandoned one is first moved out of the way
+            for attempt in range(2):
+                try:
+                    fd = os.open(lockPath, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                except FileExistsError:
+                    if attempt == 0 and self.__takeOver(lockPath):
+                        continue
+                    return False
+                with os.fdopen(fd, "w") as file:
+                    file.write(self.owner)
+                self.held.add(shard)
+                return True
+            return False
+
+    def holds(self, shard: int) -> bool:
+        """ Returns true if this instance holds the lease on a shard """
+        return shard in self.held
+
+    def holder(self, shard: int):
+        """ Returns the owner of a shard's lease, None if it is free or abandoned """
+        lockPath = self.__lockPath(shard)
+        if self.__isAbandoned(lockPath):
+            return None
+        return self.__readOwner(lockPath)
+
+    def renew(self) -> list:
+        """ Touches the lock file of every held lease, returns the shards whose lease was lost """
+        lost = []
+        with self.lock:
+            for shard in sorted(self.held):
+                lockPath = self.__lockPath(shard)
+                if self.__readOwner(lockPath) != self.owner:
+                    lost.append(shard)
+                    continue
+                os.utime(lockPath)
+            self.held.difference_update(lost)
+        return lost
+
+    def releaseAll(self) -> None:
+        """ Gives up every held lease """
+        with self.lock:
+            for shard in self.held:
+                lockPath = self.__lockPath(shard)
+                try:
+                    if self.__readOwner(lockPath) == self.owner:
+                        os.remove(lockPath)
+                except OSError as exc:
+                    print(exc)
+            self.held.clear()
+
+    def __lockPath(self, shard: int) -> str:
+        """ Returns the path of a shard's lock file """
+        if shard == self.MANIFEST:
+            return f"{self.leaseDir}/manifest.lock"
+        return f"{self.leaseDir}/shard-{shard:05d}.lock"
+
+    def __takeOver(self, lockPath: str) -> bool:
+        """
+            Moves an abandoned lock file aside so it can be created afresh, returns false if it is still live.
+            A rename only succeeds for one taker, and the file moved is checked to be the one found abandoned
+            in case another taker replaced it in between.
+        """
+        try:
+            stat = os.stat(lockPath)
+        except FileNotFoundError:
+            return True
+        if time.time() - stat.st_mtime <= self.LEASE_TIMEOUT:
+            return False
+
+        stalePath = f"{lockPath}.{uuid.uuid4().hex}.stale"
+        try:
+            os.rename(lockPath, stalePath)
+        except FileNotFoundError:
+            return True  # moved by another taker, whoever creates it first gets the lease
+        movedStat = os.stat(stalePath)
+        if movedStat.st_ino != stat.st_ino or time.time() - movedStat.st_mtime <= self.LEASE_TIMEOUT:
+            # a live lock was moved, put it back unless its place has been taken already
+            try:
+                os.link(stalePath, lockPath)
+            except OSError:
+                pass
+            os.remove(stalePath)
+            return False
+        os.remove(stalePath)
+        return True
+
+    def __readOwner(self, lockPath: str):
+        """ Returns the owner named in a lock file, None if there is none """
+        try:
+            with open(lockPath, "r") as file:
+                return file.read()
+        except FileNotFoundError:
+            return None
+
+    def __isAbandoned(self, lockPath: str) -> bool:
+        """ Returns true if a lock file is missing or has not been renewed within LEASE_TIMEOUT """
+        try:
+            return time.time() - os.path.getmtime(lockPath) > self.LEASE_TIMEOUT
+        except FileNotFoundError:
+            return True
+
+
+class ShardedAnnotationStore:
+    """
+        Annotations split into shards of SHARD_SIZE consecutive images, each an annotations file of its own in
+        the same layout as annotations.yaml. An instance only writes the shards it has leased and reads every
+        shard, so the project shows everyone's work. Each shard hands out box ids from a range of ID_RANGE ids
+        reserved for it, so annotators on different shards never give out the same id.
+    """
+    SHARD_SIZE = 1024  # images per shard
+    ID_RANGE = 1 << 20  # box ids reserved per shard
+
+    def __init__(self, storeDir: str) -> None:
+        """ init """
+        self.storeDir = storeDir
+        self.infoPath = storeDir + "/shards.yaml"
+        self.shardSize = self.SHARD_SIZE
+        self.idRange = self.ID_RANGE
+        self.idBase = 0  # ids at or below this were handed out before the project was sharded
+        self.leases = ShardLeases(storeDir)
+        self.highestIDs = {}  # shard -> highest id in its range that has been handed out
+        self.shardMtimes = {}  # shard -> mtime of its file when it was last read
+        # ids are handed out on the GUI thread while the autosave worker notes those read back from disk
+        self.lock = threading.Lock()
+
+        try:
+            with open(self.infoPath, "r") as stream:
+                info = yaml.safe_load(stream)
+            self.shardSize = info["ShardSize"]
+            self.idRange = info["IDRange"]
+            self.idBase = info["IDBase"]
+        except FileNotFoundError:
+            pass
+        except Exception as exc:
+            print(exc)
+
+    @staticmethod
+    def create(storeDir: str, idBase: int = 0) -> "ShardedAnnotationStore":
+        """ Creates an empty store, ids are handed out above idBase """
+        os.makedirs(storeDir, exist_ok=True)
+        with open(storeDir + "/shards.yaml", "w") as file:
+            yaml.safe_dump({"ShardSize": ShardedAnnotationStore.SHARD_SIZE,
+                            "IDRange": ShardedAnnotationStore.ID_RANGE,
+                            "IDBase": idBase}, file, sort_keys=False)
+        return ShardedAnnotationStore(storeDir)
+
+    def shardOf(self, imageID: int) -> int:
+        """ Returns the shard holding an image """
+        return imageID // self.shardSize
+
+    def nextID(self, shard: int) -> int:
+        """ Hands out the next box id from a shard's range """
+        start = self.idBase + shard * self.idRange + 1
+        with self.lock:
+            nextID = max(self.highestIDs.get(shard, 0), start - 1) + 1
+            if nextID >= start + self.idRange:
+                raise AnnotationIDsExhausted(f"Shard {shard} has run out of annotation ids")
+            self.highestIDs[shard] = nextID
+        return nextID
+
+    def load(self, progressCallback=None) -> dict:
+        """ Reads every shard, returns a dict of image id -> box records. progressCallback(shardsRead, shardCount) """
+        shards = self.__shardsOnDisk()
+        annotations = {}
+        for index, shard in enumerate(shards):
+            annotations.update(self.readShard(shard))
+            if progressCallback:
+                progressCallback(index + 1, len(shards))
+        return annotations
+
+    def refresh(self) -> dict:
+        """
+            Rereads the shards of other annotators that changed since they were last read, returns a dict of
+            shard -> that shard's annotations
+        """
+        changed = {}
+        for shard in self.__shardsOnDisk():
+            if self.leases.holds(shard):
+                continue
+            try:
+                mtime = os.stat(self.__shardPath(shard)).st_mtime_ns
+            except FileNotFoundError:
+                continue
+            with self.lock:
+                shardChanged = self.shardMtimes.get(shard) != mtime
+            if shardChanged:
+                changed[shard] = self.readShard(shard)
+        return changed
+
+    def readShard(self, shard: int) -> dict:
+        """ Reads a shard's annotations from disk and notes the highest id it has handed out """
+        shardPath = self.__shardPath(shard)
+        try:
+            mtime = os.stat(shardPath).st_mtime_ns
+            annotations = dict(yamlStream.AnnotationsReader(shardPath))
+        except FileNotFoundError:
+            return {}
+        with self.lock:
+            self.shardMtimes[shard] = mtime
+
+        self.noteIDs(shard, (record[6] for records in annotations.values() for record in records))
+        return annotations
+
+    def noteIDs(self, shard: int, annotationIDs) -> None:
+        """ Notes box ids in use on a shard, so those in its range are never handed out again """
+        start = self.idBase + shard * self.idRange + 1
+        inRange = [int(annotationID) for annotationID in annotationIDs if start <= int(annotationID) < start + self.idRange]
+        if not inRange:
+            return
+        # read and raised in one step, so an id handed out meanwhile is not lost
+        with self.lock:
+            self.highestIDs[shard] = max(self.highestIDs.get(shard, 0), max(inRange))
+
+    def writeShard(self, shard: int, annotations: dict) -> None:
+        """ Writes a dict of image id -> box records out as a shard, the shard must be leased """
+        items = ((imageID, annotations[imageID]) for imageID in sorted(annotations) if annotations[imageID])
+        yamlStream.dumpAnnotations(self.__shardPath(shard), {"Shard": shard, "LastUpdated": datetime.now()}, items)
+        mtime = os.stat(self.__shardPath(shard)).st_mtime_ns
+        with self.lock:
+            self.shardMtimes[shard] = mtime
+
+    def applyRecords(self, records: list) -> list:
+        """
+            Applies journal records to the shards they fall in, each shard is reread so only its own changes land.
+            Returns the records of shards that could not be leased, in their original order.
+        """
+        recordsByShard = {}
+        for record in records:
+            recordsByShard.setdefault(self.shardOf(record["image"]), []).append(record)
+
+        unsaved = []
+        for shard, shardRecords in sorted(recordsByShard.items()):
+            if not self.leases.acquire(shard):
+                print(f"Could not save {len(shardRecords)} annotation changes, shard {shard} is leased by {self.leases.holder(shard)}")
+                unsaved.extend(shardRecords)
+                continue
+            annotations = self.readShard(shard)
+            for record in shardRecords:
+                applyRecord(annotations, record)
+            self.writeShard(shard, annotations)
+        return unsaved
+
+    def writeAll(self, annotations: dict) -> None:
+        """ Writes out every shard from a dict of image id -> box records, raises ShardsLeased for shards others hold """
+        annotationsByShard = {shard: {} for shard in self.__shardsOnDisk()}
+        for imageID, records in annotations.items():
+            annotationsByShard.setdefault(self.shardOf(imageID), {})[imageID] = records
+
+        leased = []
+        for shard, shardAnnotations in sorted(annotationsByShard.items()):
+            if not self.leases.acquire(shard):
+                leased.append(shard)
+                continue
+            self.writeShard(shard, shardAnnotations)
+        if leased:
+            raise ShardsLeased(f"Could not write shards {leased}, they are leased by other annotators")
+
+    def __shardPath(self, shard: int) -> str:
+        """ Returns the path of a shard's annotations file """
+        return f"{self.storeDir}/shard-{shard:05d}.yaml"
+
+    def __shardsOnDisk(self) -> list:
+        """ Returns the number of every shard that has been written """
+        try:
+            fileNames = os.listdir(self.storeDir)
+        except FileNotFoundError:
+            return []
+        return sorted(int(fileName[6:11]) for fileName in fileNames
+                      if fileName.startswith("shard-") and fileName.endswith(".yaml"))
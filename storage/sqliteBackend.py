@@ -0,0 +1,202 @@
+"""
+    sqliteBackend.py
+    Stores a project's images, bounding boxes, classes and models in a single SQLite database
+"""
+
+import json
+import sqlite3
+import threading
+import urllib.parse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    id INTEGER PRIMARY KEY,
+    path TEXT NOT NULL UNIQUE,
+    annotated INTEGER NOT NULL DEFAULT 0,
+    needsWork INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS imagesAnnotatedIndex ON images(annotated);
+
+CREATE TABLE IF NOT EXISTS boxes (
+    id INTEGER PRIMARY KEY,
+    imageId INTEGER NOT NULL REFERENCES images(id),
+    className TEXT NOT NULL,
+    x REAL NOT NULL,
+    y REAL NOT NULL,
+    width REAL NOT NULL,
+    height REAL NOT NULL,
+    colour TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS boxesImageIndex ON boxes(imageId);
+CREATE INDEX IF NOT EXISTS boxesClassIndex ON boxes(className);
+
+CREATE TABLE IF NOT EXISTS classes (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    colour TEXT NOT NULL
+);
+
+CREATE TABLE IF NOT EXISTS models (
+    name TEXT PRIMARY KEY,
+    type TEXT,
+    device TEXT,
+    dimensions TEXT,
+    epochs TEXT,
+    batchSize TEXT,
+    workers TEXT,
+    lastUpdated TEXT
+);
+"""
+
+
+class SqliteProjectBackend:
+    """
+        Project storage backed by SQLite. Images are indexed by path and annotated status, boxes by image
+        and class name, and every write is batched into a single transaction.
+    """
+    def __init__(self, databasePath: str, readOnly: bool = False) -> None:
+        """ init, a readOnly database is opened for queries only and its schema is left as it is """
+        self.databasePath = databasePath
+        # The connection is shared with background writers, access is serialised through the lock
+        self.lock = threading.Lock()
+        if readOnly:
+            self.connection = sqlite3.connect(f"file:{urllib.parse.quote(databasePath)}?mode=ro", uri=True, check_same_thread=False)
+            return
+        self.connection = sqlite3.connect(databasePath, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("PRAGMA foreign_keys=ON")
+        self.connection.executescript(SCHEMA)
+
+    def close(self) -> None:
+        """ Closes the database connection """
+        with self.lock:
+            self.connection.close()
+
+    def writeImages(self, imagePaths: list) -> None:
+        """ Adds images to the project, existing paths are left untouched """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR IGNORE INTO images (path) VALUES (?)",
+                                        ((path,) for path in imagePaths))
+
+    def readImagePaths(self) -> list:
+        """ Returns the path of every image in the order they were added """
+        with self.lock:
+            return [row[0] for row in self.connection.execute("SELECT path FROM images ORDER BY id")]
+
+    def readClasses(self) -> list:
+        """ Returns a list of (class name, colour) """
+        with self.lock:
+            rows = self.connection.execute("SELECT name, colour FROM classes ORDER BY id").fetchall()
+        return [(name, tuple(json.loads(colour))) for name, colour in rows]
+
+    def writeClasses(self, classes: list) -> None:
+        """ Replaces the stored classes with a list of (class name, colour) """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM classes")
+            self.connection.executemany("INSERT INTO classes (name, colour) VALUES (?, ?)",
+                                        ((name, json.dumps(list(colour))) for name, colour in classes))
+
+    def readModels(self) -> list:
+        """ Returns every stored model as a dict using the same keys as a model yaml """
+        with self.lock:
+            rows = self.connection.execute("SELECT name, type, device, dimensions, epochs, batchSize, workers "
+                                           "FROM models ORDER BY rowid").fetchall()
+        return [{"Name": name, "Type": modelType, "Device": device, "Dimensions": json.loads(dimensions),
+                 "Epochs": epochs, "BatchSize": batchSize, "Workers": workers}
+                for name, modelType, device, dimensions, epochs, batchSize, workers in rows]
+
+    def writeModels(self, models: list) -> None:
+        """ Inserts or updates models given as dicts using the same keys as a model yaml """
+        with self.lock, self.connection:
+            self.connection.executemany("INSERT OR REPLACE INTO models "
+                                        "(name, type, device, dimensions, epochs, batchSize, workers, lastUpdated) "
+                                        "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                        ((model["Name"], model["Type"], model["Device"], json.dumps(model["Dimensions"]),
+                                          model["Epochs"], model["BatchSize"], model["Workers"], str(model["LastUpdated"]))
+                                         for model in models))
+
+    def readAnnotations(self, imagePaths: list = None) -> dict:
+        """ Returns a dict of image path -> box records, for every annotated image or only those given """
+        query = ("SELECT images.path, boxes.x, boxes.y, boxes.width, boxes.height, boxes.colour, boxes.className, boxes.id "
+                 "FROM boxes JOIN images ON images.id = boxes.imageId")
+        with self.lock:
+            if imagePaths is None:
+                rows = self.connection.execute(query + " ORDER BY boxes.imageId, boxes.rowid").fetchall()
+            else:
+                rows = []
+                paths = list(imagePaths)
+                # Stay under SQLite's bound parameter limit
+                for start in range(0, len(paths), 500):
+                    chunk = paths[start:start + 500]
+                    rows.extend(self.connection.execute(query + f" WHERE images.path IN ({','.join('?' * len(chunk))})"
+                                                        " ORDER BY boxes.imageId, boxes.rowid", chunk))
+
+        annotations = {}
+        for path, x, y, width, height, colour, className, annotationID in rows:
+            annotations.setdefault(path, []).append([x, y, width, height, json.loads(colour), className, annotationID])
+        return annotations
+
+    def writeImageAnnotations(self, imagePath: str, records: list) -> None:
+        """ Replaces the boxes of a single image """
+        with self.lock, self.connection:
+            imageId = self.__imageId(imagePath)
+            self.connection.execute("DELETE FROM boxes WHERE imageId = ?", (imageId,))
+            self.__insertBoxes(imageId, records)
+            self.connection.execute("UPDATE images SET annotated = ? WHERE id = ?", (int(len(records) > 0), imageId))
+
+    def writeAnnotations(self, annotations: dict) -> None:
+        """ Replaces every box in the project with a dict of image path -> box records """
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM boxes")
+            self.connection.execute("UPDATE images SET annotated = 0")
+            for imagePath, records in annotations.items():
+                imageId = self.__imageId(imagePath)
+                self.__insertBoxes(imageId, records)
+                self.connection.execute("UPDATE images SET annotated = ? WHERE id = ?", (int(len(records) > 0), imageId))
+
+    def applyJournal(self, records: list) -> None:
+        """ Applies annotation journal records in a single transaction """
+        if not records:
+            return
+        with self.lock, self.connection:
+            imageIds = set()
+            for record in records:
+                imageId = self.__imageId(record["image"])
+                imageIds.add(imageId)
+                if record["op"] == "put":
+                    self.connection.execute("DELETE FROM boxes WHERE id = ?", (int(record["box"][6]),))
+                    self.__insertBoxes(imageId, [record["box"]])
+                elif record["op"] == "delete":
+                    self.connection.execute("DELETE FROM boxes WHERE id = ?", (int(record["id"]),))
+            self.connection.executemany("UPDATE images SET annotated = EXISTS (SELECT 1 FROM boxes WHERE imageId = images.id) "
+                                        "WHERE id = ?", ((imageId,) for imageId in imageIds))
+
+    def countAnnotationsPerClass(self) -> dict:
+        """ Returns a dict of class name -> number of boxes """
+        with self.lock:
+            return dict(self.connection.execute("SELECT className, COUNT(*) FROM boxes GROUP BY className"))
+
+    def countAnnotatedImages(self) -> int:
+        """ Returns the number of images that have at least one box """
+        with self.lock:
+            return self.connection.execute("SELECT COUNT(*) FROM images WHERE annotated = 1").fetchone()[0]
+
+    def highestID(self) -> int:
+        """ Returns the highest annotation id stored """
+        with self.lock:
+            return self.connection.execute("SELECT COALESCE(MAX(id), 0) FROM boxes").fetchone()[0]
+
+    def __imageId(self, imagePath: str) -> int:
+        """ Looks up an image's id through the path index, adding the image if it is unknown """
+        row = self.connection.execute("SELECT id FROM images WHERE path = ?", (imagePath,)).fetchone()
+        if row:
+            return row[0]
+        return self.connection.execute("INSERT INTO images (path) VALUES (?)", (imagePath,)).lastrowid
+
+    def __insertBoxes(self, imageId: int, records: list) -> None:
+        """ Inserts box records for an image """
+        self.connection.executemany("INSERT INTO boxes (id, imageId, className, x, y, width, height, colour) "
+                                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                                    ((int(record[6]), imageId, record[5], record[0], record[1], record[2], record[3],
+                                      json.dumps(list(record[4]))) for record in records))
@@ -0,0 +1,212 @@
+"""
+    yamlStream.py
+    Event based reading and writing of annotations.yaml, so large files never build a full node tree in memory
+"""
+
+import io
+import os
+import math
+import yaml
+from datetime import date, datetime
+from yaml.nodes import ScalarNode
+from yaml.events import (AliasEvent, ScalarEvent, SequenceStartEvent, SequenceEndEvent, MappingStartEvent,
+                         MappingEndEvent, StreamStartEvent, StreamEndEvent, DocumentStartEvent, DocumentEndEvent)
+
+# Use libyaml when PyYAML was built against it, the pure python implementations are several times slower
+Loader = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
+Dumper = getattr(yaml, "CSafeDumper", yaml.SafeDumper)
+
+STR_TAG = "tag:yaml.org,2002:str"
+INT_TAG = "tag:yaml.org,2002:int"
+FLOAT_TAG = "tag:yaml.org,2002:float"
+BOOL_TAG = "tag:yaml.org,2002:bool"
+NULL_TAG = "tag:yaml.org,2002:null"
+TIMESTAMP_TAG = "tag:yaml.org,2002:timestamp"
+
+PROGRESS_INTERVAL = 1000  # images read between progress reports
+
+
+class AnnotationsReader:
+    """
+        Streams an annotations file. Iterating yields (image, box records) for each entry of the Annotations
+        mapping as soon as it has been parsed, the other top level keys are collected into header.
+    """
+    def __init__(self, filePath: str, progressCallback=None, data: bytes = None) -> None:
+        """
+            init, progressCallback(bytesRead, totalBytes) is called periodically while reading. The file's
+            contents can be given as data when they are already in memory, filePath is then only used in errors.
+        """
+        self.filePath = filePath
+        self.data = data
+        self.progressCallback = progressCallback
+        self.header = {}
+
+        self.resolver = yaml.resolver.Resolver()
+        self.constructor = yaml.constructor.SafeConstructor()
+        self.anchors = {}
+
+    def __iter__(self):
+        totalBytes = os.path.getsize(self.filePath) if self.data is None else len(self.data)
+        with open(self.filePath, "rb") if self.data is None else io.BytesIO(self.data) as stream:
+            events = yaml.parse(stream, Loader=Loader)
+            for event in events:
+                if isinstance(event, MappingStartEvent):
+                    break
+            else:
+                return  # empty document
+
+            # top level mapping, only the Annotations value is streamed
+            for event in events:
+                if isinstance(event, MappingEndEvent):
+                    break
+                key = self.__readValue(event, events)
+                valueEvent = next(events)
+                if key != "Annotations" or not isinstance(valueEvent, MappingStartEvent):
+                    self.header[key] = self.__readValue(valueEvent, events)
+                    continue
+
+                imagesRead = 0
+                for imageEvent in events:
+                    if isinstance(imageEvent, MappingEndEvent):
+                        break
+                    image = self.__readValue(imageEvent, events)
+                    records = self.__readValue(next(events), events)
+                    yield image, records or []
+                    imagesRead = imagesRead + 1
+                    if self.progressCallback and imagesRead % PROGRESS_INTERVAL == 0:
+                        self.progressCallback(stream.tell(), totalBytes)
+
+            if self.progressCallback:
+                self.progressCallback(totalBytes, totalBytes)
+
+    def __readValue(self, event, events):
+        """ Constructs the python value starting at event, consuming the events that make it up """
+        if isinstance(event, ScalarEvent):
+            value = self.__constructScalar(event)
+        elif isinstance(event, SequenceStartEvent):
+            value = []
+            for item in events:
+                if isinstance(item, SequenceEndEvent):
+                    break
+                value.append(self.__readValue(item, events))
+        elif isinstance(event, MappingStartEvent):
+            value = {}
+            for item in events:
+                if isinstance(item, MappingEndEvent):
+                    break
+                key = self.__readValue(item, events)
+                value[key] = self.__readValue(next(events), events)
+        elif isinstance(event, AliasEvent):
+            return self.anchors[event.anchor]
+        else:
+            raise yaml.YAMLError(f"Unexpected {event} in {self.filePath}")
+
+        if event.anchor is not None:
+            self.anchors[event.anchor] = value
+        return value
+
+    def __constructScalar(self, event: ScalarEvent):
+        """ Resolves and constructs a scalar the same way the safe loader does """
+        tag = event.tag
+        if tag is None or tag == "!":
+            if not event.implicit[0]:
+                return event.value  # quoted scalars are always strings
+            value = event.value
+            if value.isascii() and value.isdigit() and (value[0] != "0" or value == "0"):
+                return int(value)  # fast path for the ids and integer coordinates that make up most files
+            tag = self.resolver.resolve(ScalarNode, value, (True, False))
+        if tag == STR_TAG:
+            return event.value
+        constructor = self.constructor.yaml_constructors.get(tag)
+        if constructor is None:
+            raise yaml.YAMLError(f"Unsupported tag {tag} in {self.filePath}")
+        return constructor(self.constructor, ScalarNode(tag, event.value))
+
+
+def dumpAnnotations(filePath: str, header: dict, annotationItems) -> None:
+    """
+        Writes an annotations file from a header dict and an iterable of (image, box records), each image is
+        serialised as it is consumed. The file is written alongside and swapped in once complete.
+    """
+    resolver = yaml.resolver.Resolver()
+
+    def events():
+        yield StreamStartEvent()
+        yield DocumentStartEvent(explicit=False)
+        yield MappingStartEvent(anchor=None, tag=None, implicit=True, flow_style=False)
+        for key, value in header.items():
+            yield from valueEvents(key, resolver)
+            yield from valueEvents(value, resolver)
+        yield from valueEvents("Annotations", resolver)
+        yield MappingStartEvent(anchor=None, tag=None, implicit=True, flow_style=False)
+        for image, records in annotationItems:
+            yield from valueEvents(image, resolver)
+            yield SequenceStartEvent(anchor=None, tag=None, implicit=True, flow_style=False)
+            for record in records:
+                yield from valueEvents(record, resolver, flowStyle=True)
+            yield SequenceEndEvent()
+        yield MappingEndEvent()
+        yield MappingEndEvent()
+        yield DocumentEndEvent(explicit=False)
+        yield StreamEndEvent()
+
+    tempFilePath = filePath + ".tmp"
+    with open(tempFilePath, "w") as file:
+        yaml.emit(events(), file, Dumper=Dumper, allow_unicode=True)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tempFilePath, filePath)
+
+
+def valueEvents(value, resolver, flowStyle: bool = False):
+    """ Yields the events that represent a python value, mirroring the safe representer """
+    if isinstance(value, (list, tuple)):
+        yield SequenceStartEvent(anchor=None, tag=None, implicit=True, flow_style=flowStyle)
+        for item in value:
+            if isinstance(item, (list, tuple, dict)):
+                yield from valueEvents(item, resolver, flowStyle)
+            else:
+                yield scalarEvent(item, resolver)
+        yield SequenceEndEvent()
+    elif isinstance(value, dict):
+        yield MappingStartEvent(anchor=None, tag=None, implicit=True, flow_style=flowStyle)
+        for key, item in value.items():
+            yield from valueEvents(key, resolver, flowStyle)
+            yield from valueEvents(item, resolver, flowStyle)
+        yield MappingEndEvent()
+    else:
+        yield scalarEvent(value, resolver)
+
+
+def scalarEvent(value, resolver) -> ScalarEvent:
+    """ Returns the event for a scalar """
+    if isinstance(value, str):
+        # a string that would be read back as another type when plain has to be quoted
+        plain = resolver.resolve(ScalarNode, value, (True, False)) == STR_TAG
+        return ScalarEvent(anchor=None, tag=STR_TAG, implicit=(plain, True), value=value)
+    tag, text = scalarText(value)
+    return ScalarEvent(anchor=None, tag=tag, implicit=(True, False), value=text)
+
+
+def scalarText(value) -> tuple:
+    """ Returns the tag and plain text for a non string scalar """
+    if value is None:
+        return NULL_TAG, "null"
+    if isinstance(value, bool):
+        return BOOL_TAG, "true" if value else "false"
+    if isinstance(value, int):
+        return INT_TAG, str(value)
+    if isinstance(value, float):
+        if math.isnan(value):
+            return FLOAT_TAG, ".nan"
+        if math.isinf(value):
+            return FLOAT_TAG, ".inf" if value > 0 else "-.inf"
+        text = repr(value).lower()
+        if "." not in text and "e" in text:
+            text = text.replace("e", ".0e", 1)
+        return FLOAT_TAG, text
+    if isinstance(value, datetime):
+        return TIMESTAMP_TAG, value.isoformat(" ")
+    if isinstance(value, date):
+        return TIMESTAMP_TAG, value.isoformat()
+    raise yaml.representer.RepresenterError(f"cannot represent an object: {value!r}")
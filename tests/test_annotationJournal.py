@@ -0,0 +1,173 @@
+"""
+    test_annotationJournal.py
+    Tests of the annotation journal, replayed onto snapshots and compacted into them, against a temporary directory
+"""
+
+import os
+import sys
+import json
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.annotationJournal import AnnotationJournal
+
+
+def box(annotationID: int, x: int = 1) -> list:
+    """ Returns a box record """
+    return [x, x, 5, 5, [1, 2, 3, 255], "a", annotationID]
+
+
+class AnnotationJournalTest(unittest.TestCase):
+    """ A journal alongside a snapshot held in memory, as the project's annotations file would be """
+    def setUp(self) -> None:
+        """ Creates a journal in a temporary directory """
+        self.workDir = tempfile.mkdtemp()
+        self.journalPath = self.workDir + "/annotations.journal"
+        self.journal = AnnotationJournal(self.journalPath)
+        self.snapshot = {}  # image -> box records, what the annotations file holds
+        self.snapshotWrites = 0
+
+    def tearDown(self) -> None:
+        """ Removes the journal """
+        self.journal.waitForCompaction()
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def __readSnapshot(self):
+        """ Reads the snapshot as the project reads its annotations file """
+        return [(image, [list(record) for record in records]) for image, records in self.snapshot.items()]
+
+    def __writeSnapshot(self, annotationItems) -> None:
+        """ Writes the snapshot as the project writes its annotations file """
+        self.snapshot = dict(annotationItems)
+        self.snapshotWrites = self.snapshotWrites + 1
+
+    def __writeRecords(self, path: str, records: list) -> None:
+        """ Writes journal records straight to a file, as a journal left behind by an earlier session """
+        with open(path, "w") as file:
+            file.write("".join(json.dumps(record) + "\n" for record in records))
+
+    def testReplay(self) -> None:
+        """ Puts, moves and deletes are replayed onto the snapshot in the order they were recorded """
+        self.snapshot = {"a.jpg": [box(1), box(2)]}
+        self.journal.recordPut("a.jpg", box(2, x=9))
+        self.journal.recordDelete("a.jpg", 1)
+        self.journal.recordPut("b.jpg", box(3))
+        self.assertEqual(self.journal.flush(), 3)
+        self.journal.recordDelete("b.jpg", 3)
+        self.journal.recordPut("c.jpg", box(4))
+        self.journal.flush()
+
+        annotations = {image: list(records) for image, records in self.snapshot.items()}
+        self.assertEqual(AnnotationJournal(self.journalPath).replay(annotations), 5)
+        self.assertEqual(annotations, {"a.jpg": [box(2, x=9)], "c.jpg": [box(4)]})
+        self.assertEqual(self.journal.imageKeys(), {"a.jpg", "b.jpg", "c.jpg"})
+
+    def testPendingEditsCoalesce(self) -> None:
+        """ Repeated edits of a box before a flush are written as its last edit """
+        self.journal.recordPut("a.jpg", box(1))
+        self.journal.recordPut("a.jpg", box(1, x=7))
+        self.assertTrue(self.journal.hasPending())
+        self.assertEqual(self.journal.flush(), 1)
+        self.assertFalse(self.journal.hasPending())
+        self.assertEqual(self.journal.readRecords(), [{"op": "put", "image": "a.jpg", "box": box(1, x=7)}])
+
+    def testTornTailIsTruncated(self) -> None:
+        """ A record cut short by a crash is dropped, and cut off so the next append starts on a clean line """
+        self.journal.recordPut("a.jpg", box(1))
+        self.journal.flush()
+        validLength = os.path.getsize(self.journalPath)
+        with open(self.journalPath, "a") as file:
+            file.write('{"op":"put","image":"a.jpg","box":[1,1,5')
+
+        annotations = {}
+        self.assertEqual(self.journal.replay(annotations), 1)
+        self.assertEqual(annotations, {"a.jpg": [box(1)]})
+        self.assertEqual(os.path.getsize(self.journalPath), validLength)
+
+        self.journal.recordPut("b.jpg", box(2))
+        self.journal.flush()
+        self.assertEqual([record["image"] for record in self.journal.readRecords()], ["a.jpg", "b.jpg"])
+
+    def testCompaction(self) -> None:
+        """ The journal is folded into the snapshot and removed """
+        self.snapshot = {"a.jpg": [box(1)]}
+        self.journal.recordPut("a.jpg", box(1, x=4))
+        self.journal.recordPut("b.jpg", box(2))
+        self.journal.flush()
+
+        self.journal.compact(self.__readSnapshot, self.__writeSnapshot)
+        self.journal.waitForCompaction()
+        self.assertEqual(self.snapshot, {"a.jpg": [box(1, x=4)], "b.jpg": [box(2)]})
+        self.assertFalse(os.path.exists(self.journalPath))
+        self.assertFalse(os.path.exists(self.journal.compactingPath))
+
+    def testInterruptedCompactionIsResumed(self) -> None:
+        """
+            A rotation left behind by a crash is replayed ahead of the journal written since, and carried into
+            the next compaction along with it
+        """
+        self.snapshot = {"a.jpg": [box(1)]}
+        self.__writeRecords(self.journal.compactingPath, [{"op": "put", "image": "a.jpg", "box": box(1, x=4)},
+                                                         {"op": "put", "image": "b.jpg", "box": box(2)}])
+        self.__writeRecords(self.journalPath, [{"op": "put", "image": "a.jpg", "box": box(1, x=8)},
+                                               {"op": "delete", "image": "b.jpg", "id": 2}])
+
+        annotations = {image: list(records) for image, records in self.snapshot.items()}
+        self.assertEqual(self.journal.replay(annotations), 4)
+        self.assertEqual(annotations, {"a.jpg": [box(1, x=8)]})
+
+        self.journal.compact(self.__readSnapshot, self.__writeSnapshot)
+        self.journal.waitForCompaction()
+        self.assertEqual(self.snapshotWrites, 1)
+        self.assertEqual(self.snapshot, {"a.jpg": [box(1, x=8)]})
+        self.assertFalse(os.path.exists(self.journalPath))
+        self.assertFalse(os.path.exists(self.journal.compactingPath))
+
+    def testInterruptedCompactionWithoutNewRecords(self) -> None:
+        """ A rotation left behind is compacted even when nothing was journalled since """
+        self.__writeRecords(self.journal.compactingPath, [{"op": "put", "image": "a.jpg", "box": box(1)}])
+        self.journal.compact(self.__readSnapshot, self.__writeSnapshot)
+        self.journal.waitForCompaction()
+        self.assertEqual(self.snapshot, {"a.jpg": [box(1)]})
+        self.assertFalse(os.path.exists(self.journal.compactingPath))
+
+    def testFailedCompactionKeepsRecords(self) -> None:
+        """ The rotated records stay on disk if the snapshot could not be written, to be replayed next load """
+        self.journal.recordPut("a.jpg", box(1))
+        self.journal.flush()
+
+        def failingWrite(annotationItems) -> None:
+            raise OSError("disk full")
+
+        self.journal.compact(self.__readSnapshot, failingWrite)
+        self.journal.waitForCompaction()
+        annotations = {}
+        self.assertEqual(self.journal.replay(annotations), 1)
+        self.assertEqual(annotations, {"a.jpg": [box(1)]})
+
+    def testImageKey(self) -> None:
+        """ Records are keyed by imageKey when read back, those it maps to None are dropped """
+        self.__writeRecords(self.journalPath, [{"op": "put", "image": "a.jpg", "box": box(1)},
+                                               {"op": "put", "image": "gone.jpg", "box": box(2)}])
+        journal = AnnotationJournal(self.journalPath, imageKey=lambda image: {"a.jpg": 0}.get(image))
+        annotations = {}
+        self.assertEqual(journal.replay(annotations), 1)
+        self.assertEqual(annotations, {0: [box(1)]})
+
+    def testReset(self) -> None:
+        """ Resetting discards pending records and both journal files """
+        self.__writeRecords(self.journal.compactingPath, [{"op": "put", "image": "a.jpg", "box": box(1)}])
+        self.journal.recordPut("b.jpg", box(2))
+        self.journal.flush()
+        self.journal.recordPut("c.jpg", box(3))
+        self.journal.reset()
+        self.assertFalse(self.journal.hasPending())
+        self.assertFalse(os.path.exists(self.journalPath))
+        self.assertFalse(os.path.exists(self.journal.compactingPath))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,171 @@
+"""
+    test_annotationMerge.py
+    Tests of diffing and three-way merging annotation sets
+"""
+
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from storage.annotationMerge import MergePolicies, diffAnnotations, mergeAnnotations
+
+COLOUR = [1, 2, 3, 255]
+
+
+def box(annotationID: int, x: float = 0, y: float = 0, size: float = 10, className: str = "a") -> list:
+    """ Returns a box record """
+    return [x, y, size, size, COLOUR, className, annotationID]
+
+
+def sortedAnnotations(annotations: dict) -> dict:
+    """ Returns annotations with each image's boxes in id order, merges keep no particular order within an image """
+    return {image: sorted(records, key=lambda record: record[6]) for image, records in annotations.items()}
+
+
+class DiffAnnotationsTest(unittest.TestCase):
+    """ Splitting the differences between two sets into added, removed and moved boxes """
+    def testAddedRemovedMoved(self) -> None:
+        """ Each kind of change is reported once, unchanged boxes not at all """
+        base = {"a.jpg": [box(1), box(2, x=50), box(3, x=100)], "b.jpg": [box(4)]}
+        other = {"a.jpg": [box(1), box(2, x=52), box(5, x=200)], "c.jpg": [box(6)]}
+        diff = diffAnnotations(base, other)
+        self.assertTrue(diff.hasChanges())
+        self.assertEqual(sorted(diff.added, key=lambda change: change[1][6]), [("a.jpg", box(5, x=200)), ("c.jpg", box(6))])
+        self.assertEqual(sorted(diff.removed, key=lambda change: change[1][6]), [("a.jpg", box(3, x=100)), ("b.jpg", box(4))])
+        self.assertEqual(diff.moved, [("a.jpg", box(2, x=50), box(2, x=52))])
+
+    def testClassChangeIsMove(self) -> None:
+        """ A box given another class in place is moved, not removed and added """
+        diff = diffAnnotations({"a.jpg": [box(1)]}, {"a.jpg": [box(1, className="b")]})
+        self.assertEqual(diff.moved, [("a.jpg", box(1), box(1, className="b"))])
+        self.assertEqual(diff.added, [])
+        self.assertEqual(diff.removed, [])
+
+    def testReusedID(self) -> None:
+        """ An id reused for a box elsewhere in the image is one removal and one addition """
+        diff = diffAnnotations({"a.jpg": [box(1)]}, {"a.jpg": [box(1, x=500)]})
+        self.assertEqual(diff.removed, [("a.jpg", box(1))])
+        self.assertEqual(diff.added, [("a.jpg", box(1, x=500))])
+        self.assertEqual(diff.moved, [])
+
+    def testMatchIoU(self) -> None:
+        """ How far a box may move and still count as moved is given by matchIoU """
+        base, other = {"a.jpg": [box(1)]}, {"a.jpg": [box(1, x=5)]}  # an iou of a third
+        self.assertEqual(len(diffAnnotations(base, other).moved), 0)
+        self.assertEqual(len(diffAnnotations(base, other, matchIoU=0.3).moved), 1)
+
+    def testSameIDOnAnotherImage(self) -> None:
+        """ Boxes are matched by image and id together """
+        diff = diffAnnotations({"a.jpg": [box(1)]}, {"b.jpg": [box(1)]})
+        self.assertEqual(diff.removed, [("a.jpg", box(1))])
+        self.assertEqual(diff.added, [("b.jpg", box(1))])
+
+    def testEmptySides(self) -> None:
+        """ Against an empty set everything is added or removed """
+        annotations = {"a.jpg": [box(1), box(2, x=50)]}
+        diff = diffAnnotations({}, annotations)
+        self.assertEqual(len(diff.added), 2)
+        self.assertEqual(diff.removed, [])
+        diff = diffAnnotations(annotations, {})
+        self.assertEqual(len(diff.removed), 2)
+        self.assertEqual(diff.added, [])
+        self.assertFalse(diffAnnotations({}, {}).hasChanges())
+        self.assertFalse(diffAnnotations(annotations, annotations).hasChanges())
+
+
+class MergeAnnotationsTest(unittest.TestCase):
+    """ Three-way merges of two sets that descend from a common base """
+    def setUp(self) -> None:
+        """ A base with two boxes on one image """
+        self.base = {"a.jpg": [box(1), box(2, x=50)]}
+
+    def testOneSidedChanges(self) -> None:
+        """ Changes made on one side only are taken whatever the policy """
+        ours = {"a.jpg": [box(1, x=2), box(2, x=50)]}
+        theirs = {"a.jpg": [box(1)], "b.jpg": [box(3)]}
+        for policy in MergePolicies:
+            with self.subTest(policy=policy):
+                result = mergeAnnotations(self.base, ours, theirs, policy)
+                self.assertEqual(sortedAnnotations(result.annotations), {"a.jpg": [box(1, x=2)], "b.jpg": [box(3)]})
+                self.assertEqual((result.conflicts, result.collisions, result.renumbered), (0, 0, 0))
+
+    def testSameChangeOnBothSides(self) -> None:
+        """ A box changed the same way on both sides is not a conflict """
+        ours = theirs = {"a.jpg": [box(1, x=3), box(2, x=50)]}
+        result = mergeAnnotations(self.base, ours, theirs, MergePolicies.theirs)
+        self.assertEqual(sortedAnnotations(result.annotations), ours)
+        self.assertEqual(result.conflicts, 0)
+
+    def testConflictingMoves(self) -> None:
+        """ A box moved differently on both sides is resolved by the policy """
+        ours = {"a.jpg": [box(1, x=1), box(2, x=50)]}
+        theirs = {"a.jpg": [box(1, x=2), box(2, x=50)]}
+        expected = {MergePolicies.ours: box(1, x=1), MergePolicies.theirs: box(1, x=2), MergePolicies.union: box(1, x=1)}
+        for policy, kept in expected.items():
+            with self.subTest(policy=policy):
+                result = mergeAnnotations(self.base, ours, theirs, policy)
+                # overlapping versions of one box are not both kept, even under union
+                self.assertEqual(sortedAnnotations(result.annotations), {"a.jpg": [kept, box(2, x=50)]})
+                self.assertEqual(result.conflicts, 1)
+                self.assertEqual(result.renumbered, 0)
+
+    def testConflictingMovesApart(self) -> None:
+        """ Under union, versions of a box moved apart on each side are both kept, theirs under a new id """
+        ours = {"a.jpg": [box(1, x=200), box(2, x=50)]}
+        theirs = {"a.jpg": [box(1, x=400), box(2, x=50)]}
+        result = mergeAnnotations(self.base, ours, theirs, MergePolicies.union)
+        self.assertEqual(sortedAnnotations(result.annotations), {"a.jpg": [box(1, x=200), box(2, x=50), box(3, x=400)]})
+        self.assertEqual((result.conflicts, result.renumbered), (1, 1))
+        result = mergeAnnotations(self.base, ours, theirs, MergePolicies.ours)
+        self.assertEqual(sortedAnnotations(result.annotations), ours)
+
+    def testChangeAgainstRemoval(self) -> None:
+        """ A box removed on one side and moved on the other, union keeps the change """
+        ours = {"a.jpg": [box(2, x=50)]}
+        theirs = {"a.jpg": [box(1, x=1), box(2, x=50)]}
+        expected = {MergePolicies.ours: [box(2, x=50)],
+                    MergePolicies.theirs: [box(1, x=1), box(2, x=50)],
+                    MergePolicies.union: [box(1, x=1), box(2, x=50)]}
+        for policy, kept in expected.items():
+            with self.subTest(policy=policy):
+                result = mergeAnnotations(self.base, ours, theirs, policy)
+                self.assertEqual(sortedAnnotations(result.annotations), {"a.jpg": kept})
+                self.assertEqual(result.conflicts, 1)
+
+    def testCollisionWithoutOverlap(self) -> None:
+        """ Unrelated boxes added on both sides with the same id are both kept, theirs renumbered past every id """
+        ours = {"a.jpg": self.base["a.jpg"] + [box(7, x=100)]}
+        theirs = {"a.jpg": self.base["a.jpg"] + [box(7, x=300)]}
+        for policy in MergePolicies:
+            with self.subTest(policy=policy):
+                result = mergeAnnotations(self.base, ours, theirs, policy)
+                self.assertEqual(sortedAnnotations(result.annotations), {"a.jpg": [box(1), box(2, x=50), box(7, x=100), box(8, x=300)]})
+                self.assertEqual((result.conflicts, result.collisions, result.renumbered), (0, 1, 1))
+
+    def testCollisionWithOverlap(self) -> None:
+        """ Overlapping boxes added on both sides with the same id are one box drawn twice, a conflict """
+        ours = {"b.jpg": [box(7, x=100)]}
+        theirs = {"b.jpg": [box(7, x=101)]}
+        expected = {MergePolicies.ours: box(7, x=100), MergePolicies.theirs: box(7, x=101), MergePolicies.union: box(7, x=100)}
+        for policy, kept in expected.items():
+            with self.subTest(policy=policy):
+                result = mergeAnnotations({}, ours, theirs, policy)
+                self.assertEqual(result.annotations, {"b.jpg": [kept]})
+                self.assertEqual((result.conflicts, result.collisions, result.renumbered), (1, 0, 0))
+
+    def testEmptySides(self) -> None:
+        """ Empty sets merge as any other, an empty base makes every box an addition """
+        annotations = {"a.jpg": [box(1)], "b.jpg": [box(2)]}
+        self.assertEqual(mergeAnnotations({}, {}, {}).annotations, {})
+        self.assertEqual(mergeAnnotations({}, annotations, {}).annotations, annotations)
+        self.assertEqual(mergeAnnotations({}, {}, annotations).annotations, annotations)
+        # everything removed on one side and left alone on the other
+        self.assertEqual(mergeAnnotations(annotations, {}, annotations).annotations, {})
+        self.assertEqual(mergeAnnotations(annotations, annotations, {}).annotations, {})
+        self.assertEqual(mergeAnnotations(annotations, {}, {}).annotations, {})
+
+
+if __name__ == "__main__":
+    unittest.main()
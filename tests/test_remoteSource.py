@@ -0,0 +1,201 @@
+"""
+    test_remoteSource.py
+    Tests of remote datasets against a local http.server standing in for an S3 compatible store and a plain HTTP server
+"""
+
+import os
+import sys
+import shutil
+import hashlib
+import tempfile
+import threading
+import unittest
+import urllib.parse
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from dataset.remoteSource import RemoteCache, RemoteSource, fetch, fetchRange, remoteInfo
+
+PAGE_SIZE = 3  # keys per listing page, small so listings are paginated
+
+
+class StoreHandler(BaseHTTPRequestHandler):
+    """ Serves the server's objects under /bucket as a bucket and under /plain with an index.txt """
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args) -> None:
+        """ Requests are recorded on the server rather than logged """
+
+    def do_HEAD(self) -> None:
+        """ Stats an object """
+        self.__respond()
+
+    def do_GET(self) -> None:
+        """ Lists the bucket or returns an object, or a range of it """
+        self.__respond()
+
+    def __respond(self) -> None:
+        """ Answers a request """
+        parts = urllib.parse.urlsplit(self.path)
+        path = urllib.parse.unquote(parts.path)
+        query = dict(urllib.parse.parse_qsl(parts.query))
+        self.server.requests.append((self.command, path, self.headers.get("Range")))
+        if self.server.broken:
+            self.wfile.write(b"not http\r\n\r\n")  # a malformed status line
+            self.close_connection = True
+            return
+
+        if path == "/bucket" and query.get("list-type") == "2":
+            self.__sendListing(query)
+            return
+        if path == "/plain/index.txt":
+            self.__send(200, "\n".join(sorted(self.server.objects)).encode())
+            return
+        name = path.partition("/")[2].partition("/")[2]
+        data = self.server.objects.get(name)
+        if not path.startswith(("/bucket/", "/plain/")) or data is None:
+            self.__send(404, b"")
+            return
+
+        headers = {"ETag": f'"{hashlib.md5(data).hexdigest()}"', "Last-Modified": formatdate(0, usegmt=True)}
+        byteRange = self.headers.get("Range")
+        if byteRange and self.command == "GET":
+            start, _, end = byteRange[len("bytes="):].partition("-")
+            start, end = int(start), min(int(end), len(data) - 1)
+            headers["Content-Range"] = f"bytes {start}-{end}/{len(data)}"
+            self.__send(206, data[start:end + 1], headers)
+            return
+        self.__send(200, data, headers)
+
+    def __sendListing(self, query: dict) -> None:
+        """ Sends a page of a ListObjectsV2 listing """
+        names = sorted(self.server.objects)
+        start = int(query.get("continuation-token", 0))
+        contents = "".join(f"<Contents><Key>{name}</Key><LastModified>1970-01-01T00:00:00.000Z</LastModified>"
+                           f"<ETag>&quot;{hashlib.md5(self.server.objects[name]).hexdigest()}&quot;</ETag>"
+                           f"<Size>{len(self.server.objects[name])}</Size></Contents>"
+                           for name in names[start:start + PAGE_SIZE])
+        truncated = "true" if start + PAGE_SIZE < len(names) else "false"
+        body = (f'<?xml version="1.0"?><ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+                f"<IsTruncated>{truncated}</IsTruncated>{contents}"
+                f"<NextContinuationToken>{start + PAGE_SIZE}</NextContinuationToken></ListBucketResult>")
+        self.__send(200, body.encode())
+
+    def __send(self, status: int, body: bytes, headers: dict = None) -> None:
+        """ Sends a response, without its body to a HEAD request """
+        self.send_response(status)
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if self.command != "HEAD":
+            self.wfile.write(body)
+
+
+class RemoteSourceTest(unittest.TestCase):
+    """ Listing, fetching and caching of remote datasets """
+    def setUp(self) -> None:
+        """ Starts a server with a few objects and points the shared cache at a temporary directory """
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), StoreHandler)
+        self.server.objects = {f"dir/image{index}.png": bytes(range(index, index + 200)) for index in range(7)}
+        self.server.objects["hidden/.image.png"] = b"hidden"
+        self.server.requests = []
+        self.server.broken = False
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.baseUrl = f"http://127.0.0.1:{self.server.server_port}"
+
+        self.cacheDir = tempfile.mkdtemp()
+        RemoteCache.sharedCache = RemoteCache(self.cacheDir)
+        RemoteSource.credentials = None
+        RemoteSource.openSources.clear()
+        RemoteSource.statted.clear()
+
+    def tearDown(self) -> None:
+        """ Stops the server and removes the cache """
+        self.server.shutdown()
+        self.server.server_close()
+        RemoteCache.sharedCache = None
+        shutil.rmtree(self.cacheDir, ignore_errors=True)
+
+    def requestsOf(self, method: str) -> list:
+        """ Returns the requests the server received with a method """
+        return [request for request in self.server.requests if request[0] == method]
+
+    def testBucketListing(self) -> None:
+        """ Every page of a bucket listing is read, and hidden objects are not images """
+        source = RemoteSource.open(self.baseUrl + "/bucket/dir")
+        self.assertEqual(sorted(source.imageNames()), [f"image{index}.png" for index in range(7)])
+        self.assertEqual(len(self.requestsOf("GET")), 3)
+        self.assertEqual(source.objects["image2.png"][1], 200)
+
+    def testIndexListingStatsOnce(self) -> None:
+        """ Objects listed from an index.txt are statted with one HEAD request, however often they are read """
+        source = RemoteSource.open(self.baseUrl + "/plain")
+        self.assertIn("dir/image0.png", source.imageNames())
+        url = self.baseUrl + "/plain/dir/image0.png"
+        for _ in range(3):
+            self.assertEqual(fetch(url), self.server.objects["dir/image0.png"])
+        self.assertEqual(len(self.requestsOf("HEAD")), 1)
+        self.assertEqual(len([request for request in self.requestsOf("GET") if request[1].endswith(".png")]), 1)
+
+    def testRangeReads(self) -> None:
+        """ Ranges are requested until the object is cached, then read from the cache """
+        RemoteSource.open(self.baseUrl + "/bucket/dir").list()
+        url = self.baseUrl + "/bucket/dir/image3.png"
+        data = self.server.objects["dir/image3.png"]
+        self.assertEqual(fetchRange(url, 10, 20), data[10:30])
+        self.assertEqual(fetchRange(url, 190, 50), data[190:])
+        self.assertEqual(len([request for request in self.requestsOf("GET") if request[2]]), 2)
+
+        self.assertEqual(fetch(url), data)
+        requestCount = len(self.server.requests)
+        self.assertEqual(fetchRange(url, 5, 5), data[5:10])
+        self.assertEqual(len(self.server.requests), requestCount)
+
+    def testLeastRecentlyUsedEviction(self) -> None:
+        """ The least recently used entries are evicted once the cache is over capacity, along with their files """
+        cache = RemoteCache(self.cacheDir, capacity=3000)
+        keys = [RemoteCache.key(str(index)) for index in range(4)]
+        for key in keys[:3]:
+            cache.put(key, b"x" * 1000)
+        cache.get(keys[0])  # now more recently used than the second entry
+        cache.put(keys[3], b"x" * 1000)
+        self.assertIsNone(cache.get(keys[1]))
+        self.assertFalse(os.path.exists(cache.path(keys[1])))
+        for key in (keys[0], keys[2], keys[3]):
+            self.assertEqual(cache.get(key), b"x" * 1000)
+        self.assertEqual(cache.size, 3000)
+
+        # recency survives reopening the cache
+        reopened = RemoteCache(self.cacheDir, capacity=3000)
+        self.assertEqual(sorted(reopened.entries), sorted(cache.entries))
+
+    def testEtagInvalidation(self) -> None:
+        """ A replaced object is fetched again once its dataset is relisted, rather than served from the cache """
+        for datasetUrl in (self.baseUrl + "/bucket/dir", self.baseUrl + "/plain"):
+            source = RemoteSource.open(datasetUrl)
+            source.list()
+            name = "image4.png" if datasetUrl.endswith("dir") else "dir/image4.png"
+            url = datasetUrl + "/" + name
+            self.server.objects["dir/image4.png"] = b"before"
+            source.list()
+            self.assertEqual(fetch(url), b"before")
+            self.server.objects["dir/image4.png"] = b"after"
+            source.list()
+            self.assertEqual(fetch(url), b"after")
+
+    def testRequestErrors(self) -> None:
+        """ Malformed responses are reported as missing objects, and a failed listing keeps the previous one """
+        source = RemoteSource.open(self.baseUrl + "/bucket/dir")
+        objects = source.list()
+        self.server.broken = True
+        self.assertEqual(source.list(), objects)
+        self.assertIsNone(remoteInfo(self.baseUrl + "/plain/dir/image0.png"))
+        self.assertIsNone(fetchRange(self.baseUrl + "/plain/dir/image0.png", 0, 10))
+        self.assertIsNone(fetch(self.baseUrl + "/plain/dir/image1.png"))
+
+
+if __name__ == "__main__":
+    unittest.main()
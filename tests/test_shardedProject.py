@@ -0,0 +1,67 @@
+"""
+    test_shardedProject.py
+    Tests of several annotators working on one sharded project at once
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import Project, StorageFormats
+from boundingBox import BoundingBox
+
+IMAGE_COUNT = 6
+
+
+class ShardedProjectTest(unittest.TestCase):
+    """ Two instances of a sharded project, as two annotators would have open """
+    def setUp(self) -> None:
+        """ Creates a sharded project over a few images in a temporary directory and opens it twice """
+        self.previousDir = os.getcwd()
+        self.workDir = tempfile.mkdtemp()
+        os.chdir(self.workDir)  # projects are created under the working directory
+        datasetDir = self.workDir + "/images"
+        os.makedirs(datasetDir)
+        for index in range(IMAGE_COUNT):
+            with open(f"{datasetDir}/image{index}.png", "wb") as file:
+                file.write(bytes([index]) * 64)
+
+        project = Project()
+        project.createProject("shared", datasetDir, StorageFormats.sharded)
+        project.releaseShards()
+        self.projectDir = os.path.dirname(project.projectFile)
+        self.first = Project()
+        self.first.loadProject(self.projectDir)
+        self.second = Project()
+        self.second.loadProject(self.projectDir)
+
+    def tearDown(self) -> None:
+        """ Releases the leases and removes the project """
+        self.first.releaseShards()
+        self.second.releaseShards()
+        os.chdir(self.previousDir)
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def testAnnotatedStateAfterSync(self) -> None:
+        """ Boxes another annotator saved count as annotated once synced, even where the state was already worked out """
+        self.assertFalse(self.second.annotationDataset.isAnnotated(1))
+        self.assertEqual(self.second.countAnnotatedImages(), 0)
+
+        image = self.first.annotationDataset[1]
+        boundingBox = BoundingBox.fromRecord([1, 2, 3, 4, [255, 0, 0, 255], "cat", self.first.getNextAnnotationID(1)])
+        self.assertTrue(self.first.updateImageAnnotations(image, [boundingBox]))
+        self.first.writeSnapshot(self.first.takeDirtySnapshot())
+
+        self.second.syncShards()
+        self.assertEqual(len(self.second.annotationDataset[1].boundingBoxes), 1)
+        self.assertTrue(self.second.annotationDataset.isAnnotated(1))
+        self.assertEqual(self.second.annotatedImageCount, 1)
+        self.assertEqual(self.second.countAnnotatedImages(), 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
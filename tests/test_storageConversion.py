@@ -0,0 +1,97 @@
+"""
+    test_storageConversion.py
+    Tests of converting a project between storage formats
+"""
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from project import Project, StorageFormats
+from boundingBox import BoundingBox
+
+IMAGE_COUNT = 600  # enough images for a few pages of the annotation dataset
+ANNOTATED_IMAGES = (0, 300, 550)
+
+
+class StorageConversionTest(unittest.TestCase):
+    """ A sqlite project with boxes spread over several pages, converted to the other formats """
+    def setUp(self) -> None:
+        """ Creates a sqlite project in a temporary directory and saves a box on a few of its images """
+        self.previousDir = os.getcwd()
+        self.workDir = tempfile.mkdtemp()
+        os.chdir(self.workDir)  # projects are created under the working directory
+        datasetDir = self.workDir + "/images"
+        os.makedirs(datasetDir)
+        for index in range(IMAGE_COUNT):
+            with open(f"{datasetDir}/image{index}.png", "wb") as file:
+                file.write(index.to_bytes(2, "little") * 32)
+
+        self.project = Project()
+        self.project.createProject("converted", datasetDir, StorageFormats.sqlite)
+        self.projectDir = os.path.dirname(self.project.projectFile)
+        for imageID in ANNOTATED_IMAGES:
+            self.__addBox(imageID)
+        self.project.writeSnapshot(self.project.takeDirtySnapshot())
+
+    def tearDown(self) -> None:
+        """ Removes the project """
+        self.project.releaseShards()
+        os.chdir(self.previousDir)
+        shutil.rmtree(self.workDir, ignore_errors=True)
+
+    def __addBox(self, imageID: int) -> None:
+        """ Gives an image a single box """
+        image = self.project.annotationDataset[imageID]
+        record = [1, 1, 5, 5, [1, 2, 3, 255], "a", self.project.getNextAnnotationID(imageID)]
+        self.assertTrue(self.project.updateImageAnnotations(image, [BoundingBox.fromRecord(record)]))
+
+    def __annotatedImages(self, project: Project) -> list:
+        """ Returns the ids of the images with boxes """
+        return [imageID for imageID, _, boundingBoxes in project.annotationDataset.iterBoundingBoxes() if len(boundingBoxes) > 0]
+
+    def testConvertFromSqlite(self) -> None:
+        """ Saved and unsaved boxes survive leaving sqlite, both in the open project and once reopened """
+        # reopened so the saved boxes are still to be read from the database
+        self.project = Project()
+        self.project.loadProject(self.projectDir)
+        self.__addBox(50)  # not yet saved
+        expected = sorted(ANNOTATED_IMAGES + (50,))
+        for storageFormat in (StorageFormats.numpy, StorageFormats.yaml, StorageFormats.sharded):
+            with self.subTest(storageFormat=storageFormat):
+                self.project.convertStorageFormat(storageFormat)
+                self.assertIs(self.project.storageFormat, storageFormat)
+                self.assertIsNone(self.project.database)
+                self.assertEqual(self.__annotatedImages(self.project), expected)
+                self.assertFalse(os.path.exists(self.projectDir + "/project.db"))
+
+                reopened = Project()
+                reopened.loadProject(self.projectDir)
+                self.assertIs(reopened.storageFormat, storageFormat)
+                self.assertEqual(self.__annotatedImages(reopened), expected)
+                reopened.releaseShards()
+
+    def testFailedConversionKeepsFormat(self) -> None:
+        """ A conversion that fails part way leaves the project as it was, still saving to sqlite """
+        with mock.patch.object(Project, "writeModels", side_effect=OSError("disk full")):
+            with self.assertRaises(OSError):
+                self.project.convertStorageFormat(StorageFormats.numpy)
+        self.assertIs(self.project.storageFormat, StorageFormats.sqlite)
+        self.assertIsNotNone(self.project.database)
+        self.assertFalse(os.path.exists(self.projectDir + "/annotations"))
+
+        self.__addBox(10)
+        self.project.writeSnapshot(self.project.takeDirtySnapshot())
+        reopened = Project()
+        reopened.loadProject(self.projectDir)
+        self.assertIs(reopened.storageFormat, StorageFormats.sqlite)
+        self.assertEqual(self.__annotatedImages(reopened), sorted(ANNOTATED_IMAGES + (10,)))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -21,12 +21,15 @@ from pages.machineLearningPage import MachineLearningPage
 from dialogs.infoDialog import InfoDialog
 from utils.switch import Switch
 from notificationManager import NotificationManager
+from autosaveManager import AutosaveManager
+from recentProjects import RecentProjects
 
 from events.hoverEvent import HoverEvent
 
 from theme import *
 
 app = None
+window = None
 
 class Pages(Enum):
     """ Enum to represent the pages within the application"""
@@ -62,6 +65,12 @@ class YoloAnt(QMainWindow):
         # Starting the notification manager
         self.notificationManager = NotificationManager(self)
 
+        # Index of recently used projects shown on the start page
+        self.recentProjects = RecentProjects()
+
+        # Starting the autosave manager
+        self.autosaveManager = AutosaveManager(self)
+
         # Connecting signals and slots for the application
         self.__connectNavigationButtons()
         self.__connectIconHover()
@@ -104,12 +113,18 @@ class YoloAnt(QMainWindow):
 
     def closeEvent(self, event) -> None:
         """ Overrides the close event on the main window """
-        # Save annotations
+        # Finish any edit still in progress, line edits only commit their text once they lose focus
+        focusWidget = QApplication.focusWidget()
+        if focusWidget:
+            focusWidget.clearFocus()
+        # Save anything changed since the last autosave, stopping flushes whatever the project reports as dirty
+        self.autosaveManager.stop()
         if self.project:
-            self.project.writeProject()
-            self.project.writeClasses()
-            self.project.writeModels()
-            self.project.writeAnnotations()
+            self.project.releaseShards()
+        # the background metadata job is left unfinished, images it did not reach are probed next time
+        if self.startPage.metadataPrecomputer:
+            self.startPage.metadataPrecomputer.stop()
+            self.startPage.metadataPrecomputer.wait()
 
         # Ensure all notifications are closed
         self.notificationManager.closeNotifications()
@@ -272,7 +287,13 @@ class YoloAnt(QMainWindow):
 def signal_handler(sig, frame) -> None:
     """ Handles unix signals """
     # At the moment we are just worried about sigint and sigterm and both signals are handled the same
-    global app
+    global app, window
+    # Make sure nothing that has been edited is lost
+    if window:
+        window.autosaveManager.flush()
+        # leases left behind would keep other annotators off these shards until they time out
+        if window.project:
+            window.project.releaseShards()
     app.exit(-1)  # Any non-typical exit is an error -1 
 
 
@@ -289,7 +310,13 @@ def main() -> None:
     global app  # Using a global reference for the signal handling - might be something better here
     app = QApplication(sys.argv)
 
-    YoloAnt()
+    global window
+    window = YoloAnt()
+
+    # Python only runs signal handlers between its own bytecodes, the timer hands it control while Qt is idle
+    signalTimer = QtCore.QTimer()
+    signalTimer.timeout.connect(lambda: None)
+    signalTimer.start(500)
 
     sys.exit(app.exec())
 